@@ -140,6 +140,128 @@ class Qual(object):
         return hash((self.field_name, self.operator, self.value))
 
 
+class KeySetQual(Qual):
+    """A KeySetQual is a :class:`Qual` of the form::
+
+        mycolumn = ANY(ARRAY['a', 'b', 'c'])
+
+    Such a qual usually holds the keys of a join partner, given by a batched
+    join (see the ``key_batch_size`` option), or with a clause like
+    ``mycolumn = ANY(ARRAY(SELECT key FROM other_table))``. Besides the
+    list of keys in its value, it offers them as a set, so that a foreign data
+    wrapper can drop the rows which cannot match before returning them.
+
+    Attributes:
+        keys (frozenset): The keys of the qual, NULL ones excluded, or None
+            if they cannot be hashed.
+    """
+
+    def __init__(self, field_name, operator, value):
+        super(KeySetQual, self).__init__(field_name, operator, value)
+        try:
+            self.keys = frozenset(key for key in value or ()
+                                  if key is not None)
+        except TypeError:
+            self.keys = None
+
+    def __contains__(self, key):
+        """Tests whether a value of the column can match one of the keys."""
+        if key is None:
+            return False
+        if self.keys is None:
+            return key in (self.value or ())
+        return key in self.keys
+
+
+class BoolQual(object):
+    """A BoolQual describes a boolean combination of qualifiers.
+
+    It represents a where clause of the type::
+
+        mycolumn = 3 OR othercolumn > 2
+        NOT (mycolumn = 3 AND othercolumn ~~ 'A%')
+
+    BoolQuals are only given to the ForeignDataWrapper whose ``_bool_quals``
+    attribute is true. They then appear in the quals list alongside the
+    :class:`Qual` instances. A boolean expression is only pushed down if
+    every part of it could be, so a BoolQual can be evaluated exactly.
+
+    Attributes:
+        operator (str): One of 'and', 'or' or 'not'.
+        quals (list): The combined :class:`Qual` or :class:`BoolQual`
+            instances. A 'not' BoolQual holds exactly one of them.
+    """
+
+    def __init__(self, operator, quals):
+        self.operator = operator
+        self.quals = quals
+
+    @property
+    def field_names(self):
+        """
+        Returns:
+            The set of the column names used by this expression.
+        """
+        names = set()
+        for qual in self.quals:
+            if isinstance(qual, BoolQual):
+                names.update(qual.field_names)
+            else:
+                names.add(qual.field_name)
+        return names
+
+    def __repr__(self):
+        if self.operator == 'not':
+            return "NOT %r" % self.quals[0]
+        return "(%s)" % (" %s " % self.operator.upper()).join(
+            repr(qual) for qual in self.quals)
+
+    def __eq__(self, other):
+        if isinstance(other, BoolQual):
+            return (self.operator == other.operator and
+                    self.quals == other.quals)
+        return False
+
+    def __hash__(self):
+        return hash((self.operator, tuple(self.quals)))
+
+
+class ColumnBlock(object):
+    """A ColumnBlock holds a block of rows, stored by column.
+
+    When the ``_batch_size`` attribute of a ForeignDataWrapper is greater than
+    zero, its execute method can yield ColumnBlocks instead of sequences of
+    rows.
+
+    Columns supporting the buffer protocol (``array.array``, numpy arrays,
+    memoryviews...) with integer, floating point or boolean items are read
+    directly by the C-extension, without building a python object for each
+    value. Any other column is read as a sequence of values, which are
+    converted like the values of a row.
+
+    Attributes:
+        columns (dict): A mapping of column names to their values. Columns
+            missing from this mapping are NULL.
+        nulls (dict): A mapping of column names to their null masks: a
+            sequence of booleans, or a buffer of bytes, with a true value for
+            every NULL row.
+        length (int): The number of rows in the block. It defaults to the
+            length of the first column.
+    """
+
+    __slots__ = ('columns', 'nulls', 'length')
+
+    def __init__(self, columns, nulls=None, length=None):
+        self.columns = columns
+        self.nulls = nulls or {}
+        if length is None:
+            length = len(next(iter(columns.values()))) if columns else 0
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+
 class ForeignDataWrapper(object):
     """Base class for all foreign data wrapper instances.
 
@@ -148,6 +270,9 @@ class ForeignDataWrapper(object):
     """
 
     _startup_cost = 20
+    _batch_size = 0
+    _modify_batch_size = 0
+    _bool_quals = False
 
     def __init__(self, fdw_options, fdw_columns):
         """The foreign data wrapper is initialized on the first query.
@@ -178,7 +303,14 @@ class ForeignDataWrapper(object):
             columns (list): The list of columns that must be returned.
 
         Returns:
-            A tuple of the form (expected_number_of_rows, avg_row_width (in bytes))
+            A tuple of the form (expected_number_of_rows, avg_row_width (in bytes)),
+            or of the form (expected_number_of_rows, avg_row_width,
+            startup_cost, per_row_cost) to describe the cost of the scan: the
+            cost of opening it before the first row is returned, and the cost
+            of fetching every row. The total cost of the scan is then
+            ``startup_cost + expected_number_of_rows * per_row_cost``.
+            Otherwise, the startup cost is the ``_startup_cost`` attribute,
+            and the cost of a row is its width.
         """
         return (100000000, len(columns) * 100)
 
@@ -208,6 +340,111 @@ class ForeignDataWrapper(object):
         """
         return []
 
+    def get_sort_cost(self, sortkeys):
+        """
+        Method called from the planner to estimate the additional cost of a
+        scan returning its rows sorted, for the sorts accepted by
+        :meth:`can_sort`.
+
+        Args:
+            sortkeys (list): A list of :class:`SortKey`, as returned by
+                :meth:`can_sort`.
+
+        Return:
+            None if sorting is free, or a tuple of the form (startup_cost,
+            per_row_cost) added to the cost of every sorted path.
+        """
+        return None
+
+    def can_limit(self, limit):
+        """
+        Method called from the planner to ask the FDW whether it can stop
+        returning rows after the first ``limit`` ones, for queries with a
+        LIMIT clause.
+
+        The limit is only offered for queries on a single foreign table,
+        without grouping nor aggregates, and whose where clauses are all
+        enforced by the FDW, see :meth:`can_enforce`. If the query has an
+        ORDER BY clause, the FDW must also accept every sort in
+        :meth:`can_sort`.
+
+        Args:
+            limit (int): the number of rows the query needs, that is its
+                LIMIT plus its OFFSET. PostgreSQL still skips the OFFSET
+                rows itself.
+
+        Return:
+            True if the FDW accepts a ``limit`` keyword argument in
+            :meth:`execute`, and can use it.
+        """
+        return False
+
+    def can_enforce(self, quals):
+        """
+        Method called from the planner to ask the FDW which quals it enforces
+        exactly. PostgreSQL does not recheck the where clauses of those quals
+        on the returned rows, and does not account for their cost.
+
+        Only the quals whose value is known at planning time are offered.
+        An enforced qual MUST be applied by :meth:`execute` on every scan:
+        a row not matching it would otherwise be returned by the query.
+
+        Args:
+            quals (list): A list of :class:`Qual` instances, and of
+                :class:`BoolQual` instances if the ``_bool_quals`` attribute
+                is true.
+
+        Return:
+            The list of the quals the FDW enforces.
+        """
+        return []
+
+    def sample_rows(self, target):
+        """
+        Method called by ANALYZE to collect statistics about the foreign
+        table. Those statistics are then used by the planner instead of
+        :meth:`get_rel_size`.
+
+        A foreign table can only be analyzed if the FDW overrides this
+        method. The :func:`multicorn.utils.reservoir_sample` function can
+        help sampling rows from an iterable.
+
+        Args:
+            target (int): the number of rows PostgreSQL wants in the sample.
+
+        Return:
+            A tuple of the form (rows, total_rows), where rows is an iterable
+            of at most ``target`` rows picked at random, in the same format
+            as the ones returned by :meth:`execute`, and total_rows the
+            estimated number of rows in the table.
+        """
+        raise NotImplementedError("This FDW does not support ANALYZE")
+
+    def can_join(self, join_type, clauses, outer, inner):
+        """
+        Method called from the planner to ask the FDW whether it can join
+        two foreign tables itself, instead of returning the rows of both
+        tables to PostgreSQL.
+
+        This is only asked, on PostgreSQL >= 9.5, to the FDW of the outer
+        table, for joins between two foreign tables of the same server
+        whose join clauses all compare a column of each table. The quals
+        of the tables are rechecked on the joined rows, but the join
+        clauses must be enforced.
+
+        Args:
+            join_type (str): 'inner' or 'left'.
+            clauses (list): A list of (outer_column, operator, inner_column)
+                tuples, such as ``('id', '=', 'parent_id')``.
+            outer (ForeignDataWrapper): The FDW of the outer table, that is
+                self.
+            inner (ForeignDataWrapper): The FDW of the inner table.
+
+        Return:
+            True if the FDW can compute the join in :meth:`execute_join`.
+        """
+        return False
+
     def get_path_keys(self):
         u"""
         Method called from the planner to add additional Path to the planner.
@@ -262,28 +499,36 @@ class ForeignDataWrapper(object):
 
                 [(('id',), 1)]
 
+            The tuples can also be of the form (key_columns, expected_rows,
+            startup_cost, total_cost), to give the cost of a lookup instead
+            of deriving it from the costs returned by :meth:`get_rel_size`.
+
         """
         return []
 
-    def explain(self, quals, columns, sortkeys=None, verbose=False):
+    def explain(self, quals, columns, sortkeys=None, verbose=False,
+                limit=None, join_type=None, clauses=None, inner=None,
+                inner_quals=None, inner_columns=None):
         """Hook called on explain.
 
         The arguments are the same as the :meth:`execute`, with the addition of
         a "verbose" keyword arg for when the EXPLAIN is called with the VERBOSE
-        option.
+        option. For joined scans, the arguments of :meth:`execute_join` are
+        given instead.
         Returns:
             An iterable of strings to display in the EXPLAIN output.
         """
         return []
 
-    def execute(self, quals, columns, sortkeys=None):
+    def execute(self, quals, columns, sortkeys=None, limit=None):
         """Execute a query in the foreign data wrapper.
 
         This method is called at the first iteration.
         This is where the actual remote query execution takes place. Multicorn
         makes no assumption about the particular behavior of a
         ForeignDataWrapper, and will NOT remove any qualifiers from the
-        PostgreSQL quals list. That means the quals will be rechecked anyway.
+        PostgreSQL quals list. That means the quals will be rechecked anyway,
+        unless the FDW declared them as enforced in :meth:`can_enforce`.
 
         Typically, an implementation would:
 
@@ -302,13 +547,18 @@ class ForeignDataWrapper(object):
 
         Args:
             quals (list): A list of :class:`Qual` instances, containing the basic
-                where clauses in the query.
+                where clauses in the query. If the ``_bool_quals`` attribute
+                is true, it also contains :class:`BoolQual` instances for the
+                OR, NOT and nested AND clauses.
             columns (list):  A list of columns that postgresql is going to need.
                 You should return AT LEAST those columns when returning a
                 dict. If returning a sequence, every column from the table
                 should be in the sequence.
             sortkeys (list): A list of :class:`SortKey`
                 that the FDW said it can enforce.
+            limit (int): The maximum number of rows the query needs, if
+                the FDW accepted it in :meth:`can_limit`. Rows past this
+                limit are never fetched.
 
         Returns:
             An iterable of python objects which can be converted back to PostgreSQL.
@@ -319,9 +569,76 @@ class ForeignDataWrapper(object):
             If the sortkeys wasn't empty, the FDW has to return the data in the
             expected order.
 
+            If the ``_batch_size`` attribute is greater than zero, the
+            iterable must instead yield blocks of rows: lists or tuples
+            containing up to ``_batch_size`` of the objects described above.
+            Each block is then consumed by the C-extension without going back
+            to python, which greatly reduces the per-row overhead on large
+            scans.
+
+            A block can also be a :class:`ColumnBlock`, holding the rows
+            by column, or a ``pyarrow.RecordBatch`` or ``pyarrow.Table``.
+            Arrow columns are matched to the table columns by name, and
+            their integer, floating point, boolean, string, binary, date
+            and timestamp values (including dictionary-encoded ones) are
+            read without building python objects. Timestamps with a
+            timezone are converted as instants, naive ones as local times.
+            Other columns are converted through ``to_pylist``.
+
         """
         pass
 
+    def rescan(self, changed_quals):
+        """
+        Method called when a scan is restarted, for example for every row of
+        the outer relation of a nested loop. The quals of the scan are the
+        ones given to the last call of :meth:`execute`, except for the
+        ``changed_quals``, whose values depend on parameters and changed
+        since then.
+
+        Implementing this method lets the FDW keep its cursors or prepared
+        statements open between executions, instead of starting over in
+        :meth:`execute`.
+
+        Args:
+            changed_quals (list): the :class:`Qual` instances which changed
+                since the last execution. They replace the quals of the
+                same columns with the same operators.
+
+        Return:
+            An iterable of rows, in the same format as the one returned by
+            :meth:`execute`, or None to have :meth:`execute` called again with
+            every qual.
+        """
+        return None
+
+    def execute_join(self, quals, columns, join_type, clauses, inner,
+                     inner_quals, inner_columns):
+        """
+        Execute a query joining this table with the inner table, as accepted
+        by :meth:`can_join`.
+
+        Args:
+            quals (list): A list of :class:`Qual` instances on this table.
+            columns (list): The ordered list of the columns of this table
+                that postgresql is going to need.
+            join_type (str): 'inner' or 'left'.
+            clauses (list): A list of (outer_column, operator, inner_column)
+                tuples, as given to :meth:`can_join`.
+            inner (ForeignDataWrapper): The FDW of the inner table.
+            inner_quals (list): A list of :class:`Qual` instances on the
+                inner table.
+            inner_columns (list): The ordered list of the columns of the
+                inner table that postgresql is going to need.
+
+        Returns:
+            An iterable of sequences, one per joined row, containing the
+            values of ``columns`` followed by the values of
+            ``inner_columns``, in order. For left joins, the values of the
+            inner table are None for the rows without match.
+        """
+        raise NotImplementedError("This FDW does not support joins")
+
     @property
     def rowid_column(self):
         """
@@ -351,6 +668,32 @@ class ForeignDataWrapper(object):
         """
         raise NotImplementedError("This FDW does not support the writable API")
 
+    def bulk_insert(self, rows):
+        """
+        Insert several tuples in the foreign table.
+
+        This method is used instead of :meth:`insert` when the
+        ``_modify_batch_size`` attribute is greater than one: inserted rows
+        are buffered, and given to this method by batches of up to
+        ``_modify_batch_size`` rows. The remaining rows are flushed before
+        :meth:`end_modify` is called.
+
+        Rows are not buffered when the inserted values must be known
+        immediately, that is when the statement has a RETURNING clause, or
+        when the foreign table has AFTER ROW triggers or WITH CHECK
+        OPTION constraints: :meth:`insert` is then called for each row.
+
+        The default implementation calls :meth:`insert` for each row.
+
+        Args:
+            rows (list): a list of dictionaries mapping column names to
+                column values
+        Returns:
+            None
+        """
+        for values in rows:
+            self.insert(values)
+
     def update(self, oldvalues, newvalues):
         """
         Update a tuple containing ''oldvalues'' to the ''newvalues''.
@@ -366,6 +709,25 @@ class ForeignDataWrapper(object):
         """
         raise NotImplementedError("This FDW does not support the writable API")
 
+    def bulk_update(self, pairs):
+        """
+        Update several tuples.
+
+        Like :meth:`bulk_insert`, this method is used instead of
+        :meth:`update` when the ``_modify_batch_size`` attribute is greater
+        than one, under the same conditions.
+
+        The default implementation calls :meth:`update` for each pair.
+
+        Args:
+            pairs (list): a list of (oldvalues, newvalues) tuples, as
+                given to :meth:`update`
+        Returns:
+            None
+        """
+        for oldvalues, newvalues in pairs:
+            self.update(oldvalues, newvalues)
+
     def delete(self, oldvalues):
         """
         Delete a tuple identified by ``oldvalues``
@@ -378,6 +740,25 @@ class ForeignDataWrapper(object):
         """
         raise NotImplementedError("This FDW does not support the writable API")
 
+    def bulk_delete(self, rowids):
+        """
+        Delete several tuples.
+
+        Like :meth:`bulk_insert`, this method is used instead of
+        :meth:`delete` when the ``_modify_batch_size`` attribute is greater
+        than one, under the same conditions.
+
+        The default implementation calls :meth:`delete` for each row.
+
+        Args:
+            rowids (list): a list of ``oldvalues``, as given to
+                :meth:`delete`
+        Returns:
+            None
+        """
+        for oldvalues in rowids:
+            self.delete(oldvalues)
+
     def pre_commit(self):
         """
         Hook called just before a commit is issued, on PostgreSQL >=9.3.
@@ -7,6 +7,12 @@ in the table will be mapped, in order, against columns in the CSV file.
 
 .. api_compat:: :read:
 
+The table can be analyzed: ANALYZE reads the whole file to sample its lines.
+
+Lines whose text columns cannot match a ``column = ANY(...)`` restriction, for
+example ``make = ANY(ARRAY(SELECT make FROM local_makes))``, are dropped before
+being returned to PostgreSQL.
+
 .. _CSV files: http://en.wikipedia.org/wiki/Comma-separated_values
 
 Dependencies
@@ -72,8 +78,9 @@ You can declare the following table:
 """
 
 
-from . import ForeignDataWrapper
-from .utils import log_to_postgres
+from . import ForeignDataWrapper, KeySetQual
+from .compat import unicode_
+from .utils import log_to_postgres, reservoir_sample
 from logging import WARNING
 import csv
 
@@ -96,7 +103,22 @@ class CsvFdw(ForeignDataWrapper):
         self.skip_header = int(fdw_options.get('skip_header', 0))
         self.columns = fdw_columns
 
+    def _key_filters(self, quals):
+        """Returns the (position, qual) pairs of the key sets which can be
+        tested against the raw values of the lines: only text columns, whose
+        values are not converted, can be compared to the keys."""
+        if unicode_ is not str:
+            # Python 2 reads bytes, which cannot be compared to the keys
+            return []
+        positions = dict((name, position) for position, name
+                         in enumerate(self.columns))
+        return [(positions[qual.field_name], qual) for qual in quals
+                if isinstance(qual, KeySetQual) and
+                self.columns[qual.field_name].base_type_name in
+                ('text', 'character varying')]
+
     def execute(self, quals, columns):
+        filters = self._key_filters(quals)
         with open(self.filename) as stream:
             reader = csv.reader(stream, delimiter=self.delimiter)
             count = 0
@@ -113,5 +135,10 @@ class CsvFdw(ForeignDataWrapper):
                         if len(line) < len(self.columns):
                             log_to_postgres("There are less columns than "
                                             "defined in the table", WARNING)
-                    yield line[:len(self.columns)]
+                    if all(position < len(line) and line[position] in qual
+                           for position, qual in filters):
+                        yield line[:len(self.columns)]
                 count += 1
+
+    def sample_rows(self, target):
+        return reservoir_sample(self.execute([], list(self.columns)), target)
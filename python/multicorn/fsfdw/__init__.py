@@ -107,7 +107,7 @@ https://github.com/Kozea/StructuredFS.
 
 from multicorn import TransactionAwareForeignDataWrapper
 from multicorn.fsfdw.structuredfs import StructuredDirectory
-from multicorn.utils import log_to_postgres
+from multicorn.utils import log_to_postgres, reservoir_sample
 from multicorn.compat import unicode_
 from logging import ERROR, WARNING
 import os
@@ -240,6 +240,16 @@ class FilesystemFdw(TransactionAwareForeignDataWrapper):
             (qual.field_name, unicode_(qual.value)) for qual in quals
             if qual.operator == '=' and qual.field_name in properties))
 
+    def sample_rows(self, target):
+        """Sample the files matched by the pattern.
+
+        Only the sampled files are read, if the content column is defined.
+        """
+        items = (item for item in self.get_items([], self.columns)
+                 if item.full_filename not in self.invisible_files)
+        sample, count = reservoir_sample(items, target)
+        return (list(self.items_to_dicts(sample, list(self.columns))), count)
+
     def items_to_dicts(self, items, columns):
         content_column = self.content_column
         filename_column = self.filename_column
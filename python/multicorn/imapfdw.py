@@ -59,6 +59,7 @@ The imap fdw tries its best to convert postgresql quals into imap filters.
 The following quals are pushed to the server:
     - equal, not equal, like, not like comparison
     - = ANY, = NOT ANY
+    - OR and nested AND combinations of the above
 
 ntThese conditions are matched against the headers, or the body itself.
 
@@ -67,7 +68,7 @@ requesting the payload_column if you don't need it.
 """
 
 
-from . import ForeignDataWrapper, ANY, ALL
+from . import ForeignDataWrapper, BoolQual, ANY, ALL
 from .utils import log_to_postgres, ERROR, WARNING
 
 from imaplib import IMAP4
@@ -136,6 +137,8 @@ class ImapFdw(ForeignDataWrapper):
     """An imap foreign data wrapper
     """
 
+    _bool_quals = True
+
     def __init__(self, options, columns):
         super(ImapFdw, self).__init__(options, columns)
         self._imap_agent = None
@@ -164,6 +167,8 @@ class ImapFdw(ForeignDataWrapper):
             width += 100000000000
         nb_rows = nb_rows / (10 ** len(quals))
         for qual in quals:
+            if isinstance(qual, BoolQual):
+                continue
             if qual.field_name.lower() == 'in-reply-to' and\
                     qual.operator == '=':
                 nb_rows = 10
@@ -247,10 +252,46 @@ class ImapFdw(ForeignDataWrapper):
             value = '%s "%s"' % (key, value)
         return '%s%s' % (prefix, value)
 
+    def _tree_condition(self, qual):
+        """Build an imap search criteria string from a qual or a BoolQual,
+        or None if it cannot be expressed exactly."""
+        if isinstance(qual, BoolQual):
+            if qual.operator == 'not':
+                # Imap searches are case-insensitive substring matches: their
+                # negation would drop rows matching the original expression
+                return None
+            conditions = [self._tree_condition(subqual)
+                          for subqual in qual.quals]
+            if None in conditions:
+                return None
+            if qual.operator == 'or':
+                return make_or(conditions)
+            return '(%s)' % ' '.join(conditions)
+        if qual.is_list_operator:
+            conditions = [self._make_condition(qual.field_name,
+                                               qual.operator[0], value)
+                          for value in qual.value]
+        else:
+            conditions = [self._make_condition(qual.field_name,
+                                               qual.operator, qual.value)]
+        if not conditions or not all(conditions):
+            return None
+        conditions = ['(%s)' % condition for condition in conditions]
+        if qual.list_any_or_all == ANY:
+            return make_or(conditions)
+        return '(%s)' % ' '.join(conditions)
+
     def extract_conditions(self, quals):
         """Build an imap search criteria string from a list of quals"""
         conditions = []
         for qual in quals:
+            if isinstance(qual, BoolQual):
+                try:
+                    conditions.append(self._tree_condition(qual))
+                except NoMatchPossible:
+                    # Only a part of the expression can never match
+                    pass
+                continue
             # Its a list, so we must translate ANY to OR, and ALL to AND
             if qual.list_any_or_all == ANY:
                 values = [
@@ -81,7 +81,7 @@ definition:
 
 """
 
-from . import ForeignDataWrapper
+from . import ForeignDataWrapper, BoolQual
 
 import ldap3
 from multicorn.utils import log_to_postgres, ERROR
@@ -97,6 +97,13 @@ SPECIAL_CHARS = {
     ord('/'): '\\2f'
 }
 
+# Ldap matching rules are not exact (case-insensitive, wildcards), so the
+# negation of a filter cannot be pushed: it would drop matching rows
+BOOL_OPERATORS = {
+    'and': '&',
+    'or': '|'
+}
+
 
 class LdapFdw(ForeignDataWrapper):
     """An Ldap Foreign Wrapper.
@@ -113,6 +120,8 @@ class LdapFdw(ForeignDataWrapper):
 
     """
 
+    _bool_quals = True
+
     def __init__(self, fdw_options, fdw_columns):
         super(LdapFdw, self).__init__(fdw_options, fdw_columns)
         if "address" in fdw_options:
@@ -134,22 +143,35 @@ class LdapFdw(ForeignDataWrapper):
             col.column_name for name, col in self.field_definitions.items()
             if col.type_name.endswith('[]')]
 
+    def _make_filter(self, qual):
+        """Build an ldap filter from a qual, or None if it cannot be."""
+        if isinstance(qual, BoolQual):
+            if qual.operator not in BOOL_OPERATORS:
+                return None
+            filters = [self._make_filter(subqual) for subqual in qual.quals]
+            if None in filters:
+                return None
+            return unicode_("(%s%s)") % (BOOL_OPERATORS[qual.operator],
+                                         "".join(filters))
+        if isinstance(qual.operator, tuple):
+            operator = qual.operator[0]
+        else:
+            operator = qual.operator
+        if operator not in ("=", "~~"):
+            return None
+        if hasattr(qual.value, "translate"):
+            baseval = qual.value.translate(SPECIAL_CHARS)
+            val = baseval.replace("%", "*") if operator == "~~" else baseval
+        else:
+            val = qual.value
+        return unicode_("(%s=%s)") % (qual.field_name, val)
+
     def execute(self, quals, columns):
         request = unicode_("(objectClass=%s)") % self.object_class
         for qual in quals:
-            if isinstance(qual.operator, tuple):
-                operator = qual.operator[0]
-            else:
-                operator = qual.operator
-            if operator in ("=", "~~"):
-                if hasattr(qual.value, "translate"):
-                    baseval = qual.value.translate(SPECIAL_CHARS)
-                    val = (baseval.replace("%", "*")
-                           if operator == "~~" else baseval)
-                else:
-                    val = qual.value
-                request = unicode_("(&%s(%s=%s))") % (
-                    request, qual.field_name, val)
+            qual_filter = self._make_filter(qual)
+            if qual_filter is not None:
+                request = unicode_("(&%s%s)") % (request, qual_filter)
         self.ldap.search(
             self.path, request, self.scope,
             attributes=list(self.field_definitions))
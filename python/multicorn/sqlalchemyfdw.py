@@ -73,6 +73,11 @@ Other options
 ``schema``
   The schema in which this table resides on the remote side
 
+``batch_size``
+  (optional) The number of rows sent to the remote database in a single
+  statement by INSERT, UPDATE and DELETE operations. Defaults to 1, which
+  sends one statement per row.
+
 When defining the table, the local column names will be used to retrieve the
 remote column data.
 Moreover, the local column types will be used to interpret the results in the
@@ -91,8 +96,22 @@ What does it do to reduce the amount of fetched data ?
     - like, ilike and their negations
     - IN clauses with scalars, = ANY (array)
     - NOT IN clauses, != ALL (array)
+    - OR, NOT and nested AND combinations of the above
 - the set of needed columns is pushed to the remote_side, and only those columns
   will be fetched.
+- equality and range comparisons, and IN clauses, are not rechecked by
+  postgresql. On remote databases other than postgresql, only comparisons
+  with integers and booleans are trusted, since strings, floating point
+  numbers and dates may be compared differently there. On a postgresql remote
+  database, strings are only trusted for equality, inequality and IN clauses,
+  since their ordering depends on the collation of the remote database.
+- LIMIT clauses are pushed to the remote database, when every filter of the
+  query is enforced by the remote database.
+- on PostgreSQL >= 9.5, inner and left joins between two tables of the same
+  remote database are computed by the remote database, when their join
+  clauses can be trusted like the comparisons above.
+- ANALYZE counts the rows of the remote table, and samples them in random
+  order on the remote database, if it has a known random function.
 
 Sort push-down support
 ----------------------
@@ -150,11 +169,14 @@ such as pymysql):
 
 """
 
-from . import ForeignDataWrapper, TableDefinition, ColumnDefinition
-from .utils import log_to_postgres, ERROR, WARNING, DEBUG
+from . import ForeignDataWrapper, TableDefinition, ColumnDefinition, BoolQual
+from .utils import (log_to_postgres, reservoir_sample, ERROR, WARNING,
+                    DEBUG)
+from .compat import basestring_
 from sqlalchemy import create_engine
 from sqlalchemy.engine.url import make_url, URL
-from sqlalchemy.sql import select, operators as sqlops, and_
+from sqlalchemy.sql import (select, operators as sqlops, and_, or_,
+                            bindparam, func)
 from sqlalchemy.sql.expression import nullsfirst, nullslast
 
 # Handle the sqlalchemy 0.8 / 0.9 changes
@@ -168,6 +190,7 @@ from sqlalchemy.dialects.oracle import base as oracle_dialect
 from sqlalchemy.dialects.postgresql.base import (
     ARRAY, ischema_names, PGDialect, NUMERIC)
 import re
+import numbers
 import operator
 
 
@@ -216,6 +239,22 @@ OPERATORS = {
     ('<>', False): not_(sqlops.in_op)
 }
 
+# Operators with the same semantics in every database, which are not
+# rechecked by postgresql
+ENFORCED_OPERATORS = ('=', '<', '>', '<=', '>=', '<>', ('=', True))
+
+# Operators which do not depend on the ordering of the values
+EQUALITY_OPERATORS = ('=', '<>', ('=', True))
+
+# Functions returning a random value, to sample the rows of a remote table
+RANDOM_FUNCTIONS = {
+    'postgresql': func.random,
+    'sqlite': func.random,
+    'mysql': func.rand,
+    'mssql': func.newid,
+    'oracle': func.dbms_random.value
+}
+
 CONVERSION_MAP = {
     oracle_dialect.NUMBER: NUMERIC
 }
@@ -240,9 +279,12 @@ class SqlAlchemyFdw(ForeignDataWrapper):
     db_url      --  the sqlalchemy connection string.
     schema      --  (optional) schema name to qualify table name with
     tablename   --  the table name in the remote database.
+    batch_size  --  (optional) number of rows modified per remote statement.
 
     """
 
+    _bool_quals = True
+
     def __init__(self, fdw_options, fdw_columns):
         super(SqlAlchemyFdw, self).__init__(fdw_options, fdw_columns)
         if 'tablename' not in fdw_options:
@@ -261,6 +303,7 @@ class SqlAlchemyFdw(ForeignDataWrapper):
         self.transaction = None
         self._connection = None
         self._row_id_column = fdw_options.get('primary_key', None)
+        self._modify_batch_size = int(fdw_options.get('batch_size', 1))
 
 
 
@@ -291,22 +334,111 @@ class SqlAlchemyFdw(ForeignDataWrapper):
             return []
         return sortkeys
 
-    def explain(self, quals, columns, sortkeys=None, verbose=False):
+    def can_limit(self, limit):
+        return True
+
+    def _is_enforced(self, qual):
+        if isinstance(qual, BoolQual):
+            return all(self._is_enforced(subqual) for subqual in qual.quals)
+        if qual.operator not in ENFORCED_OPERATORS:
+            return False
+        values = qual.value if qual.is_list_operator else [qual.value]
+        if self.engine.dialect.name != 'postgresql':
+            # Other databases may compare strings with another collation, and
+            # floats, decimals and dates with another precision or time zone
+            return all(isinstance(value, numbers.Integral)
+                       for value in values)
+        # The remote database may sort strings with another collation
+        return (qual.operator in EQUALITY_OPERATORS or
+                not any(isinstance(value, basestring_) for value in values))
+
+    def can_enforce(self, quals):
+        return [qual for qual in quals if self._is_enforced(qual)]
+
+    def _is_enforced_join_clause(self, outer_column, operator, inner,
+                                 inner_column):
+        if operator not in ENFORCED_OPERATORS:
+            return False
+        types = (self.table.c[outer_column].type,
+                 inner.table.c[inner_column].type)
+        if self.engine.dialect.name != 'postgresql':
+            # Same restriction as the quals, see _is_enforced
+            return all(isinstance(type_, (sqltypes.Integer, sqltypes.Boolean))
+                       for type_ in types)
+        return (operator in EQUALITY_OPERATORS or
+                not any(isinstance(type_, sqltypes.String)
+                        for type_ in types))
+
+    def can_join(self, join_type, clauses, outer, inner):
+        # Both tables must live in the same remote database, and the join
+        # clauses are not rechecked by postgresql
+        return (isinstance(inner, SqlAlchemyFdw) and
+                str(inner.engine.url) == str(self.engine.url) and
+                all(self._is_enforced_join_clause(outer_column, operator,
+                                                  inner, inner_column)
+                    for outer_column, operator, inner_column in clauses))
+
+    def explain(self, quals, columns, sortkeys=None, verbose=False,
+                limit=None, join_type=None, clauses=None, inner=None,
+                inner_quals=None, inner_columns=None):
         sortkeys = sortkeys or []
-        statement = self._build_statement(quals, columns, sortkeys)
+        if join_type is not None:
+            statement = self._build_join_statement(
+                quals, columns, join_type, clauses, inner, inner_quals,
+                inner_columns)
+        else:
+            statement = self._build_statement(quals, columns, sortkeys,
+                                              limit)
         return [str(statement)]
 
-    def _build_statement(self, quals, columns, sortkeys):
-        statement = select([self.table])
+    def _build_join_statement(self, quals, columns, join_type, clauses, inner,
+                              inner_quals, inner_columns):
+        # Alias both tables, which may be the same remote table
+        outer_table = self.table.alias()
+        inner_table = inner.table.alias()
+        onclause = and_(*[OPERATORS[operator](outer_table.c[outer_column],
+                                              inner_table.c[inner_column])
+                          for outer_column, operator, inner_column
+                          in clauses])
+        join = outer_table.join(inner_table, onclause,
+                                isouter=join_type == 'left')
+        values = ([outer_table.c[column] for column in columns] +
+                  [inner_table.c[column] for column in inner_columns])
+        statement = select(values or [outer_table]).select_from(join)
+        where = (self._qual_clauses(outer_table, quals) +
+                 inner._qual_clauses(inner_table, inner_quals))
+        if where:
+            statement = statement.where(and_(*where))
+        return statement
+
+    def _qual_clause(self, table, qual):
+        if isinstance(qual, BoolQual):
+            clauses = [self._qual_clause(table, subqual)
+                       for subqual in qual.quals]
+            if None in clauses:
+                return None
+            if qual.operator == 'not':
+                return ~clauses[0]
+            return (or_ if qual.operator == 'or' else and_)(*clauses)
+        operator = OPERATORS.get(qual.operator, None)
+        if operator:
+            return operator(table.c[qual.field_name], qual.value)
+        return None
+
+    def _qual_clauses(self, table, quals):
         clauses = []
         for qual in quals:
-            operator = OPERATORS.get(qual.operator, None)
-            if operator:
-                clauses.append(operator(self.table.c[qual.field_name],
-                                        qual.value))
+            clause = self._qual_clause(table, qual)
+            if clause is not None:
+                clauses.append(clause)
             else:
                 log_to_postgres('Qual not pushed to foreign db: %s' % qual,
                                 WARNING)
+        return clauses
+
+    def _build_statement(self, quals, columns, sortkeys, limit=None):
+        statement = select([self.table])
+        clauses = self._qual_clauses(self.table, quals)
         if clauses:
             statement = statement.where(and_(*clauses))
         if columns:
@@ -325,15 +457,18 @@ class SqlAlchemyFdw(ForeignDataWrapper):
             if null_ordering:
                 column = null_ordering(column)
             statement = statement.order_by(column)
+        if limit is not None:
+            statement = statement.limit(limit)
         return statement
 
 
-    def execute(self, quals, columns, sortkeys=None):
+    def execute(self, quals, columns, sortkeys=None, limit=None):
         """
-        The quals are turned into an and'ed where clause.
+        The quals are turned into an and'ed where clause, and the limit
+        into a LIMIT clause.
         """
         sortkeys = sortkeys or []
-        statement = self._build_statement(quals, columns, sortkeys)
+        statement = self._build_statement(quals, columns, sortkeys, limit)
         log_to_postgres(str(statement), DEBUG)
         rs = (self.connection
               .execution_options(stream_results=True)
@@ -346,6 +481,46 @@ class SqlAlchemyFdw(ForeignDataWrapper):
         for item in rs:
             yield dict(item)
 
+    def sample_rows(self, target):
+        """
+        The rows are sampled by the remote database, when it has a known
+        random function. Otherwise, the whole table is fetched.
+        """
+        random = RANDOM_FUNCTIONS.get(self.engine.dialect.name)
+        if random is None:
+            statement = select([self.table])
+            log_to_postgres(str(statement), DEBUG)
+            rs = (self.connection
+                  .execution_options(stream_results=True)
+                  .execute(statement))
+            return reservoir_sample((dict(item) for item in rs), target)
+        count = select([func.count()]).select_from(self.table)
+        log_to_postgres(str(count), DEBUG)
+        total = self.connection.execute(count).scalar()
+        statement = (select([self.table])
+                     .order_by(random())
+                     .limit(target))
+        log_to_postgres(str(statement), DEBUG)
+        rows = [dict(item) for item in self.connection.execute(statement)]
+        return (rows, total)
+
+    def execute_join(self, quals, columns, join_type, clauses, inner,
+                     inner_quals, inner_columns):
+        """
+        The join is computed by the remote database, with the quals of
+        both tables turned into a where clause.
+        """
+        statement = self._build_join_statement(quals, columns, join_type,
+                                               clauses, inner, inner_quals,
+                                               inner_columns)
+        log_to_postgres(str(statement), DEBUG)
+        rs = (self.connection
+              .execution_options(stream_results=True)
+              .execute(statement))
+        width = len(columns) + len(inner_columns)
+        for item in rs:
+            yield tuple(item)[:width]
+
     @property
     def connection(self):
         if self._connection is None:
@@ -382,6 +557,9 @@ class SqlAlchemyFdw(ForeignDataWrapper):
     def insert(self, values):
         self.connection.execute(self.table.insert(values=values))
 
+    def bulk_insert(self, rows):
+        self.connection.execute(self.table.insert(), rows)
+
     def update(self, rowid, newvalues):
         self.connection.execute(
             self.table.update()
@@ -393,6 +571,22 @@ class SqlAlchemyFdw(ForeignDataWrapper):
             self.table.delete()
             .where(self.table.c[self._row_id_column] == rowid))
 
+    def bulk_update(self, pairs):
+        statement = (self.table.update()
+                     .where(self.table.c[self._row_id_column] ==
+                            bindparam('_multicorn_rowid')))
+        rows = []
+        for rowid, newvalues in pairs:
+            params = dict(newvalues)
+            params['_multicorn_rowid'] = rowid
+            rows.append(params)
+        self.connection.execute(statement, rows)
+
+    def bulk_delete(self, rowids):
+        self.connection.execute(
+            self.table.delete()
+            .where(self.table.c[self._row_id_column].in_(rowids)))
+
     def _get_column_type(self, format_type):
         """Blatant ripoff from PG_Dialect.get_column_info"""
         # strip (*) from character varying(5), timestamp(5)
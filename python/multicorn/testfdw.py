@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
-from multicorn import ForeignDataWrapper, TableDefinition, ColumnDefinition
+from multicorn import (ForeignDataWrapper, TableDefinition, ColumnDefinition,
+                       ColumnBlock, KeySetQual)
 from multicorn.compat import unicode_
-from .utils import log_to_postgres, WARNING, ERROR
-from itertools import cycle
+from .utils import log_to_postgres, reservoir_sample, WARNING, ERROR
+from itertools import cycle, islice
+from array import array
+from collections import namedtuple
 from datetime import datetime
 from operator import itemgetter
+import struct
 
 
 class TestForeignDataWrapper(ForeignDataWrapper):
@@ -18,6 +22,13 @@ class TestForeignDataWrapper(ForeignDataWrapper):
         self.tx_hook = options.get('tx_hook', False)
         self._row_id_column = options.get('row_id_column',
                                           list(self.columns.keys())[0])
+        if self.test_type in ('batch', 'columns', 'arrow', 'arrow_encoding',
+                              'arrow_overflow'):
+            self._batch_size = 7
+        elif self.test_type == 'bulk':
+            self._modify_batch_size = 2
+        elif self.test_type == 'bool':
+            self._bool_quals = True
         log_to_postgres(str(sorted(options.items())))
         log_to_postgres(str(sorted([(key, column.type_name) for key, column in
                                     columns.items()])))
@@ -31,12 +42,30 @@ class TestForeignDataWrapper(ForeignDataWrapper):
 
     def _as_generator(self, quals, columns):
         random_thing = cycle([1, 2, 3])
+        if self.test_type == 'namedtuple':
+            row_class = namedtuple('Row', list(self.columns))
         for index in range(20):
             if self.test_type == 'sequence':
                 line = []
                 for column_name in self.columns:
                     line.append('%s %s %s' % (column_name,
                                               next(random_thing), index))
+            elif self.test_type == 'namedtuple':
+                values = []
+                for column_name in self.columns:
+                    values.append('%s %s %s' % (column_name,
+                                                next(random_thing), index))
+                if index % 3 == 0:
+                    values[0] = None
+                line = row_class(*values)
+            elif self.test_type == 'sparse':
+                line = {}
+                for position, column_name in enumerate(self.columns):
+                    value = '%s %s %s' % (column_name,
+                                          next(random_thing), index)
+                    # Only keep the first column on odd lines
+                    if position == 0 or index % 2 == 0:
+                        line[column_name] = value
             else:
                 line = {}
                 for column_name, column in self.columns.items():
@@ -71,7 +100,53 @@ class TestForeignDataWrapper(ForeignDataWrapper):
                                                           index)
             yield line
 
-    def execute(self, quals, columns, sortkeys=None):
+    def _as_batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self._batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield tuple(batch)
+
+    def _as_column_blocks(self):
+        for start in range(0, 20, self._batch_size):
+            indexes = range(start, min(start + self._batch_size, 20))
+            columns = {}
+            nulls = {}
+            for column_name, column in self.columns.items():
+                if column.type_name in ('smallint', 'integer', 'bigint'):
+                    columns[column_name] = array('l', indexes)
+                else:
+                    columns[column_name] = ['%s %s' % (column_name, index)
+                                            for index in indexes]
+                    # Every fifth value is NULL
+                    nulls[column_name] = bytearray(
+                        [index % 5 == 0 for index in indexes])
+            yield ColumnBlock(columns, nulls)
+
+    def _as_arrow_batches(self):
+        # pyarrow is optional, it is only imported by the arrow tests
+        import pyarrow
+        text_column, timestamp_column = list(self.columns)
+        seconds = [index * 86400 for index in range(3)]
+        if self.test_type == 'arrow_overflow':
+            seconds[2] = 2 ** 62
+        if self.test_type == 'arrow_encoding':
+            # Strings built from raw buffers are not validated by pyarrow
+            strings = pyarrow.Array.from_buffers(
+                pyarrow.string(), 3,
+                [None, pyarrow.py_buffer(struct.pack('4i', 0, 2, 4, 6)),
+                 pyarrow.py_buffer(b'\xc3(' * 3)])
+        else:
+            strings = pyarrow.array([u'%s %s \xe9' % (text_column, index)
+                                     for index in range(3)])
+        timestamps = pyarrow.array(seconds, type=pyarrow.timestamp('s'))
+        yield pyarrow.RecordBatch.from_arrays([strings, timestamps],
+                                              [text_column, timestamp_column])
+
+    def execute(self, quals, columns, sortkeys=None, limit=None):
         sortkeys = sortkeys or []
         log_to_postgres(str(sorted(quals)))
         log_to_postgres(str(sorted(columns)))
@@ -79,10 +154,16 @@ class TestForeignDataWrapper(ForeignDataWrapper):
             log_to_postgres("requested sort(s): ")
             for k in sortkeys:
                 log_to_postgres(k)
+        if limit is not None:
+            log_to_postgres("requested limit: %s" % limit)
         if self.test_type == 'None':
             return None
         elif self.test_type == 'iter_none':
             return [None, None]
+        elif self.test_type == 'columns':
+            return self._as_column_blocks()
+        elif self.test_type in ('arrow', 'arrow_encoding', 'arrow_overflow'):
+            return self._as_arrow_batches()
         else:
             if (len(sortkeys) > 0):
                 # testfdw don't have tables with more than 2 fields, without
@@ -90,28 +171,98 @@ class TestForeignDataWrapper(ForeignDataWrapper):
                 # asked column
                 k = sortkeys[0];
                 res = self._as_generator(quals, columns)
-                if (self.test_type == 'sequence'):
-                    return sorted(res, key=itemgetter(k.attnum - 1),
-                                  reverse=k.is_reversed)
+                if self.test_type in ('sequence', 'namedtuple'):
+                    res = sorted(res, key=itemgetter(k.attnum - 1),
+                                 reverse=k.is_reversed)
                 else:
-                    return sorted(res, key=itemgetter(k.attname),
-                                  reverse=k.is_reversed)
-            return self._as_generator(quals, columns)
+                    res = sorted(res, key=itemgetter(k.attname),
+                                 reverse=k.is_reversed)
+            else:
+                res = self._as_generator(quals, columns)
+            if self.test_type == 'enforce':
+                res = (row for row in res
+                       if all(row[qual.field_name] == qual.value
+                              for qual in self.can_enforce(quals)))
+            elif self.test_type == 'keyset':
+                key_sets = [qual for qual in quals
+                            if isinstance(qual, KeySetQual)]
+                for qual in key_sets:
+                    log_to_postgres("KEY SET ON %s: %s" % (
+                        qual.field_name, ', '.join(sorted(qual.keys))))
+                res = (row for row in res
+                       if all(row[qual.field_name] in qual
+                              for qual in key_sets))
+            if limit is not None:
+                res = islice(res, limit)
+            if self.test_type == 'batch':
+                return self._as_batches(res)
+            return res
+
+    def rescan(self, changed_quals):
+        if self.test_type != 'rescan':
+            return None
+        log_to_postgres("RESCAN: %s" % changed_quals)
+        return self._as_generator(changed_quals, self.columns)
 
     def get_rel_size(self, quals, columns):
-        if self.test_type == 'planner':
+        if self.test_type in ('planner', 'rescan'):
             return (10000000, len(columns) * 10)
+        elif self.test_type == 'cost':
+            return (20, len(columns) * 10, 100, 0.5)
+        elif self.test_type == 'estimate':
+            log_to_postgres("ESTIMATING: %s, %s" % (quals, sorted(columns)))
         return (20, len(columns) * 10)
 
     def get_path_keys(self):
-        if self.test_type == 'planner':
+        if self.test_type in ('planner', 'rescan'):
             return [(('test1',), 1)]
+        elif self.test_type == 'cost':
+            return [(('test1',), 1, 5, 6)]
         return []
 
+    def sample_rows(self, target):
+        return reservoir_sample(self._as_generator([], self.columns), target)
+
     def can_sort(self, sortkeys):
         # assume sort pushdown ok for all cols, in any order, any collation
         return sortkeys
 
+    def get_sort_cost(self, sortkeys):
+        if self.test_type == 'cost':
+            return (50, 1)
+        return None
+
+    def can_limit(self, limit):
+        return self.test_type in ('limit', 'enforce')
+
+    def can_enforce(self, quals):
+        if self.test_type != 'enforce':
+            return []
+        return [qual for qual in quals if qual.operator == '=']
+
+    def can_join(self, join_type, clauses, outer, inner):
+        return (self.test_type == 'join' and
+                getattr(inner, 'test_type', None) == 'join' and
+                all(operator == '=' for _, operator, _ in clauses))
+
+    def execute_join(self, quals, columns, join_type, clauses, inner,
+                     inner_quals, inner_columns):
+        log_to_postgres("%s JOIN ON %s" % (join_type.upper(), clauses))
+        log_to_postgres("%s, %s" % (columns, inner_columns))
+        log_to_postgres("%s, %s" % (sorted(quals), sorted(inner_quals)))
+        inner_rows = list(inner._as_generator(inner_quals, inner_columns))
+        for row in self._as_generator(quals, columns):
+            values = [row[column] for column in columns]
+            matched = False
+            for inner_row in inner_rows:
+                if all(row[outer_column] == inner_row[inner_column]
+                       for outer_column, _, inner_column in clauses):
+                    matched = True
+                    yield values + [inner_row[column]
+                                    for column in inner_columns]
+            if not matched and join_type == 'left':
+                yield values + [None] * len(inner_columns)
+
     def update(self, rowid, newvalues):
         if self.test_type == 'nowrite':
             super(TestForeignDataWrapper, self).update(rowid, newvalues)
@@ -136,6 +287,17 @@ class TestForeignDataWrapper(ForeignDataWrapper):
                 values[key] = "INSERTED: %s" % values.get(key, None)
             return values
 
+    def bulk_insert(self, rows):
+        log_to_postgres("BULK INSERTING: %s" % [sorted(values.items())
+                                                for values in rows])
+
+    def bulk_update(self, pairs):
+        log_to_postgres("BULK UPDATING: %s" % [
+            (rowid, sorted(newvalues.items())) for rowid, newvalues in pairs])
+
+    def bulk_delete(self, rowids):
+        log_to_postgres("BULK DELETING: %s" % rowids)
+
     @property
     def rowid_column(self):
         return self._row_id_column
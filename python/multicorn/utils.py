@@ -1,4 +1,5 @@
 from logging import ERROR, INFO, DEBUG, WARNING, CRITICAL
+from random import randint
 try:
     from ._utils import _log_to_postgres
     from ._utils import check_interrupts
@@ -26,3 +27,22 @@ def log_to_postgres(message, level=INFO, hint=None, detail=None):
         raise KeyError("Not a valid log level")
     _log_to_postgres(message, code, hint=hint, detail=detail)
 
+
+def reservoir_sample(iterable, target):
+    """
+    Pick at most ``target`` items at random from an iterable, in a single pass.
+
+    Returns:
+        A tuple of the form (sample, count), where count is the number of items
+        in the iterable.
+    """
+    sample = []
+    count = 0
+    for count, item in enumerate(iterable, 1):
+        if count <= target:
+            sample.append(item)
+        else:
+            index = randint(0, count - 1)
+            if index < target:
+                sample[index] = item
+    return sample, count
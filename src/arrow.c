@@ -0,0 +1,701 @@
+/*-------------------------------------------------------------------------
+ *
+ * The Multicorn Foreign Data Wrapper allows you to fetch foreign data in
+ * Python in your PostgreSQL server.
+ *
+ * This module reads Apache Arrow record batches yielded by the execute
+ * method, through the Arrow C data interface. Values are read straight from
+ * the Arrow buffers, without building python objects.
+ *
+ * pyarrow is never imported by this module: if the wrapper did not import it,
+ * it cannot have yielded Arrow objects.
+ *
+ * This software is released under the postgresql licence
+ *
+ * author: Kozea
+ *
+ *
+ *-------------------------------------------------------------------------
+ */
+#include "multicorn.h"
+#include "mb/pg_wchar.h"
+#include "utils/date.h"
+#include "utils/datetime.h"
+#include "utils/memutils.h"
+#include "utils/timestamp.h"
+
+/*
+ * Structures of the Arrow C data interface, as defined by the specification.
+ * See https://arrow.apache.org/docs/format/CDataInterface.html
+ */
+#ifndef ARROW_C_DATA_INTERFACE
+#define ARROW_C_DATA_INTERFACE
+
+#define ARROW_FLAG_DICTIONARY_ORDERED 1
+#define ARROW_FLAG_NULLABLE 2
+#define ARROW_FLAG_MAP_KEYS_SORTED 4
+
+struct ArrowSchema
+{
+	const char *format;
+	const char *name;
+	const char *metadata;
+	int64_t		flags;
+	int64_t		n_children;
+	struct ArrowSchema **children;
+	struct ArrowSchema *dictionary;
+	void		(*release) (struct ArrowSchema *);
+	void	   *private_data;
+};
+
+struct ArrowArray
+{
+	int64_t		length;
+	int64_t		null_count;
+	int64_t		offset;
+	int64_t		n_buffers;
+	int64_t		n_children;
+	const void **buffers;
+	struct ArrowArray **children;
+	struct ArrowArray *dictionary;
+	void		(*release) (struct ArrowArray *);
+	void	   *private_data;
+};
+#endif   /* ARROW_C_DATA_INTERFACE */
+
+/* Physical types of the Arrow values read natively */
+typedef enum MulticornArrowType
+{
+	MC_ARROW_UNSUPPORTED,
+	MC_ARROW_INT,
+	MC_ARROW_UINT,
+	MC_ARROW_FLOAT,
+	MC_ARROW_BOOL,
+	MC_ARROW_STRING,
+	MC_ARROW_LARGE_STRING,
+	MC_ARROW_BINARY,
+	MC_ARROW_LARGE_BINARY,
+	MC_ARROW_DATE32,
+	MC_ARROW_DATE64,
+	MC_ARROW_TIMESTAMP
+}	MulticornArrowType;
+
+/* Type of the Arrow values, parsed from a format string */
+typedef struct MulticornArrowFormat
+{
+	MulticornArrowType type;
+	/* Width in bytes, for integers and floating point numbers */
+	int			width;
+	/* Unit of timestamps, as a number of units per second */
+	int64		units_per_sec;
+	/* Does the timestamp carry a timezone ? */
+	bool		has_tz;
+}	MulticornArrowFormat;
+
+/* One column of a record batch, matched to an attribute */
+struct MulticornArrowColumn
+{
+	struct ArrowArray *array;
+	/* Offset of the record batch itself */
+	int64		base_offset;
+	/* For dictionary-encoded columns, the indices format */
+	bool		is_dictionary;
+	MulticornArrowFormat index_format;
+	/* The values format, and the values array */
+	MulticornArrowFormat format;
+	struct ArrowArray *values;
+};
+
+/* Offset between the unix and the postgres epochs */
+#define MC_EPOCH_DIFF_DAYS (POSTGRES_EPOCH_JDATE - UNIX_EPOCH_JDATE)
+
+/* Range of valid timestamps, defined by PostgreSQL >= 9.6 */
+#ifndef IS_VALID_TIMESTAMP
+#ifdef HAVE_INT64_TIMESTAMP
+#define MIN_TIMESTAMP	INT64CONST(-211813488000000000)
+#define END_TIMESTAMP	INT64CONST(9223371331200000000)
+#else
+#define MIN_TIMESTAMP	-211813488000.0
+#define END_TIMESTAMP	185330760393600.0
+#endif
+#define IS_VALID_TIMESTAMP(t)  (MIN_TIMESTAMP <= (t) && (t) < END_TIMESTAMP)
+#endif
+
+
+static PyObject *
+getPyarrowClass(PyObject **cache, const char *classname)
+{
+	if (*cache == NULL)
+	{
+		/* Only look at pyarrow if it has already been imported */
+		PyObject   *p_module = PyDict_GetItemString(PyImport_GetModuleDict(),
+													"pyarrow");
+
+		if (p_module == NULL)
+		{
+			return NULL;
+		}
+		*cache = PyObject_GetAttrString(p_module, classname);
+		if (*cache == NULL)
+		{
+			PyErr_Clear();
+			return NULL;
+		}
+	}
+	return *cache;
+}
+
+bool
+isArrowRecordBatch(PyObject *p_block)
+{
+	static PyObject *p_class = NULL;
+	PyObject   *p_cls = getPyarrowClass(&p_class, "RecordBatch");
+
+	return p_cls != NULL && PyObject_TypeCheck(p_block, (PyTypeObject *) p_cls);
+}
+
+bool
+isArrowTable(PyObject *p_block)
+{
+	static PyObject *p_class = NULL;
+	PyObject   *p_cls = getPyarrowClass(&p_class, "Table");
+
+	return p_cls != NULL && PyObject_TypeCheck(p_block, (PyTypeObject *) p_cls);
+}
+
+/*
+ * Parse an Arrow format string. Unsupported types are reported as
+ * MC_ARROW_UNSUPPORTED, and converted through python instead.
+ */
+static void
+parseArrowFormat(const char *format, MulticornArrowFormat * result)
+{
+	memset(result, 0, sizeof(MulticornArrowFormat));
+	result->type = MC_ARROW_UNSUPPORTED;
+	if (format[0] == '\0')
+	{
+		return;
+	}
+	if (format[1] == '\0')
+	{
+		switch (format[0])
+		{
+			case 'c':
+			case 's':
+			case 'i':
+			case 'l':
+				result->type = MC_ARROW_INT;
+				break;
+			case 'C':
+			case 'S':
+			case 'I':
+			case 'L':
+				result->type = MC_ARROW_UINT;
+				break;
+			case 'f':
+			case 'g':
+				result->type = MC_ARROW_FLOAT;
+				break;
+			case 'b':
+				result->type = MC_ARROW_BOOL;
+				break;
+			case 'u':
+				result->type = MC_ARROW_STRING;
+				break;
+			case 'U':
+				result->type = MC_ARROW_LARGE_STRING;
+				break;
+			case 'z':
+				result->type = MC_ARROW_BINARY;
+				break;
+			case 'Z':
+				result->type = MC_ARROW_LARGE_BINARY;
+				break;
+		}
+		switch (format[0])
+		{
+			case 'c':
+			case 'C':
+				result->width = 1;
+				break;
+			case 's':
+			case 'S':
+				result->width = 2;
+				break;
+			case 'i':
+			case 'I':
+			case 'f':
+				result->width = 4;
+				break;
+			case 'l':
+			case 'L':
+			case 'g':
+				result->width = 8;
+				break;
+		}
+		return;
+	}
+	if (strcmp(format, "tdD") == 0)
+	{
+		result->type = MC_ARROW_DATE32;
+	}
+	else if (strcmp(format, "tdm") == 0)
+	{
+		result->type = MC_ARROW_DATE64;
+	}
+	else if (strncmp(format, "ts", 2) == 0 && format[2] != '\0' &&
+			 format[3] == ':')
+	{
+		result->type = MC_ARROW_TIMESTAMP;
+		result->has_tz = format[4] != '\0';
+		switch (format[2])
+		{
+			case 's':
+				result->units_per_sec = 1;
+				break;
+			case 'm':
+				result->units_per_sec = 1000;
+				break;
+			case 'u':
+				result->units_per_sec = 1000000;
+				break;
+			case 'n':
+				result->units_per_sec = 1000000000;
+				break;
+			default:
+				result->type = MC_ARROW_UNSUPPORTED;
+		}
+	}
+}
+
+/*
+ * Returns true if values of the given Arrow type can be stored natively in
+ * an attribute of the given type.
+ */
+static bool
+arrowTypeMatchesType(MulticornArrowType type, Oid typeoid)
+{
+	switch (type)
+	{
+		case MC_ARROW_INT:
+		case MC_ARROW_UINT:
+			return typeoid == INT2OID || typeoid == INT4OID ||
+				typeoid == INT8OID || typeoid == FLOAT4OID ||
+				typeoid == FLOAT8OID || typeoid == NUMERICOID;
+		case MC_ARROW_FLOAT:
+			return typeoid == FLOAT4OID || typeoid == FLOAT8OID ||
+				typeoid == NUMERICOID;
+		case MC_ARROW_BOOL:
+			return typeoid == BOOLOID;
+		case MC_ARROW_STRING:
+		case MC_ARROW_LARGE_STRING:
+			/* Any type can be read from its text representation */
+			return true;
+		case MC_ARROW_BINARY:
+		case MC_ARROW_LARGE_BINARY:
+			return typeoid == BYTEAOID;
+		case MC_ARROW_DATE32:
+		case MC_ARROW_DATE64:
+			return typeoid == DATEOID;
+		case MC_ARROW_TIMESTAMP:
+			return typeoid == TIMESTAMPOID || typeoid == TIMESTAMPTZOID;
+		default:
+			return false;
+	}
+}
+
+#define ARROW_BIT(buffer, i) \
+	((((const uint8 *) (buffer))[(i) >> 3] >> ((i) & 7)) & 1)
+
+static int64
+readArrowInteger(const MulticornArrowFormat * format, const void *buffer,
+				 int64 i, uint64 *uvalue)
+{
+	*uvalue = 0;
+	if (format->type == MC_ARROW_UINT)
+	{
+		switch (format->width)
+		{
+			case 1:
+				*uvalue = ((const uint8 *) buffer)[i];
+				break;
+			case 2:
+				*uvalue = ((const uint16 *) buffer)[i];
+				break;
+			case 4:
+				*uvalue = ((const uint32 *) buffer)[i];
+				break;
+			default:
+				*uvalue = ((const uint64 *) buffer)[i];
+				break;
+		}
+		return (int64) *uvalue;
+	}
+	switch (format->width)
+	{
+		case 1:
+			return ((const int8 *) buffer)[i];
+		case 2:
+			return ((const int16 *) buffer)[i];
+		case 4:
+			return ((const int32 *) buffer)[i];
+		default:
+			return ((const int64 *) buffer)[i];
+	}
+}
+
+/*
+ * Convert a timestamp from the unix epoch, in the given unit, to a postgres
+ * timestamp. Values outside of the postgres range are rejected.
+ */
+static Timestamp
+arrowTimestampToTimestamp(int64 value, int64 units_per_sec)
+{
+	Timestamp	result;
+
+#ifdef HAVE_INT64_TIMESTAMP
+	if (units_per_sec > USECS_PER_SEC)
+	{
+		value /= units_per_sec / USECS_PER_SEC;
+	}
+	else
+	{
+		int64		factor = USECS_PER_SEC / units_per_sec;
+
+		if (value > PG_INT64_MAX / factor || value < PG_INT64_MIN / factor)
+		{
+			ereport(ERROR,
+					(errcode(ERRCODE_DATETIME_VALUE_OUT_OF_RANGE),
+					 errmsg("timestamp out of range")));
+		}
+		value *= factor;
+	}
+	if (value < PG_INT64_MIN + MC_EPOCH_DIFF_DAYS * USECS_PER_DAY)
+	{
+		ereport(ERROR,
+				(errcode(ERRCODE_DATETIME_VALUE_OUT_OF_RANGE),
+				 errmsg("timestamp out of range")));
+	}
+	result = value - MC_EPOCH_DIFF_DAYS * USECS_PER_DAY;
+#else
+	result = (double) value / units_per_sec -
+		(double) MC_EPOCH_DIFF_DAYS * SECS_PER_DAY;
+#endif
+	if (!IS_VALID_TIMESTAMP(result))
+	{
+		ereport(ERROR,
+				(errcode(ERRCODE_DATETIME_VALUE_OUT_OF_RANGE),
+				 errmsg("timestamp out of range")));
+	}
+	return result;
+}
+
+static Datum
+arrowVarlenaToDatum(const char *data, Size len, ConversionInfo * cinfo,
+					bool binary)
+{
+	char	   *cstring;
+
+	if (!binary)
+	{
+		/*
+		 * Arrow strings are UTF-8, which must be validated and converted to
+		 * the server encoding.
+		 */
+		char	   *converted;
+
+		if (GetDatabaseEncoding() == PG_UTF8)
+		{
+			pg_verifymbstr(data, len, false);
+		}
+		else
+		{
+			converted = pg_any_to_server(data, len, PG_UTF8);
+			if (converted != data)
+			{
+				data = converted;
+				len = strlen(converted);
+			}
+		}
+	}
+	if (binary || cinfo->atttypoid == TEXTOID ||
+		cinfo->atttypoid == VARCHAROID)
+	{
+		/* Same special case as in pyobjectToDatum */
+		return PointerGetDatum(cstring_to_text_with_len(data, len));
+	}
+	cstring = pnstrdup(data, len);
+	return InputFunctionCall(cinfo->attinfunc, cstring, cinfo->attioparam,
+							 cinfo->atttypmod);
+}
+
+/*
+ * Read the value at the given index of the array, as described by format.
+ */
+static Datum
+arrowValueToDatum(const MulticornArrowFormat * format,
+				  struct ArrowArray *array, int64 i, ConversionInfo * cinfo)
+{
+	const void *values = array->buffers[1];
+	int64		ivalue;
+	uint64		uvalue;
+
+	i += array->offset;
+	switch (format->type)
+	{
+		case MC_ARROW_INT:
+		case MC_ARROW_UINT:
+			ivalue = readArrowInteger(format, values, i, &uvalue);
+			if (uvalue > (uint64) INT64CONST(0x7FFFFFFFFFFFFFFF))
+			{
+				ereport(ERROR,
+						(errcode(ERRCODE_NUMERIC_VALUE_OUT_OF_RANGE),
+						 errmsg("value " UINT64_FORMAT " is out of range for type %s",
+								uvalue, format_type_be(cinfo->atttypoid))));
+			}
+			return nativeNumberToDatum(ivalue, 0, false, cinfo);
+		case MC_ARROW_FLOAT:
+			if (format->width == 4)
+				return nativeNumberToDatum(0, ((const float *) values)[i],
+										   true, cinfo);
+			return nativeNumberToDatum(0, ((const double *) values)[i],
+									   true, cinfo);
+		case MC_ARROW_BOOL:
+			return BoolGetDatum(ARROW_BIT(values, i));
+		case MC_ARROW_STRING:
+		case MC_ARROW_BINARY:
+			{
+				const int32 *offsets = values;
+
+				return arrowVarlenaToDatum((const char *) array->buffers[2] +
+										   offsets[i],
+										   offsets[i + 1] - offsets[i],
+										   cinfo,
+										   format->type == MC_ARROW_BINARY);
+			}
+		case MC_ARROW_LARGE_STRING:
+		case MC_ARROW_LARGE_BINARY:
+			{
+				const int64 *offsets = values;
+
+				return arrowVarlenaToDatum((const char *) array->buffers[2] +
+										   offsets[i],
+										   offsets[i + 1] - offsets[i],
+										   cinfo,
+									format->type == MC_ARROW_LARGE_BINARY);
+			}
+		case MC_ARROW_DATE32:
+			return DateADTGetDatum(((const int32 *) values)[i] -
+								   MC_EPOCH_DIFF_DAYS);
+		case MC_ARROW_DATE64:
+			return DateADTGetDatum(((const int64 *) values)[i] /
+								   (SECS_PER_DAY * INT64CONST(1000)) -
+								   MC_EPOCH_DIFF_DAYS);
+		case MC_ARROW_TIMESTAMP:
+			{
+				Timestamp	ts = arrowTimestampToTimestamp(((const int64 *) values)[i],
+													 format->units_per_sec);
+
+				/*
+				 * Timestamps with a timezone are instants, and naive ones
+				 * are local times.
+				 */
+				if (format->has_tz && cinfo->atttypoid == TIMESTAMPOID)
+				{
+					return DirectFunctionCall1(timestamptz_timestamp,
+											   TimestampTzGetDatum(ts));
+				}
+				if (!format->has_tz && cinfo->atttypoid == TIMESTAMPTZOID)
+				{
+					return DirectFunctionCall1(timestamp_timestamptz,
+											   TimestampGetDatum(ts));
+				}
+				return TimestampGetDatum(ts);
+			}
+		default:
+			elog(ERROR, "unsupported arrow type");
+	}
+	return (Datum) 0;
+}
+
+/*
+ * Get the value at the given row of the column.
+ * Returns false if the value is NULL.
+ */
+bool
+arrowColumnToDatum(struct MulticornArrowColumn *column, Py_ssize_t index,
+				   ConversionInfo * cinfo, Datum *value)
+{
+	struct ArrowArray *array = column->array;
+	int64		i = column->base_offset + index;
+
+	if (array->null_count != 0 && array->buffers[0] != NULL &&
+		!ARROW_BIT(array->buffers[0], array->offset + i))
+	{
+		return false;
+	}
+	if (column->is_dictionary)
+	{
+		uint64		uvalue;
+
+		i = readArrowInteger(&column->index_format, array->buffers[1],
+							 array->offset + i, &uvalue);
+		array = column->values;
+		if (i < 0 || i >= array->length)
+		{
+			ereport(ERROR,
+					(errcode(ERRCODE_DATA_EXCEPTION),
+					 errmsg("arrow dictionary index " INT64_FORMAT " is out of range",
+							i)));
+		}
+		if (array->null_count != 0 && array->buffers[0] != NULL &&
+			!ARROW_BIT(array->buffers[0], array->offset + i))
+		{
+			return false;
+		}
+	}
+	*value = arrowValueToDatum(&column->format, array, i, cinfo);
+	return true;
+}
+
+/*
+ * Prepare the readers for a record batch, exported through the C data
+ * interface. The batch is then read like a ColumnBlock.
+ * Columns with a type not supported natively are read from their python
+ * values, as returned by to_pylist.
+ */
+void
+beginArrowBatch(MulticornExecState * state, PyObject *p_batch, int natts)
+{
+	MemoryContext oldcontext;
+	struct ArrowArray *array;
+	struct ArrowSchema *schema;
+	PyObject   *p_result;
+	int			i;
+
+	/* Those must survive until the end of the batch */
+	oldcontext = MemoryContextSwitchTo(GetMemoryChunkContext(state));
+	array = palloc0(sizeof(struct ArrowArray));
+	schema = palloc0(sizeof(struct ArrowSchema));
+	state->arrow_array = array;
+	state->arrow_schema = schema;
+	state->p_columnblock = p_batch;
+	Py_INCREF(p_batch);
+	p_result = PyObject_CallMethod(p_batch, "_export_to_c", "(NN)",
+								   PyLong_FromVoidPtr(array),
+								   PyLong_FromVoidPtr(schema));
+	errorCheck();
+	Py_DECREF(p_result);
+	if (strcmp(schema->format, "+s") != 0 ||
+		array->n_children != schema->n_children)
+	{
+		elog(ERROR, "unexpected arrow record batch format: %s", schema->format);
+	}
+	for (i = 0; i < natts; i++)
+	{
+		MulticornColumnReader *reader = &state->column_readers[i];
+		ConversionInfo *cinfo = state->cinfos[i];
+		struct MulticornArrowColumn *column;
+		struct ArrowSchema *child_schema = NULL;
+		int			j;
+
+		if (cinfo == NULL || cinfo->unrequested)
+		{
+			continue;
+		}
+		for (j = 0; j < schema->n_children; j++)
+		{
+			if (schema->children[j]->name != NULL &&
+				strcmp(schema->children[j]->name, cinfo->attrname) == 0)
+			{
+				child_schema = schema->children[j];
+				break;
+			}
+		}
+		if (child_schema == NULL)
+		{
+			/* Missing columns are NULL */
+			continue;
+		}
+		column = palloc0(sizeof(struct MulticornArrowColumn));
+		column->array = array->children[j];
+		column->base_offset = array->offset;
+		column->values = column->array;
+		if (child_schema->dictionary != NULL)
+		{
+			column->is_dictionary = true;
+			parseArrowFormat(child_schema->format, &column->index_format);
+			parseArrowFormat(child_schema->dictionary->format,
+							 &column->format);
+			column->values = column->array->dictionary;
+			if (column->index_format.type != MC_ARROW_INT &&
+				column->index_format.type != MC_ARROW_UINT)
+			{
+				column->format.type = MC_ARROW_UNSUPPORTED;
+			}
+		}
+		else
+		{
+			parseArrowFormat(child_schema->format, &column->format);
+		}
+		if (arrowTypeMatchesType(column->format.type, cinfo->atttypoid))
+		{
+			reader->arrow = column;
+		}
+		else
+		{
+			PyObject   *p_column,
+					   *p_values;
+
+			pfree(column);
+			p_column = PyObject_CallMethod(p_batch, "column", "(i)", j);
+			errorCheck();
+			p_values = PyObject_CallMethod(p_column, "to_pylist", "()");
+			Py_DECREF(p_column);
+			errorCheck();
+			reader->p_values = PySequence_Fast(p_values,
+										   "to_pylist should return a list");
+			Py_DECREF(p_values);
+			errorCheck();
+		}
+	}
+	MemoryContextSwitchTo(oldcontext);
+	state->columnblock_length = array->length;
+	state->batch_index = 0;
+}
+
+/*
+ * Release the Arrow structures of the current batch, if any.
+ */
+void
+releaseArrowBatch(MulticornExecState * state, int natts)
+{
+	int			i;
+
+	for (i = 0; i < natts; i++)
+	{
+		if (state->column_readers[i].arrow != NULL)
+		{
+			pfree(state->column_readers[i].arrow);
+			state->column_readers[i].arrow = NULL;
+		}
+	}
+	if (state->arrow_array != NULL)
+	{
+		if (state->arrow_array->release != NULL)
+		{
+			state->arrow_array->release(state->arrow_array);
+		}
+		pfree(state->arrow_array);
+		state->arrow_array = NULL;
+	}
+	if (state->arrow_schema != NULL)
+	{
+		if (state->arrow_schema->release != NULL)
+		{
+			state->arrow_schema->release(state->arrow_schema);
+		}
+		pfree(state->arrow_schema);
+		state->arrow_schema = NULL;
+	}
+}
@@ -0,0 +1,685 @@
+/*-------------------------------------------------------------------------
+ *
+ * The Multicorn Foreign Data Wrapper allows you to fetch foreign data in
+ * Python in your PostgreSQL server.
+ *
+ * This module batches the lookups of a join into a multicorn table. Instead
+ * of executing the scan of the table once per outer row, as a nested loop
+ * does, a custom scan collects the keys of up to key_batch_size outer rows,
+ * executes the scan once with a "column = ANY(keys)" qual, and distributes
+ * the returned rows to the outer rows they match.
+ *
+ * This software is released under the postgresql licence
+ *
+ * author: Kozea
+ *
+ *
+ *-------------------------------------------------------------------------
+ */
+#include "multicorn.h"
+
+#if PG_VERSION_NUM >= 90500
+#include <math.h>
+
+#include "access/htup_details.h"
+#include "executor/executor.h"
+#include "nodes/nodeFuncs.h"
+#include "optimizer/clauses.h"
+#include "optimizer/cost.h"
+#include "optimizer/pathnode.h"
+#include "optimizer/paths.h"
+#include "optimizer/restrictinfo.h"
+#include "optimizer/var.h"
+#include "utils/array.h"
+#include "utils/datum.h"
+#include "utils/lsyscache.h"
+#include "utils/memutils.h"
+
+/* State of the execution of a batched join */
+typedef struct MulticornKeyBatchState
+{
+	CustomScanState css;
+	int			batch_size;
+	JoinType	jointype;
+	PlanState  *outer_ps;
+	PlanState  *inner_ps;
+	/* Number of columns of each side in the scan tuple */
+	int			outer_natts;
+	int			inner_natts;
+	TupleTableSlot *outer_slot;
+	TupleTableSlot *inner_slot;
+	/* Key of the outer rows, and join clauses between the rows */
+	ExprState  *key_expr;
+	List	   *join_quals;
+	Oid			key_type;
+	int16		key_typlen;
+	bool		key_typbyval;
+	char		key_typalign;
+	/* Qual given to the inner scan, holding the keys of the batch */
+	MulticornConstQual *key_qual;
+	/* Rows of the current batch, allocated in the batch context */
+	MemoryContext batch_context;
+	HeapTuple  *outer_tuples;
+	int			nouter;
+	bool		outer_done;
+	Datum	   *keys;
+	HeapTuple  *inner_tuples;
+	int			ninner;
+	int			maxinner;
+	/* Position in the current batch */
+	int			outer_index;
+	int			inner_index;
+	bool		matched;
+	/* Number of lookups, shown by EXPLAIN ANALYZE */
+	long		nlookups;
+}	MulticornKeyBatchState;
+
+static set_join_pathlist_hook_type prev_set_join_pathlist_hook = NULL;
+
+static void multicornKeyBatchPaths(PlannerInfo *root, RelOptInfo *joinrel,
+					   RelOptInfo *outerrel, RelOptInfo *innerrel,
+					   JoinType jointype, JoinPathExtraData *extra);
+static bool findBatchKey(RestrictInfo *rinfo, RelOptInfo *outerrel,
+			 RelOptInfo *innerrel, Var **inner_var, Expr **outer_expr);
+static Plan *multicornPlanKeyBatch(PlannerInfo *root, RelOptInfo *rel,
+					  CustomPath *best_path, List *tlist,
+					  List *clauses, List *custom_plans);
+static Node *multicornCreateKeyBatchState(CustomScan *cscan);
+static void multicornBeginKeyBatch(CustomScanState *node, EState *estate,
+					   int eflags);
+static TupleTableSlot *multicornExecKeyBatch(CustomScanState *node);
+static void multicornEndKeyBatch(CustomScanState *node);
+static void multicornReScanKeyBatch(CustomScanState *node);
+static void multicornExplainKeyBatch(CustomScanState *node, List *ancestors,
+						 ExplainState *es);
+static TupleTableSlot *nextJoinedRow(CustomScanState *node);
+static bool recheckJoinedRow(CustomScanState *node, TupleTableSlot *slot);
+static void fetchBatch(MulticornKeyBatchState * state);
+static TupleTableSlot *storeJoinedRow(MulticornKeyBatchState * state,
+			   HeapTuple inner_tuple);
+
+static CustomPathMethods multicornKeyBatchPathMethods = {
+	"MulticornKeyBatch",
+	multicornPlanKeyBatch,
+	NULL
+};
+
+static CustomScanMethods multicornKeyBatchScanMethods = {
+	"MulticornKeyBatch",
+	multicornCreateKeyBatchState,
+	NULL
+};
+
+static CustomExecMethods multicornKeyBatchExecMethods = {
+	"MulticornKeyBatch",
+	multicornBeginKeyBatch,
+	multicornExecKeyBatch,
+	multicornEndKeyBatch,
+	multicornReScanKeyBatch,
+	NULL,
+	NULL,
+	multicornExplainKeyBatch
+};
+
+
+/*
+ * Install the planner hook adding the batched joins.
+ */
+void
+initKeyBatch(void)
+{
+	prev_set_join_pathlist_hook = set_join_pathlist_hook;
+	set_join_pathlist_hook = multicornKeyBatchPaths;
+}
+
+/*
+ * Add a path joining a relation to a multicorn table by batches of keys, if
+ * the key_batch_size option of the table is set.
+ *
+ * Only inner and left joins are considered, with one of their join clauses
+ * comparing a column of the table to an expression of the outer relation
+ * with an equality operator. The whole join clauses are evaluated on the
+ * rows of each batch, so that the python fdw may return more rows than
+ * requested.
+ */
+static void
+multicornKeyBatchPaths(PlannerInfo *root, RelOptInfo *joinrel,
+					   RelOptInfo *outerrel, RelOptInfo *innerrel,
+					   JoinType jointype, JoinPathExtraData *extra)
+{
+	MulticornPlanState *innerstate = innerrel->fdw_private;
+	Path	   *outer_path = outerrel->cheapest_total_path,
+			   *inner_path = innerrel->cheapest_total_path;
+	List	   *join_rinfos = NIL,
+			   *other_rinfos = NIL;
+	Var		   *key_var = NULL;
+	Expr	   *key_expr = NULL;
+	ListCell   *lc;
+	int			batch_size;
+	double		nbatches,
+				inner_rows;
+	QualCost	join_cost,
+				other_cost;
+	Cost		batch_cost;
+	CustomPath *path;
+
+	if (prev_set_join_pathlist_hook)
+	{
+		prev_set_join_pathlist_hook(root, joinrel, outerrel, innerrel,
+									jointype, extra);
+	}
+	/* Joins locking rows, or with lateral references, are left to PostgreSQL */
+	if ((jointype != JOIN_INNER && jointype != JOIN_LEFT) ||
+		innerrel->reloptkind != RELOPT_BASEREL ||
+		!isMulticornRoutine(innerrel->fdwroutine) ||
+		innerstate == NULL ||
+		root->parse->commandType != CMD_SELECT ||
+		root->parse->rowMarks != NIL ||
+		!bms_is_empty(joinrel->lateral_relids) ||
+		!bms_is_empty(innerrel->lateral_relids) ||
+		outer_path == NULL || !IsA(inner_path, ForeignPath) ||
+		!bms_is_empty(PATH_REQ_OUTER(outer_path)) ||
+		!bms_is_empty(PATH_REQ_OUTER(inner_path)))
+	{
+		return;
+	}
+	batch_size = getCacheEntry(innerstate->foreigntableid)->key_batch_size;
+	if (batch_size <= 0)
+	{
+		return;
+	}
+	foreach(lc, innerrel->baserestrictinfo)
+	{
+		/* Constant quals are applied above the scan of the table */
+		if (((RestrictInfo *) lfirst(lc))->pseudoconstant)
+		{
+			return;
+		}
+	}
+	foreach(lc, extra->restrictlist)
+	{
+		RestrictInfo *rinfo = (RestrictInfo *) lfirst(lc);
+
+		if (rinfo->pseudoconstant)
+		{
+			return;
+		}
+		/* Filters applied after a left join are not join clauses */
+		if (jointype == JOIN_LEFT && rinfo->is_pushed_down)
+		{
+			other_rinfos = lappend(other_rinfos, rinfo);
+			continue;
+		}
+		join_rinfos = lappend(join_rinfos, rinfo);
+		if (key_var == NULL)
+		{
+			findBatchKey(rinfo, outerrel, innerrel, &key_var, &key_expr);
+		}
+	}
+	if (key_var == NULL)
+	{
+		return;
+	}
+
+	/*
+	 * Every batch executes the scan of the table once, for the rows matching
+	 * its keys, which are then compared to each outer row of the batch.
+	 */
+	nbatches = Max(ceil(outer_path->rows / batch_size), 1.0);
+	inner_rows = Min(clamp_row_est(joinrel->rows / nbatches), innerrel->rows);
+	batch_cost = innerstate->startupCost +
+		inner_rows * (innerstate->perRowCost + innerstate->localQualCost);
+	cost_qual_eval(&join_cost, join_rinfos, root);
+	cost_qual_eval(&other_cost, other_rinfos, root);
+
+	path = makeNode(CustomPath);
+	path->path.pathtype = T_CustomScan;
+	path->path.parent = joinrel;
+	path->path.param_info = NULL;
+	path->path.rows = joinrel->rows;
+	path->path.startup_cost = outer_path->startup_cost + batch_cost +
+		join_cost.startup + other_cost.startup;
+	path->path.total_cost = outer_path->total_cost + nbatches * batch_cost +
+		outer_path->rows * inner_rows * join_cost.per_tuple +
+		joinrel->rows * (cpu_tuple_cost + other_cost.per_tuple) +
+		join_cost.startup + other_cost.startup;
+	/* The rows are returned in the order of the outer relation */
+	path->path.pathkeys = build_join_pathkeys(root, joinrel, jointype,
+											  outer_path->pathkeys);
+	path->flags = 0;
+	path->custom_paths = list_make2(outer_path, inner_path);
+	path->custom_private = list_make4(join_rinfos, other_rinfos,
+									  list_make2(key_var, key_expr),
+									  list_make2_int(batch_size, jointype));
+	path->methods = &multicornKeyBatchPathMethods;
+	add_path(joinrel, (Path *) path);
+}
+
+/*
+ * Look for the key of a batched join in a join clause, of the form
+ * "inner column = outer expression". The keys are sent as an array of the
+ * type of the outer expression, which must not be volatile.
+ */
+static bool
+findBatchKey(RestrictInfo *rinfo, RelOptInfo *outerrel, RelOptInfo *innerrel,
+			 Var **inner_var, Expr **outer_expr)
+{
+	OpExpr	   *op = (OpExpr *) rinfo->clause;
+	Node	   *inner,
+			   *outer;
+	char	   *opname;
+
+	if (!IsA(op, OpExpr) || list_length(op->args) != 2 || !rinfo->can_join)
+	{
+		return false;
+	}
+	if (bms_equal(rinfo->left_relids, innerrel->relids) &&
+		bms_is_subset(rinfo->right_relids, outerrel->relids))
+	{
+		inner = linitial(op->args);
+		outer = lsecond(op->args);
+	}
+	else if (bms_equal(rinfo->right_relids, innerrel->relids) &&
+			 bms_is_subset(rinfo->left_relids, outerrel->relids))
+	{
+		inner = lsecond(op->args);
+		outer = linitial(op->args);
+	}
+	else
+	{
+		return false;
+	}
+	while (IsA(inner, RelabelType))
+	{
+		inner = (Node *) ((RelabelType *) inner)->arg;
+	}
+	if (!IsA(inner, Var) || ((Var *) inner)->varattno <= 0 ||
+		contain_volatile_functions(outer) ||
+		!OidIsValid(get_array_type(exprType(outer))))
+	{
+		return false;
+	}
+	/* Only the equality operators can look up keys */
+	opname = get_opname(op->opno);
+	if (opname == NULL || strcmp(opname, "=") != 0 ||
+		!(op_mergejoinable(op->opno, exprType(linitial(op->args))) ||
+		  op_hashjoinable(op->opno, exprType(linitial(op->args)))))
+	{
+		return false;
+	}
+	*inner_var = (Var *) inner;
+	*outer_expr = (Expr *) outer;
+	return true;
+}
+
+/*
+ * Build the custom scan of a batched join. The scan tuple holds the columns
+ * of the outer plan, followed by those of the inner plan. The key and the
+ * join clauses are kept in custom_exprs, and the filters applied after the
+ * join in the qual of the scan.
+ */
+static Plan *
+multicornPlanKeyBatch(PlannerInfo *root, RelOptInfo *rel,
+					  CustomPath *best_path, List *tlist,
+					  List *clauses, List *custom_plans)
+{
+	CustomScan *cscan = makeNode(CustomScan);
+	List	   *join_rinfos = linitial(best_path->custom_private),
+			   *other_rinfos = lsecond(best_path->custom_private),
+			   *key = lthird(best_path->custom_private),
+			   *settings = lfourth(best_path->custom_private),
+			   *scan_tlist = NIL;
+	Plan	   *outer_plan = linitial(custom_plans),
+			   *inner_plan = lsecond(custom_plans);
+	ListCell   *lc;
+
+	foreach(lc, list_concat(list_copy(outer_plan->targetlist),
+							inner_plan->targetlist))
+	{
+		TargetEntry *entry = (TargetEntry *) lfirst(lc);
+
+		scan_tlist = lappend(scan_tlist,
+							 makeTargetEntry(copyObject(entry->expr),
+											 list_length(scan_tlist) + 1,
+											 NULL, false));
+	}
+	cscan->scan.plan.targetlist = tlist;
+	cscan->scan.plan.qual = extract_actual_clauses(other_rinfos, false);
+	cscan->scan.scanrelid = 0;
+	cscan->flags = best_path->flags;
+	cscan->custom_plans = custom_plans;
+	cscan->custom_exprs = lcons(copyObject(lsecond(key)),
+								extract_actual_clauses(join_rinfos, false));
+	/* Batch size, key column, join type, and columns of each side */
+	cscan->custom_private = list_make4_int(linitial_int(settings),
+										 ((Var *) linitial(key))->varattno,
+										   lsecond_int(settings),
+										 list_length(outer_plan->targetlist));
+	cscan->custom_private = lappend_int(cscan->custom_private,
+										list_length(inner_plan->targetlist));
+	cscan->custom_scan_tlist = scan_tlist;
+	cscan->methods = &multicornKeyBatchScanMethods;
+	return &cscan->scan.plan;
+}
+
+static Node *
+multicornCreateKeyBatchState(CustomScan *cscan)
+{
+	MulticornKeyBatchState *state = palloc0(sizeof(MulticornKeyBatchState));
+
+	NodeSetTag(state, T_CustomScanState);
+	state->css.flags = cscan->flags;
+	state->css.methods = &multicornKeyBatchExecMethods;
+	return (Node *) state;
+}
+
+/*
+ * Initialize the execution of a batched join, and the qual giving the keys
+ * of every batch to the scan of the multicorn table.
+ */
+static void
+multicornBeginKeyBatch(CustomScanState *node, EState *estate, int eflags)
+{
+	MulticornKeyBatchState *state = (MulticornKeyBatchState *) node;
+	CustomScan *cscan = (CustomScan *) node->ss.ps.plan;
+	List	   *settings = cscan->custom_private;
+	Expr	   *key_expr = linitial(cscan->custom_exprs);
+	MulticornExecState *execstate;
+
+	state->batch_size = linitial_int(settings);
+	state->jointype = (JoinType) lthird_int(settings);
+	state->outer_natts = lfourth_int(settings);
+	state->inner_natts = list_nth_int(settings, 4);
+	state->outer_ps = ExecInitNode(linitial(cscan->custom_plans), estate,
+								   eflags);
+	state->inner_ps = ExecInitNode(lsecond(cscan->custom_plans), estate,
+								   eflags);
+	node->custom_ps = list_make2(state->outer_ps, state->inner_ps);
+	if (!IsA(state->inner_ps, ForeignScanState) ||
+		!isMulticornRoutine(((ForeignScanState *) state->inner_ps)->fdwroutine))
+	{
+		elog(ERROR, "the inner plan of a batched join must scan a multicorn table");
+	}
+	state->outer_slot = MakeSingleTupleTableSlot(ExecGetResultType(state->outer_ps));
+	state->inner_slot = MakeSingleTupleTableSlot(ExecGetResultType(state->inner_ps));
+	state->key_expr = ExecInitExpr(key_expr, (PlanState *) node);
+	state->join_quals = (List *) ExecInitExpr((Expr *) list_copy_tail(cscan->custom_exprs, 1),
+											  (PlanState *) node);
+	state->key_type = exprType((Node *) key_expr);
+	get_typlenbyvalalign(state->key_type, &state->key_typlen,
+						 &state->key_typbyval, &state->key_typalign);
+	state->key_qual = palloc0(sizeof(MulticornConstQual));
+	state->key_qual->base.varattno = lsecond_int(settings);
+	state->key_qual->base.right_type = T_Const;
+	state->key_qual->base.typeoid = get_array_type(state->key_type);
+	state->key_qual->base.opname = "=";
+	state->key_qual->base.isArray = true;
+	state->key_qual->base.useOr = true;
+	/* The rows of each batch depend on its keys, and cannot be cached */
+	execstate = ((ForeignScanState *) state->inner_ps)->fdw_state;
+	execstate->key_qual = state->key_qual;
+	execstate->result_cache = NULL;
+	state->batch_context = AllocSetContextCreate(estate->es_query_cxt,
+												 "multicorn key batch",
+												 ALLOCSET_DEFAULT_MINSIZE,
+												 ALLOCSET_DEFAULT_INITSIZE,
+												 ALLOCSET_DEFAULT_MAXSIZE);
+	state->outer_tuples = palloc(sizeof(HeapTuple) * state->batch_size);
+	state->keys = palloc(sizeof(Datum) * state->batch_size);
+}
+
+/*
+ * Collect the next batch of outer rows, and fetch the rows of the multicorn
+ * table matching their keys in a single execution of its scan.
+ */
+static void
+fetchBatch(MulticornKeyBatchState * state)
+{
+	ExprContext *econtext = state->css.ss.ps.ps_ExprContext;
+	MemoryContext oldcontext;
+	int			nkeys = 0;
+
+	MemoryContextReset(state->batch_context);
+	state->nouter = 0;
+	state->ninner = 0;
+	state->maxinner = 0;
+	state->inner_tuples = NULL;
+	state->outer_index = 0;
+	state->inner_index = 0;
+	state->matched = false;
+	while (state->nouter < state->batch_size)
+	{
+		TupleTableSlot *slot = ExecProcNode(state->outer_ps);
+		HeapTuple	tuple;
+		Datum		key;
+		bool		isnull;
+		int			i;
+
+		if (TupIsNull(slot))
+		{
+			state->outer_done = true;
+			break;
+		}
+		oldcontext = MemoryContextSwitchTo(state->batch_context);
+		tuple = ExecCopySlotTuple(slot);
+		MemoryContextSwitchTo(oldcontext);
+		state->outer_tuples[state->nouter++] = tuple;
+		ExecStoreTuple(tuple, state->outer_slot, InvalidBuffer, false);
+		slot_getallattrs(state->outer_slot);
+		ResetExprContext(econtext);
+		econtext->ecxt_scantuple = storeJoinedRow(state, NULL);
+		key = ExecEvalExpr(state->key_expr, econtext, &isnull, NULL);
+		/* A NULL key cannot match any row */
+		if (isnull)
+		{
+			continue;
+		}
+		for (i = 0; i < nkeys; i++)
+		{
+			if (datumIsEqual(state->keys[i], key, state->key_typbyval,
+							 state->key_typlen))
+			{
+				break;
+			}
+		}
+		if (i == nkeys)
+		{
+			oldcontext = MemoryContextSwitchTo(state->batch_context);
+			state->keys[nkeys++] = datumCopy(key, state->key_typbyval,
+											 state->key_typlen);
+			MemoryContextSwitchTo(oldcontext);
+		}
+	}
+	if (nkeys == 0)
+	{
+		return;
+	}
+	oldcontext = MemoryContextSwitchTo(state->batch_context);
+	state->key_qual->value = PointerGetDatum(construct_array(state->keys, nkeys,
+															 state->key_type,
+														 state->key_typlen,
+													   state->key_typbyval,
+													 state->key_typalign));
+	MemoryContextSwitchTo(oldcontext);
+	ExecReScan(state->inner_ps);
+	state->nlookups++;
+	while (true)
+	{
+		TupleTableSlot *slot = ExecProcNode(state->inner_ps);
+
+		if (TupIsNull(slot))
+		{
+			break;
+		}
+		oldcontext = MemoryContextSwitchTo(state->batch_context);
+		if (state->ninner == state->maxinner)
+		{
+			state->maxinner = Max(state->maxinner * 2, 64);
+			if (state->inner_tuples == NULL)
+			{
+				state->inner_tuples = palloc(sizeof(HeapTuple) * state->maxinner);
+			}
+			else
+			{
+				state->inner_tuples = repalloc(state->inner_tuples,
+										sizeof(HeapTuple) * state->maxinner);
+			}
+		}
+		state->inner_tuples[state->ninner++] = ExecCopySlotTuple(slot);
+		MemoryContextSwitchTo(oldcontext);
+	}
+}
+
+/*
+ * Store the current outer row, followed by an inner row or by NULL values,
+ * in the scan tuple.
+ */
+static TupleTableSlot *
+storeJoinedRow(MulticornKeyBatchState * state, HeapTuple inner_tuple)
+{
+	TupleTableSlot *slot = state->css.ss.ss_ScanTupleSlot;
+
+	ExecClearTuple(slot);
+	memcpy(slot->tts_values, state->outer_slot->tts_values,
+		   sizeof(Datum) * state->outer_natts);
+	memcpy(slot->tts_isnull, state->outer_slot->tts_isnull,
+		   sizeof(bool) * state->outer_natts);
+	if (inner_tuple == NULL)
+	{
+		memset(slot->tts_isnull + state->outer_natts, true,
+			   sizeof(bool) * state->inner_natts);
+	}
+	else
+	{
+		ExecStoreTuple(inner_tuple, state->inner_slot, InvalidBuffer, false);
+		slot_getallattrs(state->inner_slot);
+		memcpy(slot->tts_values + state->outer_natts,
+			   state->inner_slot->tts_values,
+			   sizeof(Datum) * state->inner_natts);
+		memcpy(slot->tts_isnull + state->outer_natts,
+			   state->inner_slot->tts_isnull,
+			   sizeof(bool) * state->inner_natts);
+	}
+	return ExecStoreVirtualTuple(slot);
+}
+
+/*
+ * Returns the next pair of an outer row and of an inner row satisfying the
+ * join clauses. The outer rows of a left join without any match are returned
+ * with NULL values.
+ */
+static TupleTableSlot *
+nextJoinedRow(CustomScanState *node)
+{
+	MulticornKeyBatchState *state = (MulticornKeyBatchState *) node;
+	ExprContext *econtext = node->ss.ps.ps_ExprContext;
+
+	while (true)
+	{
+		if (state->outer_index >= state->nouter)
+		{
+			if (state->outer_done)
+			{
+				return ExecClearTuple(node->ss.ss_ScanTupleSlot);
+			}
+			fetchBatch(state);
+			continue;
+		}
+		if (state->inner_index == 0 && !state->matched)
+		{
+			ExecStoreTuple(state->outer_tuples[state->outer_index],
+						   state->outer_slot, InvalidBuffer, false);
+			slot_getallattrs(state->outer_slot);
+		}
+		while (state->inner_index < state->ninner)
+		{
+			TupleTableSlot *slot = storeJoinedRow(state,
+							  state->inner_tuples[state->inner_index++]);
+
+			ResetExprContext(econtext);
+			econtext->ecxt_scantuple = slot;
+			if (ExecQual(state->join_quals, econtext, false))
+			{
+				state->matched = true;
+				return slot;
+			}
+		}
+		if (!state->matched && state->jointype == JOIN_LEFT)
+		{
+			state->matched = true;
+			return storeJoinedRow(state, NULL);
+		}
+		state->outer_index++;
+		state->inner_index = 0;
+		state->matched = false;
+	}
+}
+
+static bool
+recheckJoinedRow(CustomScanState *node, TupleTableSlot *slot)
+{
+	return true;
+}
+
+static TupleTableSlot *
+multicornExecKeyBatch(CustomScanState *node)
+{
+	return ExecScan(&node->ss, (ExecScanAccessMtd) nextJoinedRow,
+					(ExecScanRecheckMtd) recheckJoinedRow);
+}
+
+static void
+multicornEndKeyBatch(CustomScanState *node)
+{
+	MulticornKeyBatchState *state = (MulticornKeyBatchState *) node;
+
+	ExecDropSingleTupleTableSlot(state->outer_slot);
+	ExecDropSingleTupleTableSlot(state->inner_slot);
+	ExecEndNode(state->outer_ps);
+	ExecEndNode(state->inner_ps);
+	MemoryContextDelete(state->batch_context);
+}
+
+/*
+ * Restart the join from the first outer row. The parameters which changed
+ * are given to both plans, which are not known to ExecReScan.
+ */
+static void
+multicornReScanKeyBatch(CustomScanState *node)
+{
+	MulticornKeyBatchState *state = (MulticornKeyBatchState *) node;
+
+	if (node->ss.ps.chgParam != NULL)
+	{
+		UpdateChangedParamSet(state->outer_ps, node->ss.ps.chgParam);
+		UpdateChangedParamSet(state->inner_ps, node->ss.ps.chgParam);
+	}
+	if (state->outer_ps->chgParam == NULL)
+	{
+		ExecReScan(state->outer_ps);
+	}
+	MemoryContextReset(state->batch_context);
+	state->inner_tuples = NULL;
+	state->nouter = 0;
+	state->ninner = 0;
+	state->maxinner = 0;
+	state->outer_index = 0;
+	state->inner_index = 0;
+	state->matched = false;
+	state->outer_done = false;
+}
+
+static void
+multicornExplainKeyBatch(CustomScanState *node, List *ancestors,
+						 ExplainState *es)
+{
+	MulticornKeyBatchState *state = (MulticornKeyBatchState *) node;
+
+	ExplainPropertyInteger("Key Batch Size", state->batch_size, es);
+	if (es->analyze)
+	{
+		ExplainPropertyLong("Key Lookups", state->nlookups, es);
+	}
+}
+
+#endif
@@ -12,6 +12,7 @@
 #include "optimizer/planmain.h"
 #include "optimizer/restrictinfo.h"
 #include "optimizer/clauses.h"
+#include "optimizer/cost.h"
 #include "optimizer/var.h"
 #include "access/reloptions.h"
 #include "access/relscan.h"
@@ -61,6 +62,17 @@ static ForeignScan *multicornGetForeignPlan(PlannerInfo *root,
 #endif
 		);
 static void multicornExplainForeignScan(ForeignScanState *node, ExplainState *es);
+#if PG_VERSION_NUM >= 90500
+static void multicornGetForeignJoinPaths(PlannerInfo *root,
+							 RelOptInfo *joinrel,
+							 RelOptInfo *outerrel,
+							 RelOptInfo *innerrel,
+							 JoinType jointype,
+							 JoinPathExtraData *extra);
+static List *deparseJoinClause(Expr *clause, RelOptInfo *outerrel,
+				  RelOptInfo *innerrel, PlannerInfo *root);
+static List *addJoinColumn(List *tlist, Var *var);
+#endif
 static void multicornBeginForeignScan(ForeignScanState *node, int eflags);
 static TupleTableSlot *multicornIterateForeignScan(ForeignScanState *node);
 static void multicornReScanForeignScan(ForeignScanState *node);
@@ -88,11 +100,24 @@ static TupleTableSlot *multicornExecForeignDelete(EState *estate, ResultRelInfo
 static TupleTableSlot *multicornExecForeignUpdate(EState *estate, ResultRelInfo *resultRelInfo,
 						   TupleTableSlot *slot, TupleTableSlot *planSlot);
 static void multicornEndForeignModify(EState *estate, ResultRelInfo *resultRelInfo);
+static bool canBufferModifications(ModifyTableState *mtstate,
+					   ResultRelInfo *resultRelInfo);
+static void flushPendingModifications(MulticornModifyState * modstate);
+static void bufferModification(MulticornModifyState * modstate,
+				   PyObject *p_row);
 
 static void multicorn_subxact_callback(SubXactEvent event, SubTransactionId mySubid,
 						   SubTransactionId parentSubid, void *arg);
 #endif
 
+static bool multicornAnalyzeForeignTable(Relation relation,
+							 AcquireSampleRowsFunc *func,
+							 BlockNumber *totalpages);
+static int multicornAcquireSampleRows(Relation relation, int elevel,
+						   HeapTuple *rows, int targrows,
+						   double *totalrows,
+						   double *totaldeadrows);
+
 #if PG_VERSION_NUM >= 90500
 static List *multicornImportForeignSchema(ImportForeignSchemaStmt * stmt,
 							 Oid serverOid);
@@ -102,7 +127,11 @@ static void multicorn_xact_callback(XactEvent event, void *arg);
 
 /*	Helpers functions */
 void	   *serializePlanState(MulticornPlanState * planstate);
+static Const *makeInt8Const(int64 value);
+static bool getQueryLimit(PlannerInfo *root, RelOptInfo *baserel,
+			  int64 *limit);
 MulticornExecState *initializeExecState(void *internal_plan_state);
+static ConversionInfo **tableConversionInfos(Oid foreigntableid, int *natts);
 
 /* Hash table mapping oid to fdw instances */
 HTAB	   *InstancesHash;
@@ -129,6 +158,9 @@ _PG_init()
 								&ctl,
 								HASH_ELEM | HASH_FUNCTION);
 	MemoryContextSwitchTo(oldctx);
+#if PG_VERSION_NUM >= 90500
+	initKeyBatch();
+#endif
 }
 
 void
@@ -148,6 +180,9 @@ multicorn_handler(PG_FUNCTION_ARGS)
 	fdw_routine->GetForeignPaths = multicornGetForeignPaths;
 	fdw_routine->GetForeignPlan = multicornGetForeignPlan;
 	fdw_routine->ExplainForeignScan = multicornExplainForeignScan;
+#if PG_VERSION_NUM >= 90500
+	fdw_routine->GetForeignJoinPaths = multicornGetForeignJoinPaths;
+#endif
 
 	/* Scan phase */
 	fdw_routine->BeginForeignScan = multicornBeginForeignScan;
@@ -167,6 +202,9 @@ multicorn_handler(PG_FUNCTION_ARGS)
 	fdw_routine->EndForeignModify = multicornEndForeignModify;
 #endif
 
+	/* Statistics */
+	fdw_routine->AnalyzeForeignTable = multicornAnalyzeForeignTable;
+
 #if PG_VERSION_NUM >= 90500
 	fdw_routine->ImportForeignSchema = multicornImportForeignSchema;
 #endif
@@ -174,6 +212,17 @@ multicorn_handler(PG_FUNCTION_ARGS)
 	PG_RETURN_POINTER(fdw_routine);
 }
 
+/*
+ * Returns true if the routine is the one of multicorn, to recognize the
+ * scans of multicorn tables in the plans.
+ */
+bool
+isMulticornRoutine(FdwRoutine *routine)
+{
+	return routine != NULL &&
+		routine->BeginForeignScan == multicornBeginForeignScan;
+}
+
 Datum
 multicorn_validator(PG_FUNCTION_ARGS)
 {
@@ -201,6 +250,42 @@ multicorn_validator(PG_FUNCTION_ARGS)
 				className = (char *) defGetString(def);
 			}
 		}
+		else if (strcmp(def->defname, "estimate_cache_ttl") == 0)
+		{
+			char	   *value = defGetString(def);
+			char	   *end;
+			long		ttl = strtol(value, &end, 10);
+
+			if (*value == '\0' || *end != '\0' || ttl < 0 || ttl > INT_MAX)
+			{
+				ereport(ERROR, (errmsg("%s", "The estimate_cache_ttl parameter must be a number of seconds"),
+								errhint("%s", "Set it to 0 to disable the estimate cache")));
+			}
+		}
+		else if (strcmp(def->defname, "result_cache_size") == 0)
+		{
+			char	   *value = defGetString(def);
+			char	   *end;
+			long		size = strtol(value, &end, 10);
+
+			if (*value == '\0' || *end != '\0' || size < 0 || size > INT_MAX)
+			{
+				ereport(ERROR, (errmsg("%s", "The result_cache_size parameter must be a number of kilobytes"),
+								errhint("%s", "Set it to 0 to disable the result cache")));
+			}
+		}
+		else if (strcmp(def->defname, "key_batch_size") == 0)
+		{
+			char	   *value = defGetString(def);
+			char	   *end;
+			long		size = strtol(value, &end, 10);
+
+			if (*value == '\0' || *end != '\0' || size < 0 || size > MaxAllocSize / sizeof(Datum))
+			{
+				ereport(ERROR, (errmsg("%s", "The key_batch_size parameter must be a number of keys"),
+								errhint("%s", "Set it to 0 to disable the batched lookups")));
+			}
+		}
 	}
 	if (catalog == ForeignServerRelationId)
 	{
@@ -232,6 +317,12 @@ multicornGetForeignRelSize(PlannerInfo *root,
 	ListCell   *lc;
 	bool		needWholeRow = false;
 	TupleDesc	desc;
+	List	   *columns;
+	List	   *candidates = NIL;
+	List	   *candidate_quals = NIL;
+	QualCost	local_cost;
+	double		rows;
+	int			width;
 
 	baserel->fdw_private = planstate;
 	planstate->fdw_instance = getInstance(foreigntableid);
@@ -248,9 +339,25 @@ multicornGetForeignRelSize(PlannerInfo *root,
 		planstate->cinfos = palloc0(sizeof(ConversionInfo *) *
 									planstate->numattrs);
 		initConversioninfo(planstate->cinfos, attinmeta);
-		needWholeRow = rel->trigdesc && rel->trigdesc->trig_insert_after_row;
+
+		/*
+		 * Row triggers need every column when the table is modified, but a
+		 * plain scan only needs the referenced ones.
+		 */
+		needWholeRow = root->parse->commandType != CMD_SELECT &&
+			root->parse->resultRelation == baserel->relid &&
+			rel->trigdesc && rel->trigdesc->trig_insert_after_row;
 		RelationClose(rel);
 	}
+	columns = extractColumns(baserel->reltargetlist, baserel->baserestrictinfo);
+	foreach(lc, columns)
+	{
+		/* A whole-row reference needs every column too. */
+		if (((Var *) lfirst(lc))->varattno == InvalidAttrNumber)
+		{
+			needWholeRow = true;
+		}
+	}
 	if (needWholeRow)
 	{
 		int			i;
@@ -268,7 +375,7 @@ multicornGetForeignRelSize(PlannerInfo *root,
 	else
 	{
 		/* Pull "var" clauses to build an appropriate target list */
-		foreach(lc, extractColumns(baserel->reltargetlist, baserel->baserestrictinfo))
+		foreach(lc, columns)
 		{
 			Var		   *var = (Var *) lfirst(lc);
 			Value	   *colname;
@@ -287,12 +394,47 @@ multicornGetForeignRelSize(PlannerInfo *root,
 	/* Extract the restrictions from the plan. */
 	foreach(lc, baserel->baserestrictinfo)
 	{
-		extractRestrictions(baserel->relids, ((RestrictInfo *) lfirst(lc))->clause,
-							&planstate->qual_list);
+		RestrictInfo *rinfo = (RestrictInfo *) lfirst(lc);
+		List	   *quals = NIL;
 
+		extractRestrictions(baserel->relids, rinfo->clause, &quals);
+		/* Only a clause translated to a single qual can be enforced */
+		if (list_length(quals) == 1)
+		{
+			candidates = lappend(candidates, rinfo);
+			candidate_quals = lappend(candidate_quals, linitial(quals));
+		}
+		planstate->qual_list = list_concat(planstate->qual_list, quals);
 	}
 	/* Inject the "rows" and "width" attribute into the baserel */
-	getRelSize(planstate, root, &baserel->rows, &baserel->width);
+	getRelSize(planstate, root, &rows, &width);
+
+	/*
+	 * Once the table has been analyzed, the planner already estimated its
+	 * size from the statistics, see multicornAnalyzeForeignTable.
+	 */
+	if (baserel->pages == 0)
+	{
+		baserel->rows = rows;
+		baserel->width = width;
+	}
+	/* Without a cost from the python fdw, a row costs its width */
+	if (!planstate->fdwCosts)
+	{
+		planstate->perRowCost = baserel->width;
+	}
+
+	/*
+	 * The clauses enforced by the python fdw are not rechecked, so only the
+	 * other ones are evaluated locally for every row.
+	 */
+	planstate->enforced_clauses = canEnforce(planstate, candidates,
+											 candidate_quals);
+	cost_qual_eval(&local_cost,
+				   list_difference_ptr(baserel->baserestrictinfo,
+									   planstate->enforced_clauses),
+				   root);
+	planstate->localQualCost = local_cost.per_tuple;
 }
 
 /*
@@ -315,6 +457,13 @@ multicornGetForeignPaths(PlannerInfo *root,
 	List				*apply_pathkeys = NULL;
 	List				*deparsed_pathkeys = NULL;
 
+	/* Additional costs of the sorted paths, see getSortCost */
+	Cost				sort_startup_cost = 0;
+	Cost				sort_per_row_cost = 0;
+
+	/* Number of rows needed by the query, see getQueryLimit */
+	int64				limit;
+
 	/* Extract a friendly version of the pathkeys. */
 	List	   *possiblePaths = pathKeys(planstate);
 
@@ -326,7 +475,7 @@ multicornGetForeignPaths(PlannerInfo *root,
 	pathes = lappend(pathes, create_foreignscan_path(root, baserel,
 			baserel->rows,
 			planstate->startupCost,
-			baserel->rows * baserel->width,
+			scanTotalCost(planstate, baserel->rows),
 			NIL,		/* no pathkeys */
 		    NULL,
 #if PG_VERSION_NUM >= 90500
@@ -345,6 +494,11 @@ multicornGetForeignPaths(PlannerInfo *root,
 			computeDeparsedSortGroup(deparsed, planstate, &apply_pathkeys,
 					&deparsed_pathkeys);
 		}
+		if (deparsed_pathkeys)
+		{
+			getSortCost(planstate, deparsed_pathkeys, &sort_startup_cost,
+						&sort_per_row_cost);
+		}
 	}
 
 	/* Add each ForeignPath previously found */
@@ -361,20 +515,365 @@ multicornGetForeignPaths(PlannerInfo *root,
 			ForeignPath *newpath;
 
 			newpath = create_foreignscan_path(root, baserel, path->path.rows,
-					path->path.startup_cost, path->path.total_cost,
+					path->path.startup_cost + sort_startup_cost,
+					path->path.total_cost + sort_startup_cost +
+					path->path.rows * sort_per_row_cost,
 					apply_pathkeys, NULL,
 #if PG_VERSION_NUM >= 90500
 					NULL,
 #endif
-					(void *) deparsed_pathkeys);
+					list_make1(deparsed_pathkeys));
 
 			newpath->path.param_info = path->path.param_info;
 			add_path(baserel, (Path *) newpath);
 		}
 	}
+
+	/* Add a path pushing the LIMIT down, if the wrapper accepts it */
+	if (getQueryLimit(root, baserel, &limit) &&
+		(root->query_pathkeys == NIL ||
+		 (deparsed_pathkeys != NIL &&
+		  pathkeys_contained_in(root->query_pathkeys, apply_pathkeys))) &&
+		canLimit(planstate, limit))
+	{
+		ForeignPath *limitpath;
+		double		rows = Min(baserel->rows, (double) limit);
+		Cost		startup_cost = planstate->startupCost;
+		Cost		total_cost = scanTotalCost(planstate, rows);
+
+		/*
+		 * If the query is ordered, the rows must be sorted by the wrapper
+		 * before the limit is applied.
+		 */
+		if (root->query_pathkeys == NIL)
+		{
+			apply_pathkeys = NIL;
+			deparsed_pathkeys = NIL;
+		}
+		else
+		{
+			startup_cost += sort_startup_cost;
+			total_cost += sort_startup_cost + rows * sort_per_row_cost;
+		}
+		limitpath = create_foreignscan_path(root, baserel,
+											rows,
+											startup_cost,
+											total_cost,
+											apply_pathkeys,
+											NULL,
+#if PG_VERSION_NUM >= 90500
+											NULL,
+#endif
+											list_make2(deparsed_pathkeys,
+													   makeInt8Const(limit)));
+		add_path(baserel, (Path *) limitpath);
+	}
 	errorCheck();
 }
 
+/*
+ * getQueryLimit
+ *		Get the number of rows the query needs from the scan of baserel,
+ *		that is the LIMIT plus the OFFSET, if the scan can apply it.
+ *
+ *		This is the case if the query has constant limit and offset, if the
+ *		scanned relation is the only one in the query, without grouping or
+ *		aggregates, and if every row returned by the scan is kept: the local
+ *		filters would otherwise be applied after the limit. Every restriction
+ *		must thus be enforced by the python fdw, see canEnforce.
+ */
+static bool
+getQueryLimit(PlannerInfo *root, RelOptInfo *baserel, int64 *limit)
+{
+	Query	   *parse = root->parse;
+	MulticornPlanState *planstate = baserel->fdw_private;
+	int64		offset = 0;
+
+	/* limit_tuples is only set if there is no grouping or aggregation */
+	if (root->limit_tuples < 0 ||
+		baserel->reloptkind != RELOPT_BASEREL ||
+		bms_membership(root->all_baserels) != BMS_SINGLETON ||
+		list_length(baserel->baserestrictinfo) !=
+		list_length(planstate->enforced_clauses))
+	{
+		return false;
+	}
+	if (parse->limitCount == NULL || !IsA(parse->limitCount, Const) ||
+		((Const *) parse->limitCount)->constisnull)
+	{
+		return false;
+	}
+	*limit = DatumGetInt64(((Const *) parse->limitCount)->constvalue);
+	if (parse->limitOffset != NULL)
+	{
+		if (!IsA(parse->limitOffset, Const))
+		{
+			return false;
+		}
+		if (!((Const *) parse->limitOffset)->constisnull)
+		{
+			offset = DatumGetInt64(((Const *) parse->limitOffset)->constvalue);
+		}
+	}
+	if (*limit < 0 || offset < 0 ||
+		offset > INT64CONST(0x7FFFFFFFFFFFFFFF) - *limit)
+	{
+		return false;
+	}
+	/* The offset is still applied by the Limit node */
+	*limit += offset;
+	return true;
+}
+
+#if PG_VERSION_NUM >= 90500
+/*
+ * multicornGetForeignJoinPaths
+ *		Add a path joining two foreign tables of the same server in the python
+ *		fdw, if it accepts the join.
+ *
+ *		Only inner and left joins between two tables are considered, whose
+ *		join clauses all compare a column of each table. The quals of the
+ *		tables are given to the python fdw, and rechecked on the joined rows:
+ *		the nullable side of a left join must not have any. The joined rows
+ *		hold the columns of the outer table, followed by those of the inner
+ *		table.
+ */
+static void
+multicornGetForeignJoinPaths(PlannerInfo *root, RelOptInfo *joinrel,
+							 RelOptInfo *outerrel, RelOptInfo *innerrel,
+							 JoinType jointype, JoinPathExtraData *extra)
+{
+	MulticornPlanState *outerstate = outerrel->fdw_private,
+			   *innerstate = innerrel->fdw_private,
+			   *planstate;
+	List	   *join_clauses = NIL,
+			   *outer_clauses,
+			   *inner_clauses = NIL,
+			   *outer_tlist = NIL,
+			   *inner_tlist = NIL,
+			   *vars;
+	ListCell   *lc;
+	double		rows;
+	int			width;
+	QualCost	recheck_cost;
+	Cost		startup_cost,
+				total_cost;
+	ForeignPath *path;
+
+	/* Joins locking rows, or with lateral references, are left to PostgreSQL */
+	if (joinrel->fdw_private != NULL ||
+		(jointype != JOIN_INNER && jointype != JOIN_LEFT) ||
+		outerrel->reloptkind != RELOPT_BASEREL ||
+		innerrel->reloptkind != RELOPT_BASEREL ||
+		outerstate == NULL || innerstate == NULL ||
+		root->parse->commandType != CMD_SELECT ||
+		root->parse->rowMarks != NIL ||
+		!bms_is_empty(joinrel->lateral_relids) ||
+		GetForeignTable(outerstate->foreigntableid)->serverid !=
+		GetForeignTable(innerstate->foreigntableid)->serverid)
+	{
+		return;
+	}
+	if (jointype == JOIN_LEFT && innerrel->baserestrictinfo != NIL)
+	{
+		return;
+	}
+	foreach(lc, list_concat(list_copy(outerrel->baserestrictinfo),
+							innerrel->baserestrictinfo))
+	{
+		/* Constant quals are applied above the scans of the tables */
+		if (((RestrictInfo *) lfirst(lc))->pseudoconstant)
+		{
+			return;
+		}
+	}
+	foreach(lc, extra->restrictlist)
+	{
+		RestrictInfo *rinfo = (RestrictInfo *) lfirst(lc);
+		List	   *clause;
+
+		/* Filters applied after a left join cannot be joined on */
+		if (jointype == JOIN_LEFT && rinfo->is_pushed_down)
+		{
+			return;
+		}
+		clause = deparseJoinClause(rinfo->clause, outerrel, innerrel, root);
+		if (clause == NIL)
+		{
+			return;
+		}
+		join_clauses = lappend(join_clauses, clause);
+	}
+	if (join_clauses == NIL)
+	{
+		/* Cross joins are left to PostgreSQL */
+		return;
+	}
+	outer_clauses = extract_actual_clauses(outerrel->baserestrictinfo, false);
+	if (jointype == JOIN_INNER)
+	{
+		inner_clauses = extract_actual_clauses(innerrel->baserestrictinfo, false);
+	}
+	/* The scan returns the columns needed above the join, and by the quals */
+	vars = list_concat(list_copy(joinrel->reltargetlist),
+					   pull_var_clause((Node *) list_concat(list_copy(outer_clauses),
+															inner_clauses),
+									   PVC_REJECT_AGGREGATES,
+									   PVC_INCLUDE_PLACEHOLDERS));
+	width = joinrel->width;
+	foreach(lc, vars)
+	{
+		Var		   *var = (Var *) lfirst(lc);
+
+		if (!IsA(var, Var) || var->varattno <= 0 || var->varlevelsup != 0)
+		{
+			return;
+		}
+		if (var->varno == outerrel->relid)
+		{
+			outer_tlist = addJoinColumn(outer_tlist, var);
+		}
+		else if (var->varno == innerrel->relid)
+		{
+			inner_tlist = addJoinColumn(inner_tlist, var);
+		}
+		else
+		{
+			return;
+		}
+	}
+	planstate = palloc0(sizeof(MulticornPlanState));
+	planstate->fdw_instance = outerstate->fdw_instance;
+	planstate->foreigntableid = outerstate->foreigntableid;
+	planstate->startupCost = outerstate->startupCost;
+	planstate->fdwCosts = outerstate->fdwCosts;
+	/* Without a cost from the python fdw, a row costs its width */
+	planstate->perRowCost = outerstate->fdwCosts ? outerstate->perRowCost :
+		width;
+	planstate->limit = -1;
+	planstate->joined = true;
+	planstate->jointype = jointype;
+	planstate->join_clauses = join_clauses;
+	planstate->inner_foreigntableid = innerstate->foreigntableid;
+	planstate->outer_relid = outerrel->relid;
+	planstate->inner_relid = innerrel->relid;
+	planstate->outer_clauses = outer_clauses;
+	planstate->inner_clauses = inner_clauses;
+	foreach(lc, outer_tlist)
+	{
+		Var		   *var = (Var *) ((TargetEntry *) lfirst(lc))->expr;
+
+		planstate->target_list = lappend(planstate->target_list,
+										 colnameFromVar(var, root, outerstate));
+	}
+	foreach(lc, inner_tlist)
+	{
+		TargetEntry *entry = (TargetEntry *) lfirst(lc);
+
+		planstate->inner_target_list = lappend(planstate->inner_target_list,
+											   colnameFromVar((Var *) entry->expr,
+															  root, innerstate));
+		entry->resno += list_length(outer_tlist);
+	}
+	if (!canJoin(planstate, innerstate->fdw_instance))
+	{
+		return;
+	}
+	planstate->scan_tlist = list_concat(outer_tlist, inner_tlist);
+	planstate->numattrs = list_length(planstate->scan_tlist);
+	joinrel->fdw_private = planstate;
+	rows = joinrel->rows;
+
+	/* The quals of both tables are rechecked on every joined row */
+	cost_qual_eval(&recheck_cost, list_concat(list_copy(outer_clauses),
+											  inner_clauses), root);
+	planstate->localQualCost = recheck_cost.per_tuple;
+	startup_cost = planstate->startupCost + recheck_cost.startup;
+	total_cost = scanTotalCost(planstate, rows) + recheck_cost.startup;
+	path = create_foreignscan_path(root, joinrel,
+								   rows,
+								   startup_cost,
+								   total_cost,
+								   NIL,	/* no pathkeys */
+								   NULL,
+								   NULL,
+								   NULL);
+	add_path(joinrel, (Path *) path);
+}
+
+/*
+ * deparseJoinClause
+ *		Returns the outer column name, the operator name and the inner column
+ *		name of a join clause comparing a column of each table, as a list of
+ *		strings. Returns NIL for any other clause.
+ */
+static List *
+deparseJoinClause(Expr *clause, RelOptInfo *outerrel, RelOptInfo *innerrel,
+				  PlannerInfo *root)
+{
+	OpExpr	   *op = (OpExpr *) clause;
+	Var		   *left,
+			   *right;
+	Oid			opno;
+
+	if (!IsA(clause, OpExpr) || list_length(op->args) != 2)
+	{
+		return NIL;
+	}
+	left = (Var *) linitial(op->args);
+	right = (Var *) lsecond(op->args);
+	opno = op->opno;
+	if (!IsA(left, Var) || !IsA(right, Var) ||
+		left->varattno <= 0 || right->varattno <= 0 ||
+		left->varlevelsup != 0 || right->varlevelsup != 0)
+	{
+		return NIL;
+	}
+	if (left->varno == innerrel->relid && right->varno == outerrel->relid)
+	{
+		/* Put the outer column on the left */
+		Var		   *tmp = left;
+
+		left = right;
+		right = tmp;
+		opno = get_commutator(opno);
+		if (opno == InvalidOid)
+		{
+			return NIL;
+		}
+	}
+	if (left->varno != outerrel->relid || right->varno != innerrel->relid)
+	{
+		return NIL;
+	}
+	return list_make3(colnameFromVar(left, root, NULL),
+					  makeString(get_opname(opno)),
+					  colnameFromVar(right, root, NULL));
+}
+
+/*
+ * addJoinColumn
+ *		Add a column to the target list of one of the tables of a join scan,
+ *		if it is not there yet.
+ */
+static List *
+addJoinColumn(List *tlist, Var *var)
+{
+	ListCell   *lc;
+
+	foreach(lc, tlist)
+	{
+		if (((Var *) ((TargetEntry *) lfirst(lc))->expr)->varattno == var->varattno)
+		{
+			return tlist;
+		}
+	}
+	return lappend(tlist, makeTargetEntry((Expr *) copyObject(var),
+										  list_length(tlist) + 1,
+										  NULL, false));
+}
+#endif
+
 /*
  * multicornGetForeignPlan
  *		Create a ForeignScan plan node for scanning the foreign table
@@ -394,7 +893,49 @@ multicornGetForeignPlan(PlannerInfo *root,
 	Index		scan_relid = baserel->relid;
 	MulticornPlanState *planstate = (MulticornPlanState *) baserel->fdw_private;
 	ListCell   *lc;
+	List	   *local_clauses = NIL;
+	List	   *recheck_clauses = NIL;
+
+#if PG_VERSION_NUM >= 90500
+	if (planstate->joined)
+	{
+		/*
+		 * The quals of both tables are rechecked on the joined rows, see
+		 * multicornGetForeignJoinPaths.
+		 */
+		return make_foreignscan(tlist,
+								list_concat(list_copy(planstate->outer_clauses),
+											planstate->inner_clauses),
+								0,
+								NIL,
+								serializePlanState(planstate),
+								planstate->scan_tlist,
+								NIL,
+								outer_plan);
+	}
+#endif
+	/*
+	 * The clauses enforced by the python fdw are left out of the local
+	 * filter. They are still checked when rows are rechecked for concurrent
+	 * updates.
+	 */
+	foreach(lc, scan_clauses)
+	{
+		RestrictInfo *rinfo = (RestrictInfo *) lfirst(lc);
 
+		if (rinfo->pseudoconstant)
+		{
+			continue;
+		}
+		if (list_member_ptr(planstate->enforced_clauses, rinfo))
+		{
+			recheck_clauses = lappend(recheck_clauses, rinfo->clause);
+		}
+		else
+		{
+			local_clauses = lappend(local_clauses, rinfo->clause);
+		}
+	}
 	scan_clauses = extract_actual_clauses(scan_clauses, false);
 	/* Extract the quals coming from a parameterized path, if any */
 	if (best_path->path.param_info)
@@ -406,15 +947,27 @@ multicornGetForeignPlan(PlannerInfo *root,
 								&planstate->qual_list);
 		}
 	}
-	planstate->pathkeys = (List *) best_path->fdw_private;
+	/* The path private list holds the pathkeys, and the limit if any */
+	planstate->pathkeys = NIL;
+	planstate->limit = -1;
+	if (best_path->fdw_private != NIL)
+	{
+		List	   *pathprivate = (List *) best_path->fdw_private;
+
+		planstate->pathkeys = (List *) linitial(pathprivate);
+		if (list_length(pathprivate) > 1)
+		{
+			planstate->limit = DatumGetInt64(((Const *) lsecond(pathprivate))->constvalue);
+		}
+	}
 	return make_foreignscan(tlist,
-							scan_clauses,
+							local_clauses,
 							scan_relid,
 							scan_clauses,		/* no expressions to evaluate */
 							serializePlanState(planstate)
 #if PG_VERSION_NUM >= 90500
 							, NULL
-							, NULL /* All quals are meant to be rechecked */
+							, recheck_clauses
 							, NULL
 #endif
 							);
@@ -440,6 +993,42 @@ multicornExplainForeignScan(ForeignScanState *node, ExplainState *es)
 	}
 	Py_DECREF(p_iterable);
 	errorCheck();
+	if (((MulticornExecState *) node->fdw_state)->result_cache != NULL)
+	{
+		explainResultCache(((MulticornExecState *) node->fdw_state)->result_cache,
+						   es);
+	}
+}
+
+/*
+ * markUnrequestedColumns
+ *		Flag the columns which are not part of the target list, so that
+ *		they are left NULL instead of being converted from the python rows.
+ */
+static void
+markUnrequestedColumns(ConversionInfo ** cinfos, int numattrs,
+					   List *target_list)
+{
+	int			i;
+
+	for (i = 0; i < numattrs; i++)
+	{
+		ListCell   *lc;
+
+		if (cinfos[i] == NULL)
+		{
+			continue;
+		}
+		cinfos[i]->unrequested = true;
+		foreach(lc, target_list)
+		{
+			if (strcmp(strVal(lfirst(lc)), cinfos[i]->attrname) == 0)
+			{
+				cinfos[i]->unrequested = false;
+				break;
+			}
+		}
+	}
 }
 
 /*
@@ -454,13 +1043,12 @@ multicornBeginForeignScan(ForeignScanState *node, int eflags)
 {
 	ForeignScan *fscan = (ForeignScan *) node->ss.ps.plan;
 	MulticornExecState *execstate;
-	TupleDesc	tupdesc = RelationGetDescr(node->ss.ss_currentRelation);
+	TupleDesc	tupdesc = node->ss.ss_ScanTupleSlot->tts_tupleDescriptor;
 	ListCell   *lc;
 
 	execstate = initializeExecState(fscan->fdw_private);
 	execstate->values = palloc(sizeof(Datum) * tupdesc->natts);
 	execstate->nulls = palloc(sizeof(bool) * tupdesc->natts);
-	execstate->qual_list = NULL;
 	foreach(lc, fscan->fdw_exprs)
 	{
 		extractRestrictions(bms_make_singleton(fscan->scan.scanrelid),
@@ -468,9 +1056,183 @@ multicornBeginForeignScan(ForeignScanState *node, int eflags)
 							&execstate->qual_list);
 	}
 	initConversioninfo(execstate->cinfos, TupleDescGetAttInMetadata(tupdesc));
+	/* The rows of joined scans only hold the requested values */
+	if (!execstate->joined)
+	{
+		markUnrequestedColumns(execstate->cinfos, tupdesc->natts,
+							   execstate->target_list);
+	}
+	execstate->batch_mode = getBatchSize(execstate->fdw_instance) > 0;
+	if (execstate->batch_mode)
+	{
+		/* Allocated here, since rows are fetched in a short-lived context */
+		execstate->column_readers = palloc0(sizeof(MulticornColumnReader) *
+											tupdesc->natts);
+	}
+	if (execstate->result_cache_size > 0 && !execstate->joined &&
+		!(eflags & EXEC_FLAG_EXPLAIN_ONLY))
+	{
+		execstate->result_cache = createResultCache(node,
+													execstate->qual_list,
+											 execstate->result_cache_size);
+	}
 	node->fdw_state = execstate;
 }
 
+/*
+ * nextBatchedRow
+ *		Returns the next row from the current block of a batched scan,
+ *		fetching the next block from the python iterator once the current one
+ *		is exhausted.
+ *
+ *		Rows from a ColumnBlock or an Arrow record batch are directly stored in
+ *		the slot, in which case stored is set to true and NULL is returned.
+ *		Otherwise, returns a new reference, or NULL when the iterator is
+ *		exhausted.
+ */
+static PyObject *
+nextBatchedRow(MulticornExecState *execstate, TupleTableSlot *slot,
+			   bool *stored)
+{
+	PyObject   *p_row;
+	int			natts = slot->tts_tupleDescriptor->natts;
+
+	*stored = false;
+	while (true)
+	{
+		PyObject   *p_block;
+
+		if (execstate->p_columnblock != NULL)
+		{
+			if (execstate->batch_index < execstate->columnblock_length)
+			{
+				columnBlockToTuple(execstate, execstate->batch_index, slot);
+				execstate->batch_index++;
+				*stored = true;
+				return NULL;
+			}
+			releaseColumnBlock(execstate, natts);
+		}
+		else if (execstate->p_batch != NULL &&
+				 execstate->batch_index < PySequence_Fast_GET_SIZE(execstate->p_batch))
+		{
+			break;
+		}
+		Py_CLEAR(execstate->p_batch);
+		if (execstate->p_arrow_batches != NULL)
+		{
+			/* Record batches of an Arrow table */
+			p_block = PyIter_Next(execstate->p_arrow_batches);
+			errorCheck();
+			if (p_block == NULL)
+			{
+				Py_CLEAR(execstate->p_arrow_batches);
+				continue;
+			}
+		}
+		else
+		{
+			p_block = PyIter_Next(execstate->p_iterator);
+			errorCheck();
+			if (p_block == NULL)
+			{
+				return NULL;
+			}
+		}
+		if (isArrowTable(p_block))
+		{
+			PyObject   *p_batches = PyObject_CallMethod(p_block, "to_batches",
+														"()");
+
+			Py_DECREF(p_block);
+			errorCheck();
+			execstate->p_arrow_batches = PyObject_GetIter(p_batches);
+			Py_DECREF(p_batches);
+			errorCheck();
+			continue;
+		}
+		if (isColumnBlock(p_block))
+		{
+			beginColumnBlock(execstate, p_block, natts);
+		}
+		else if (isArrowRecordBatch(p_block))
+		{
+			beginArrowBatch(execstate, p_block, natts);
+		}
+		else
+		{
+			execstate->p_batch = PySequence_Fast(p_block,
+								"execute should yield sequences of rows");
+			errorCheck();
+		}
+		Py_DECREF(p_block);
+		execstate->batch_index = 0;
+	}
+	p_row = PySequence_Fast_GET_ITEM(execstate->p_batch, execstate->batch_index);
+	execstate->batch_index++;
+	Py_INCREF(p_row);
+	return p_row;
+}
+
+
+/*
+ * startNextIterator
+ *		Start the python iterator of the scan.
+ *
+ *		After a rescan of a plain scan, the python fdw can restart the scan
+ *		itself, see executeRescan. The scans of a batched join are executed
+ *		again with the keys of the next batch.
+ */
+static void
+startNextIterator(ForeignScanState *node)
+{
+	MulticornExecState *execstate = node->fdw_state;
+
+	if (execstate->rescanned)
+	{
+		execstate->rescanned = false;
+		if (!execstate->joined && execstate->key_qual == NULL &&
+			executeRescan(node))
+		{
+			return;
+		}
+	}
+	execute(node, NULL);
+}
+
+/*
+ * nextScanRow
+ *		Returns the next row from the python iterator, as a new reference, or
+ *		NULL at the end of the scan.
+ *
+ *		Rows read natively from a ColumnBlock or an Arrow record batch are
+ *		directly stored in the slot, in which case stored is set to true.
+ */
+static PyObject *
+nextScanRow(ForeignScanState *node, TupleTableSlot *slot, bool *stored)
+{
+	MulticornExecState *execstate = node->fdw_state;
+	PyObject   *p_value;
+
+	*stored = false;
+	if (execstate->p_iterator == NULL)
+	{
+		startNextIterator(node);
+	}
+	if (execstate->p_iterator == Py_None)
+	{
+		/* No iterator returned from get_iterator */
+		Py_DECREF(execstate->p_iterator);
+		return NULL;
+	}
+	if (execstate->batch_mode)
+	{
+		return nextBatchedRow(execstate, slot, stored);
+	}
+	p_value = PyIter_Next(execstate->p_iterator);
+	errorCheck();
+	return p_value;
+}
 
 /*
  * multicornIterateForeignScan
@@ -478,52 +1240,89 @@ multicornBeginForeignScan(ForeignScanState *node, int eflags)
  *		EOF.
  *
  *		This is done by iterating over the result from the "execute" python
- *		method.
+ *		method. In batch mode, every item yielded by the python iterator is a
+ *		block of rows (or a ColumnBlock, or Arrow data), which is drained before
+ *		resuming the iterator.
+ *
+ *		With a result cache, the rows of an execution whose parameters were
+ *		already seen are returned from the cache, and the other ones are
+ *		stored into it.
  */
 static TupleTableSlot *
 multicornIterateForeignScan(ForeignScanState *node)
 {
 	TupleTableSlot *slot = node->ss.ss_ScanTupleSlot;
 	MulticornExecState *execstate = node->fdw_state;
+	struct MulticornResultCache *cache = execstate->result_cache;
 	PyObject   *p_value;
+	bool		stored;
 
-	if (execstate->p_iterator == NULL)
+	ExecClearTuple(slot);
+	slot->tts_values = execstate->values;
+	slot->tts_isnull = execstate->nulls;
+	if (cache != NULL)
 	{
-		execute(node, NULL);
+		if (!execstate->scan_started)
+		{
+			execstate->scan_started = true;
+			resultCacheLookup(node, cache);
+		}
+		if (resultCacheNext(cache, slot))
+		{
+			return slot;
+		}
 	}
-	ExecClearTuple(slot);
-	if (execstate->p_iterator == Py_None)
+	p_value = nextScanRow(node, slot, &stored);
+	if (stored)
 	{
-		/* No iterator returned from get_iterator */
-		Py_DECREF(execstate->p_iterator);
+		ExecStoreVirtualTuple(slot);
+		if (cache != NULL)
+		{
+			resultCacheStore(cache, slot);
+		}
 		return slot;
 	}
-	p_value = PyIter_Next(execstate->p_iterator);
-	errorCheck();
 	/* A none value results in an empty slot. */
 	if (p_value == NULL || p_value == Py_None)
 	{
 		Py_XDECREF(p_value);
+		if (cache != NULL)
+		{
+			resultCacheFinish(cache);
+		}
 		return slot;
 	}
-	slot->tts_values = execstate->values;
-	slot->tts_isnull = execstate->nulls;
 	pythonResultToTuple(p_value, slot, execstate->cinfos, execstate->buffer);
 	ExecStoreVirtualTuple(slot);
 	Py_DECREF(p_value);
+	if (cache != NULL)
+	{
+		resultCacheStore(cache, slot);
+	}
 
 	return slot;
 }
 
 /*
  * multicornReScanForeignScan
- *		Restart the scan
+ *		Restart the scan. The python quals are kept, and only the ones
+ *		depending on parameters are evaluated again on the next execution.
  */
 static void
 multicornReScanForeignScan(ForeignScanState *node)
 {
 	MulticornExecState *state = node->fdw_state;
 
+	state->rescanned = true;
+	state->scan_started = false;
+	if (state->result_cache != NULL)
+	{
+		resultCacheReset(state->result_cache);
+	}
+	Py_CLEAR(state->p_batch);
+	Py_CLEAR(state->p_arrow_batches);
+	releaseColumnBlock(state,
+					   node->ss.ss_ScanTupleSlot->tts_tupleDescriptor->natts);
 	if (state->p_iterator)
 	{
 		Py_DECREF(state->p_iterator);
@@ -544,12 +1343,26 @@ multicornEndForeignScan(ForeignScanState *node)
 	errorCheck();
 	Py_DECREF(result);
 	Py_DECREF(state->fdw_instance);
+	Py_CLEAR(state->p_batch);
+	Py_CLEAR(state->p_arrow_batches);
+	releaseColumnBlock(state,
+					   node->ss.ss_ScanTupleSlot->tts_tupleDescriptor->natts);
 	Py_XDECREF(state->p_iterator);
 	state->p_iterator = NULL;
+	Py_CLEAR(state->p_quals);
+	releaseConversionInfos(state->cinfos,
+						   node->ss.ss_ScanTupleSlot->tts_tupleDescriptor->natts);
+	if (state->joined)
+	{
+		Py_DECREF(state->inner_fdw_instance);
+		releaseConversionInfos(state->outer_cinfos, state->outer_natts);
+		releaseConversionInfos(state->inner_cinfos, state->inner_natts);
+	}
 }
 
 
 
+
 #if PG_VERSION_NUM >= 90300
 /*
  * multicornAddForeigUpdateTargets
@@ -656,6 +1469,7 @@ multicornBeginForeignModify(ModifyTableState *mtstate,
 	{
 		TupleDesc	resultTupleDesc = ps->ps_ResultTupleSlot->tts_tupleDescriptor;
 
+		modstate->resultNatts = resultTupleDesc->natts;
 		modstate->resultCinfos = palloc0(sizeof(ConversionInfo *) *
 										 resultTupleDesc->natts);
 		initConversioninfo(modstate->resultCinfos, TupleDescGetAttInMetadata(resultTupleDesc));
@@ -674,13 +1488,122 @@ multicornBeginForeignModify(ModifyTableState *mtstate,
 		}
 	}
 	modstate->rowidAttno = ExecFindJunkAttributeInTlist(subplan->targetlist, modstate->rowidAttrName);
+	modstate->operation = mtstate->operation;
+	if (canBufferModifications(mtstate, resultRelInfo))
+	{
+		modstate->modifyBatchSize = getModifyBatchSize(modstate->fdw_instance);
+	}
 	resultRelInfo->ri_FdwState = modstate;
 }
 
+/*
+ * canBufferModifications
+ *		Returns true if the rows modified by the given ModifyTable can be
+ *		sent to the python side later, by batches.
+ *
+ *		This is not the case if the executor needs the row stored on the
+ *		foreign side right away: for a RETURNING clause, for AFTER ROW
+ *		triggers or for WITH CHECK OPTION constraints.
+ */
+static bool
+canBufferModifications(ModifyTableState *mtstate, ResultRelInfo *resultRelInfo)
+{
+	ModifyTable *plan = (ModifyTable *) mtstate->ps.plan;
+	TriggerDesc *trigdesc = resultRelInfo->ri_TrigDesc;
+
+	if (plan->returningLists != NIL)
+	{
+		return false;
+	}
+#if PG_VERSION_NUM >= 90400
+	if (plan->withCheckOptionLists != NIL)
+	{
+		return false;
+	}
+#endif
+	if (trigdesc == NULL)
+	{
+		return true;
+	}
+	switch (mtstate->operation)
+	{
+		case CMD_INSERT:
+			return !trigdesc->trig_insert_after_row;
+		case CMD_UPDATE:
+			return !trigdesc->trig_update_after_row;
+		case CMD_DELETE:
+			return !trigdesc->trig_delete_after_row;
+		default:
+			return false;
+	}
+}
+
+/*
+ * flushPendingModifications
+ *		Give the buffered rows to the bulk python method matching the
+ *		operation: bulk_insert, bulk_update or bulk_delete.
+ */
+static void
+flushPendingModifications(MulticornModifyState * modstate)
+{
+	PyObject   *p_pending = modstate->p_pending,
+			   *p_result;
+	char	   *method = NULL;
+
+	if (p_pending == NULL)
+	{
+		return;
+	}
+	switch (modstate->operation)
+	{
+		case CMD_INSERT:
+			method = "bulk_insert";
+			break;
+		case CMD_UPDATE:
+			method = "bulk_update";
+			break;
+		case CMD_DELETE:
+			method = "bulk_delete";
+			break;
+		default:
+			elog(ERROR, "unexpected operation: %d", (int) modstate->operation);
+	}
+	/* Forget the rows first, so that they are not sent again on error */
+	modstate->p_pending = NULL;
+	p_result = PyObject_CallMethod(modstate->fdw_instance, method, "(O)",
+								   p_pending);
+	Py_DECREF(p_pending);
+	errorCheck();
+	Py_DECREF(p_result);
+}
+
+/*
+ * bufferModification
+ *		Append a row to the pending rows, and flush them once a batch is full.
+ *		The row reference is stolen.
+ */
+static void
+bufferModification(MulticornModifyState * modstate, PyObject *p_row)
+{
+	if (modstate->p_pending == NULL)
+	{
+		modstate->p_pending = PyList_New(0);
+	}
+	PyList_Append(modstate->p_pending, p_row);
+	Py_DECREF(p_row);
+	errorCheck();
+	if (PyList_GET_SIZE(modstate->p_pending) >= modstate->modifyBatchSize)
+	{
+		flushPendingModifications(modstate);
+	}
+}
+
 /*
  * multicornExecForeignInsert
  *		Execute a foreign insert operation
- *		This is done by calling the python "insert" method.
+ *		This is done by calling the python "insert" method, or by buffering
+ *		the row for the "bulk_insert" method if the wrapper defines a modify
+ *		batch size.
  */
 static TupleTableSlot *
 multicornExecForeignInsert(EState *estate, ResultRelInfo *resultRelInfo,
@@ -689,8 +1612,14 @@ multicornExecForeignInsert(EState *estate, ResultRelInfo *resultRelInfo,
 	MulticornModifyState *modstate = resultRelInfo->ri_FdwState;
 	PyObject   *fdw_instance = modstate->fdw_instance;
 	PyObject   *values = tupleTableSlotToPyObject(slot, modstate->cinfos);
-	PyObject   *p_new_value = PyObject_CallMethod(fdw_instance, "insert", "(O)", values);
+	PyObject   *p_new_value;
 
+	if (modstate->modifyBatchSize > 1)
+	{
+		bufferModification(modstate, values);
+		return slot;
+	}
+	p_new_value = PyObject_CallMethod(fdw_instance, "insert", "(O)", values);
 	errorCheck();
 	if (p_new_value && p_new_value != Py_None)
 	{
@@ -708,7 +1637,8 @@ multicornExecForeignInsert(EState *estate, ResultRelInfo *resultRelInfo,
  * multicornExecForeignDelete
  *		Execute a foreign delete operation
  *		This is done by calling the python "delete" method, with the opaque
- *		rowid that was supplied.
+ *		rowid that was supplied, or by buffering the rowid for the
+ *		"bulk_delete" method if the wrapper defines a modify batch size.
  */
 static TupleTableSlot *
 multicornExecForeignDelete(EState *estate, ResultRelInfo *resultRelInfo,
@@ -723,6 +1653,11 @@ multicornExecForeignDelete(EState *estate, ResultRelInfo *resultRelInfo,
 	Datum		value = ExecGetJunkAttribute(planSlot, modstate->rowidAttno, &is_null);
 
 	p_row_id = datumToPython(value, cinfo->atttypoid, cinfo);
+	if (modstate->modifyBatchSize > 1)
+	{
+		bufferModification(modstate, p_row_id);
+		return slot;
+	}
 	p_new_value = PyObject_CallMethod(fdw_instance, "delete", "(O)", p_row_id);
 	errorCheck();
 	if (p_new_value == NULL || p_new_value == Py_None)
@@ -743,7 +1678,9 @@ multicornExecForeignDelete(EState *estate, ResultRelInfo *resultRelInfo,
  * multicornExecForeignUpdate
  *		Execute a foreign update operation
  *		This is done by calling the python "update" method, with the opaque
- *		rowid that was supplied.
+ *		rowid that was supplied, or by buffering the (rowid, new values) pair
+ *		for the "bulk_update" method if the wrapper defines a modify batch
+ *		size.
  */
 static TupleTableSlot *
 multicornExecForeignUpdate(EState *estate, ResultRelInfo *resultRelInfo,
@@ -759,8 +1696,18 @@ multicornExecForeignUpdate(EState *estate, ResultRelInfo *resultRelInfo,
 	Datum		value = ExecGetJunkAttribute(planSlot, modstate->rowidAttno, &is_null);
 
 	p_row_id = datumToPython(value, cinfo->atttypoid, cinfo);
+	if (modstate->modifyBatchSize > 1)
+	{
+		PyObject   *p_pair = PyTuple_Pack(2, p_row_id, p_value);
+
+		Py_DECREF(p_row_id);
+		Py_DECREF(p_value);
+		bufferModification(modstate, p_pair);
+		return slot;
+	}
 	p_new_value = PyObject_CallMethod(fdw_instance, "update", "(O,O)", p_row_id,
 									  p_value);
+	Py_DECREF(p_value);
 	errorCheck();
 	if (p_new_value != NULL && p_new_value != Py_None)
 	{
@@ -783,11 +1730,16 @@ multicornEndForeignModify(EState *estate, ResultRelInfo *resultRelInfo)
 
 {
 	MulticornModifyState *modstate = resultRelInfo->ri_FdwState;
-	PyObject   *result = PyObject_CallMethod(modstate->fdw_instance, "end_modify", "()");
+	PyObject   *result;
 
+	flushPendingModifications(modstate);
+	result = PyObject_CallMethod(modstate->fdw_instance, "end_modify", "()");
 	errorCheck();
 	Py_DECREF(modstate->fdw_instance);
 	Py_DECREF(result);
+	releaseConversionInfos(modstate->cinfos,
+						   RelationGetDescr(resultRelInfo->ri_RelationDesc)->natts);
+	releaseConversionInfos(modstate->resultCinfos, modstate->resultNatts);
 }
 
 /*
@@ -869,6 +1821,98 @@ multicorn_xact_callback(XactEvent event, void *arg)
 	}
 }
 
+/*
+ * multicornAnalyzeForeignTable
+ *		Let ANALYZE sample the rows of the table, if the python fdw implements
+ *		the sample_rows method.
+ */
+static bool
+multicornAnalyzeForeignTable(Relation relation,
+							 AcquireSampleRowsFunc *func,
+							 BlockNumber *totalpages)
+{
+	PyObject   *fdw_instance = getInstance(RelationGetRelid(relation));
+	bool		result = canAnalyze(fdw_instance);
+
+	Py_DECREF(fdw_instance);
+	if (!result)
+	{
+		return false;
+	}
+	*func = multicornAcquireSampleRows;
+
+	/*
+	 * The python fdw has no notion of pages, but a non-zero relpages tells
+	 * the planner that the table has been analyzed, see
+	 * multicornGetForeignRelSize.
+	 */
+	*totalpages = 1;
+	return true;
+}
+
+/*
+ * multicornAcquireSampleRows
+ *		Fetch a random sample of the rows of the table, and an estimate of
+ *		their total number, from the python fdw.
+ */
+static int
+multicornAcquireSampleRows(Relation relation, int elevel,
+						   HeapTuple *rows, int targrows,
+						   double *totalrows,
+						   double *totaldeadrows)
+{
+	PyObject   *fdw_instance = getInstance(RelationGetRelid(relation)),
+			   *p_sample,
+			   *p_total,
+			   *p_iterator,
+			   *p_row;
+	TupleDesc	desc = RelationGetDescr(relation);
+	ConversionInfo **cinfos = palloc0(sizeof(ConversionInfo *) * desc->natts);
+	StringInfo	buffer = makeStringInfo();
+	TupleTableSlot *slot;
+	int			numrows = 0;
+
+	initConversioninfo(cinfos, TupleDescGetAttInMetadata(desc));
+	p_sample = PyObject_CallMethod(fdw_instance, "sample_rows", "(i)",
+								   targrows);
+	errorCheck();
+	Py_DECREF(fdw_instance);
+	if (!PyTuple_Check(p_sample) || PyTuple_GET_SIZE(p_sample) != 2)
+	{
+		Py_DECREF(p_sample);
+		elog(ERROR, "The sample_rows python method should return a tuple of length 2");
+	}
+	p_total = PyNumber_Float(PyTuple_GetItem(p_sample, 1));
+	errorCheck();
+	*totalrows = PyFloat_AsDouble(p_total);
+	*totaldeadrows = 0;
+	Py_DECREF(p_total);
+	p_iterator = PyObject_GetIter(PyTuple_GetItem(p_sample, 0));
+	errorCheck();
+	slot = MakeSingleTupleTableSlot(desc);
+	while (numrows < targrows && (p_row = PyIter_Next(p_iterator)) != NULL)
+	{
+		ExecClearTuple(slot);
+		pythonResultToTuple(p_row, slot, cinfos, buffer);
+		Py_DECREF(p_row);
+		rows[numrows++] = heap_form_tuple(desc, slot->tts_values,
+										  slot->tts_isnull);
+	}
+	Py_DECREF(p_iterator);
+	Py_DECREF(p_sample);
+	errorCheck();
+	ExecDropSingleTupleTableSlot(slot);
+	/* The table cannot be smaller than the sample */
+	if (*totalrows < numrows)
+	{
+		*totalrows = numrows;
+	}
+	ereport(elevel,
+			(errmsg("\"%s\": table contains %.0f rows, %d rows in sample",
+					RelationGetRelationName(relation), *totalrows, numrows)));
+	return numrows;
+}
+
 #if PG_VERSION_NUM >= 90500
 static List *
 multicornImportForeignSchema(ImportForeignSchemaStmt * stmt,
@@ -991,10 +2035,48 @@ serializePlanState(MulticornPlanState * state)
 	result = lappend(result, state->target_list);
 
 	result = lappend(result, serializeDeparsedSortGroup(state->pathkeys));
+	result = lappend(result, makeInt8Const(state->limit));
+	result = lappend(result, makeBoolConst(state->joined, false));
+	result = lappend(result, makeConst(INT4OID,
+					-1, InvalidOid, 4, Int32GetDatum(state->jointype), false, true));
+	result = lappend(result, state->join_clauses);
+	result = lappend(result, makeConst(INT4OID,
+					-1, InvalidOid, 4, ObjectIdGetDatum(state->inner_foreigntableid), false, true));
+	result = lappend(result, state->inner_target_list);
+	result = lappend(result, makeConst(INT4OID,
+					-1, InvalidOid, 4, Int32GetDatum(state->outer_relid), false, true));
+	result = lappend(result, makeConst(INT4OID,
+					-1, InvalidOid, 4, Int32GetDatum(state->inner_relid), false, true));
+	result = lappend(result, copyObject(state->outer_clauses));
+	result = lappend(result, copyObject(state->inner_clauses));
 
 	return result;
 }
 
+static Const *
+makeInt8Const(int64 value)
+{
+	return makeConst(INT8OID, -1, InvalidOid, sizeof(int64),
+					 Int64GetDatum(value), false, FLOAT8PASSBYVAL);
+}
+
+/*
+ * Build the conversion infos of the columns of a foreign table, used to
+ * convert the quals of a join scan.
+ */
+static ConversionInfo **
+tableConversionInfos(Oid foreigntableid, int *natts)
+{
+	Relation	rel = RelationIdGetRelation(foreigntableid);
+	TupleDesc	desc = RelationGetDescr(rel);
+	ConversionInfo **cinfos = palloc0(sizeof(ConversionInfo *) * desc->natts);
+
+	initConversioninfo(cinfos, TupleDescGetAttInMetadata(desc));
+	*natts = desc->natts;
+	RelationClose(rel);
+	return cinfos;
+}
+
 /*
  *	"Deserialize" an internal state and inject it in an
  *	MulticornExecState
@@ -1007,13 +2089,45 @@ initializeExecState(void *internalstate)
 	AttrNumber	attnum = ((Const *) linitial(values))->constvalue;
 	Oid			foreigntableid = ((Const *) lsecond(values))->constvalue;
 	List		*pathkeys;
+	CacheEntry *entry;
 
 	/* Those list must be copied, because their memory context can become */
 	/* invalid during the execution (in particular with the cursor interface) */
 	execstate->target_list = copyObject(lthird(values));
 	pathkeys = lfourth(values);
 	execstate->pathkeys = deserializeDeparsedSortGroup(pathkeys);
-	execstate->fdw_instance = getInstance(foreigntableid);
+	execstate->limit = DatumGetInt64(((Const *) list_nth(values, 4))->constvalue);
+	execstate->joined = DatumGetBool(((Const *) list_nth(values, 5))->constvalue);
+	if (execstate->joined)
+	{
+		Oid			inner_foreigntableid = DatumGetObjectId(((Const *) list_nth(values, 8))->constvalue);
+		Index		outer_relid = DatumGetInt32(((Const *) list_nth(values, 10))->constvalue),
+					inner_relid = DatumGetInt32(((Const *) list_nth(values, 11))->constvalue);
+		ListCell   *lc;
+
+		execstate->jointype = DatumGetInt32(((Const *) list_nth(values, 6))->constvalue);
+		execstate->join_clauses = copyObject(list_nth(values, 7));
+		execstate->inner_fdw_instance = getInstance(inner_foreigntableid);
+		execstate->inner_target_list = copyObject(list_nth(values, 9));
+		/* The quals of each table are given to the python fdw */
+		foreach(lc, (List *) list_nth(values, 12))
+		{
+			extractRestrictions(bms_make_singleton(outer_relid),
+								(Expr *) lfirst(lc), &execstate->qual_list);
+		}
+		foreach(lc, (List *) list_nth(values, 13))
+		{
+			extractRestrictions(bms_make_singleton(inner_relid),
+								(Expr *) lfirst(lc), &execstate->inner_qual_list);
+		}
+		execstate->outer_cinfos = tableConversionInfos(foreigntableid,
+													   &execstate->outer_natts);
+		execstate->inner_cinfos = tableConversionInfos(inner_foreigntableid,
+													   &execstate->inner_natts);
+	}
+	entry = getCacheEntry(foreigntableid);
+	execstate->fdw_instance = entry->value;
+	execstate->result_cache_size = entry->result_cache_size;
 	execstate->buffer = makeStringInfo();
 	execstate->cinfos = palloc0(sizeof(ConversionInfo *) * attnum);
 	execstate->values = palloc(attnum * sizeof(Datum));
@@ -16,12 +16,34 @@
 #include "nodes/relation.h"
 #include "utils/builtins.h"
 #include "utils/syscache.h"
+#include "utils/timestamp.h"
 
 #ifndef PG_MULTICORN_H
 #define PG_MULTICORN_H
 
 /* Data structures */
 
+/*
+ * A planner estimate from the python fdw, cached for estimate_cache_ttl
+ * seconds. The key describes the kind of estimate, and the shape of the scan
+ * it was computed for: only the fields matching this kind are set.
+ */
+typedef struct MulticornEstimate
+{
+	char	   *key;
+	TimestampTz expires;
+	/* get_rel_size */
+	double		rows;
+	int			width;
+	Cost		startupCost;
+	Cost		perRowCost;
+	bool		fdwCosts;
+	/* get_path_keys */
+	List	   *paths;
+	/* can_sort */
+	List	   *attnums;
+}	MulticornEstimate;
+
 typedef struct CacheEntry
 {
 	Oid			hashkey;
@@ -31,9 +53,30 @@ typedef struct CacheEntry
 	int			xact_depth;
 	/* Keep the "options" and "columns" in a specific context to avoid leaks. */
 	MemoryContext cacheContext;
+	/* Lifetime of the cached estimates, in seconds, 0 to disable the cache */
+	int			estimate_ttl;
+	/* List of MulticornEstimate, allocated in the cacheContext */
+	List	   *estimates;
+	/* Memory of the result cache of a scan, in kB, 0 to disable it */
+	int			result_cache_size;
+	/* Number of keys looked up at once by a join, 0 to disable it */
+	int			key_batch_size;
 }	CacheEntry;
 
 
+struct ConversionInfo;
+
+/* Builds a datum directly from a python object, see getNativeConverter */
+typedef bool (*pyobjectToDatumFunc) (PyObject *object,
+												 struct ConversionInfo *cinfo,
+												 Datum *value);
+/* Appends the text representation of a python object to a buffer */
+typedef void (*pyobjectToCStringFunc) (PyObject *object, StringInfo buffer,
+												   struct ConversionInfo *cinfo);
+/* Builds a python object from a datum, see getPythonConverter */
+typedef PyObject *(*datumToPythonFunc) (Datum datum,
+													struct ConversionInfo *cinfo);
+
 typedef struct ConversionInfo
 {
 	char	   *attrname;
@@ -46,9 +89,47 @@ typedef struct ConversionInfo
 	bool		is_array;
 	int			attndims;
 	bool		need_quote;
+	/* The column is not needed by the scan, and is left NULL */
+	bool		unrequested;
+	/* Cached key object, used to look up the attribute in dictionary rows */
+	PyObject   *attrkey;
+	/* Native converter picked from the column type, if any */
+	pyobjectToDatumFunc pytodatum;
+	/* Python type of the last converted value, and its text converter */
+	PyTypeObject *guessedpytype;
+	pyobjectToCStringFunc guessedtocstring;
+
+	/*
+	 * Output information for the last type without a native python converter
+	 * given to datumToPython. For arrays, this describes the element type.
+	 */
+	Oid			outtypoid;
+	Oid			outelemtypoid;
+	int16		outelemlen;
+	bool		outelembyval;
+	char		outelemalign;
+	datumToPythonFunc outelemconverter;
+	FmgrInfo	outfunc;
 }	ConversionInfo;
 
 
+/* Reads the values of one column of a ColumnBlock */
+typedef struct MulticornColumnReader
+{
+	/* The column buffer, if it can be read directly */
+	bool		has_view;
+	Py_buffer	view;
+	char		kind;
+	/* Otherwise, the column values as a fast sequence */
+	PyObject   *p_values;
+	/* The null mask, as a buffer of bytes or a fast sequence */
+	bool		has_nullview;
+	Py_buffer	nullview;
+	PyObject   *p_nulls;
+	/* For Arrow record batches, the column read natively, see arrow.c */
+	struct MulticornArrowColumn *arrow;
+}	MulticornColumnReader;
+
 typedef struct MulticornPlanState
 {
 	Oid			foreigntableid;
@@ -56,9 +137,31 @@ typedef struct MulticornPlanState
 	PyObject   *fdw_instance;
 	List	   *target_list;
 	List	   *qual_list;
-	int			startupCost;
+	Cost		startupCost;
+	/* Per-row cost of the scan, see getRelSize */
+	Cost		perRowCost;
+	/* True if the costs were given by get_rel_size */
+	bool		fdwCosts;
+	/* Restrictions enforced by the python fdw, see canEnforce */
+	List	   *enforced_clauses;
+	/* Per-row cost of the restrictions evaluated locally */
+	Cost		localQualCost;
 	ConversionInfo **cinfos;
 	List	   *pathkeys; /* list of MulticornDeparsedSortGroup) */
+	/* Number of rows needed by the query, or -1 if unknown */
+	int64		limit;
+	/* Join computed by the python fdw, see GetForeignJoinPaths */
+	bool		joined;
+	JoinType	jointype;
+	List	   *join_clauses;
+	Oid			inner_foreigntableid;
+	List	   *inner_target_list;
+	Index		outer_relid;
+	Index		inner_relid;
+	List	   *outer_clauses;
+	List	   *inner_clauses;
+	/* Target list of joined scans */
+	List	   *scan_tlist;
 }	MulticornPlanState;
 
 typedef struct MulticornExecState
@@ -66,9 +169,33 @@ typedef struct MulticornExecState
 	/* instance and iterator */
 	PyObject   *fdw_instance;
 	PyObject   *p_iterator;
+	/* Current block of rows, when the python side yields batches */
+	bool		batch_mode;
+	PyObject   *p_batch;
+	Py_ssize_t	batch_index;
+	/* Current ColumnBlock, read with one reader per attribute */
+	PyObject   *p_columnblock;
+	Py_ssize_t	columnblock_length;
+	MulticornColumnReader *column_readers;
+	/* Arrow structures of the current record batch, and pending batches */
+	struct ArrowArray *arrow_array;
+	struct ArrowSchema *arrow_schema;
+	PyObject   *p_arrow_batches;
 	/* Information carried from the plan phase. */
 	List	   *target_list;
 	List	   *qual_list;
+	/*
+	 * Python quals of the last execution, and the positions of the ones
+	 * depending on parameters, which are the only ones rebuilt on a rescan.
+	 */
+	PyObject   *p_quals;
+	List	   *param_quals;
+	List	   *param_positions;
+	bool		rescanned;
+	/* Rows of the previous executions, by parameter values, see resultcache.c */
+	int			result_cache_size;
+	struct MulticornResultCache *result_cache;
+	bool		scan_started;
 	Datum	   *values;
 	bool	   *nulls;
 	ConversionInfo **cinfos;
@@ -77,17 +204,36 @@ typedef struct MulticornExecState
 	AttrNumber	rowidAttno;
 	char	   *rowidAttrName;
 	List	   *pathkeys; /* list of MulticornDeparsedSortGroup) */
+	int64		limit;
+	/* Inner table of a join scan, and the quals of both tables */
+	bool		joined;
+	JoinType	jointype;
+	List	   *join_clauses;
+	PyObject   *inner_fdw_instance;
+	List	   *inner_target_list;
+	List	   *inner_qual_list;
+	ConversionInfo **outer_cinfos;
+	ConversionInfo **inner_cinfos;
+	int			outer_natts;
+	int			inner_natts;
+	/* Keys looked up by a batched join, see keybatch.c */
+	struct MulticornConstQual *key_qual;
 }	MulticornExecState;
 
 typedef struct MulticornModifyState
 {
 	ConversionInfo **cinfos;
 	ConversionInfo **resultCinfos;
+	int			resultNatts;
 	PyObject   *fdw_instance;
 	StringInfo	buffer;
 	AttrNumber	rowidAttno;
 	char	   *rowidAttrName;
 	ConversionInfo *rowidCinfo;
+	/* Rows buffered for the bulk methods, flushed by batches */
+	CmdType		operation;
+	int			modifyBatchSize;
+	PyObject   *p_pending;
 }	MulticornModifyState;
 
 
@@ -118,8 +264,21 @@ typedef struct MulticornParamQual
 {
 	MulticornBaseQual base;
 	Expr	   *expr;
+	/* Initialized on the first execution of the scan, see qualToPython */
+	ExprState  *expr_state;
 }	MulticornParamQual;
 
+/*
+ * A boolean combination (AND, OR, NOT) of quals, stored with a right_type of
+ * T_BoolExpr.
+ */
+typedef struct MulticornBoolQual
+{
+	MulticornBaseQual base;
+	BoolExprType boolop;
+	List	   *args;
+}	MulticornBoolQual;
+
 typedef struct MulticornDeparsedSortGroup
 {
 	Name 			attname;
@@ -133,6 +292,39 @@ typedef struct MulticornDeparsedSortGroup
 /* errors.c */
 void		errorCheck(void);
 
+/* multicorn.c */
+bool		isMulticornRoutine(FdwRoutine *routine);
+
+/* resultcache.c */
+struct MulticornResultCache;
+struct MulticornResultCache *createResultCache(ForeignScanState *node,
+				  List *qual_list, int size);
+bool		resultCacheLookup(ForeignScanState *node,
+				  struct MulticornResultCache *cache);
+bool		resultCacheNext(struct MulticornResultCache *cache,
+				TupleTableSlot *slot);
+void		resultCacheStore(struct MulticornResultCache *cache,
+				 TupleTableSlot *slot);
+void		resultCacheFinish(struct MulticornResultCache *cache);
+void		resultCacheReset(struct MulticornResultCache *cache);
+void		explainResultCache(struct MulticornResultCache *cache,
+				   ExplainState *es);
+
+/* keybatch.c */
+#if PG_VERSION_NUM >= 90500
+void		initKeyBatch(void);
+#endif
+
+/* arrow.c */
+struct MulticornArrowColumn;
+bool		isArrowRecordBatch(PyObject *p_block);
+bool		isArrowTable(PyObject *p_block);
+void beginArrowBatch(MulticornExecState * state, PyObject *p_batch,
+				int natts);
+void		releaseArrowBatch(MulticornExecState * state, int natts);
+bool arrowColumnToDatum(struct MulticornArrowColumn *column,
+				   Py_ssize_t index, ConversionInfo * cinfo, Datum *value);
+
 /* python.c */
 PyObject   *pgstringToPyUnicode(const char *string);
 char	  **pyUnicodeToPgString(PyObject *pyobject);
@@ -141,12 +333,28 @@ PyObject   *getInstance(Oid foreigntableid);
 PyObject   *qualToPyObject(Expr *expr, PlannerInfo *root);
 PyObject   *getClassString(const char *className);
 PyObject   *execute(ForeignScanState *state, ExplainState *es);
+bool		acceptsBoolQuals(PyObject *fdw_instance);
+bool		executeRescan(ForeignScanState *node);
+Datum evaluateParamQual(ForeignScanState *node, MulticornParamQual * qual,
+				  bool *isnull);
+bool		canAnalyze(PyObject *fdw_instance);
 void pythonResultToTuple(PyObject *p_value,
 					TupleTableSlot *slot,
 					ConversionInfo ** cinfos,
 					StringInfo buffer);
 PyObject   *tupleTableSlotToPyObject(TupleTableSlot *slot, ConversionInfo ** cinfos);
 char	   *getRowIdColumn(PyObject *fdw_instance);
+int			getBatchSize(PyObject *fdw_instance);
+int			getModifyBatchSize(PyObject *fdw_instance);
+void		releaseConversionInfos(ConversionInfo ** cinfos, int numattrs);
+bool		isColumnBlock(PyObject *p_block);
+void		beginColumnBlock(MulticornExecState * state, PyObject *p_block,
+				 int natts);
+void		releaseColumnBlock(MulticornExecState * state, int natts);
+void columnBlockToTuple(MulticornExecState * state, Py_ssize_t index,
+				   TupleTableSlot *slot);
+Datum nativeNumberToDatum(int64 ivalue, double dvalue, bool isfloat,
+					ConversionInfo * cinfo);
 PyObject   *optionsListToPyDict(List *options);
 const char *getPythonEncodingName(void);
 
@@ -159,6 +367,16 @@ List	   *pathKeys(MulticornPlanState * state);
 
 List	   *canSort(MulticornPlanState * state, List *deparsed);
 
+void getSortCost(MulticornPlanState * state, List *deparsed,
+			Cost *startup_cost, Cost *per_row_cost);
+
+bool		canLimit(MulticornPlanState * state, int64 limit);
+
+List	   *canEnforce(MulticornPlanState * state, List *clauses,
+					   List *quals);
+
+bool		canJoin(MulticornPlanState * state, PyObject *inner_instance);
+
 CacheEntry *getCacheEntry(Oid foreigntableid);
 UserMapping *multicorn_GetUserMapping(Oid userid, Oid serverid);
 
@@ -183,13 +401,17 @@ void computeDeparsedSortGroup(List *deparsed, MulticornPlanState *planstate,
 		List **deparsed_pathkeys);
 
 List	*findPaths(PlannerInfo *root, RelOptInfo *baserel, List *possiblePaths,
-		int startupCost,
+		Cost startupCost,
 		MulticornPlanState *state,
 		List *apply_pathkeys, List *deparsed_pathkeys);
 
+Cost		scanTotalCost(MulticornPlanState *state, double rows);
+
 List        *deparse_sortgroup(PlannerInfo *root, Oid foreigntableid, RelOptInfo *rel);
 
 PyObject   *datumToPython(Datum node, Oid typeoid, ConversionInfo * cinfo);
+datumToPythonFunc getPythonConverter(Oid typeoid);
+pyobjectToDatumFunc getNativeConverter(Oid typeoid);
 
 List	*serializeDeparsedSortGroup(List *pathkeys);
 List	*deserializeDeparsedSortGroup(List *items);
@@ -7,7 +7,13 @@
 #include "miscadmin.h"
 #include "utils/numeric.h"
 #include "utils/date.h"
+#include "utils/datetime.h"
 #include "utils/timestamp.h"
+#include "utils/uuid.h"
+#if PG_VERSION_NUM >= 90400
+#include "utils/jsonb.h"
+#endif
+#include "pgtime.h"
 #include "utils/array.h"
 #include "utils/catcache.h"
 #include "utils/memutils.h"
@@ -29,7 +35,16 @@ bool		compareColumns(List *columns1, List *columns2);
 
 PyObject   *getClass(PyObject *className);
 PyObject   *valuesToPySet(List *targetlist);
-PyObject   *qualDefsToPyList(List *quallist, ConversionInfo ** cinfo);
+static PyObject *valuesToPyList(List *values);
+static PyObject *joinClausesToPyList(List *join_clauses);
+static const char *joinTypeName(JoinType jointype);
+PyObject   *qualDefsToPyList(List *quallist, ConversionInfo ** cinfo,
+				 bool bool_quals);
+static PyObject *qualToPython(ForeignScanState *node, MulticornBaseQual * qual,
+			 ConversionInfo ** cinfos);
+static PyObject *boolQualToPython(ForeignScanState *node,
+				 MulticornBoolQual * qual,
+				 ConversionInfo ** cinfos);
 PyObject *pythonQual(char *operatorname, PyObject *value,
 		   ConversionInfo * cinfo,
 		   bool is_array,
@@ -42,6 +57,7 @@ MulticornDeparsedSortGroup *getDeparsedSortGroup(PyObject *key);
 
 Datum pyobjectToDatum(PyObject *object, StringInfo buffer,
 				ConversionInfo * cinfo);
+pyobjectToCStringFunc getCStringConverter(PyObject *pyobject);
 PyObject   *qualdefToPython(MulticornConstQual * qualdef, ConversionInfo ** cinfo);
 PyObject *paramDefToPython(List *paramdef, ConversionInfo ** cinfos,
 				 Oid typeoid,
@@ -53,7 +69,19 @@ PyObject   *datumStringToPython(Datum node, ConversionInfo * cinfo);
 PyObject   *datumNumberToPython(Datum node, ConversionInfo * cinfo);
 PyObject   *datumDateToPython(Datum datum, ConversionInfo * cinfo);
 PyObject   *datumTimestampToPython(Datum datum, ConversionInfo * cinfo);
+PyObject   *datumTimestamptzToPython(Datum datum, ConversionInfo * cinfo);
+PyObject   *datumIntervalToPython(Datum datum, ConversionInfo * cinfo);
+PyObject   *datumInt2ToPython(Datum datum, ConversionInfo * cinfo);
 PyObject   *datumIntToPython(Datum datum, ConversionInfo * cinfo);
+PyObject   *datumInt8ToPython(Datum datum, ConversionInfo * cinfo);
+PyObject   *datumFloat4ToPython(Datum datum, ConversionInfo * cinfo);
+PyObject   *datumFloat8ToPython(Datum datum, ConversionInfo * cinfo);
+PyObject   *datumBoolToPython(Datum datum, ConversionInfo * cinfo);
+PyObject   *datumUuidToPython(Datum datum, ConversionInfo * cinfo);
+PyObject   *datumJsonToPython(Datum datum, ConversionInfo * cinfo);
+#if PG_VERSION_NUM >= 90400
+PyObject   *datumJsonbToPython(Datum datum, ConversionInfo * cinfo);
+#endif
 PyObject   *datumArrayToPython(Datum datum, Oid type, ConversionInfo * cinfo);
 PyObject   *datumByteaToPython(Datum datum, ConversionInfo * cinfo);
 PyObject   *datumUnknownToPython(Datum datum, ConversionInfo * cinfo, Oid type);
@@ -97,6 +125,115 @@ void appendBinaryStringInfoQuote(StringInfo buffer,
 
 static void begin_remote_xact(CacheEntry * entry);
 
+/* Import the datetime C API, only once per backend */
+#define importDateTime() \
+	do { \
+		if (PyDateTimeAPI == NULL) \
+		{ \
+			PyDateTime_IMPORT; \
+		} \
+	} while (0)
+
+#if PY_MAJOR_VERSION >= 3
+#define PyIntOrLong_Check(o) PyLong_Check(o)
+#else
+#define PyIntOrLong_Check(o) (PyInt_Check(o) || PyLong_Check(o))
+#endif
+
+#if PY_VERSION_HEX < 0x02070000
+/*
+ * PyLong_AsLongLongAndOverflow only appeared in python 2.7: report overflows
+ * of PyLong_AsLongLong the same way.
+ */
+static PY_LONG_LONG
+PyLong_AsLongLongAndOverflow(PyObject *object, int *overflow)
+{
+	PY_LONG_LONG result = PyLong_AsLongLong(object);
+
+	*overflow = 0;
+	if (result == -1 && PyErr_Occurred())
+	{
+		if (!PyErr_ExceptionMatches(PyExc_OverflowError))
+			return -1;
+		PyErr_Clear();
+		*overflow = _PyLong_Sign(object);
+	}
+	return result;
+}
+#endif
+
+/*
+ * On-disk layout of the numeric type, mirrored from utils/adt/numeric.c so
+ * that numeric values can be built without going through their text form.
+ */
+#define MC_NBASE 10000
+#define MC_DEC_DIGITS 4
+
+typedef int16 MulticornNumericDigit;
+
+#define MC_NUMERIC_POS 0x0000
+#define MC_NUMERIC_NEG 0x4000
+#define MC_NUMERIC_SHORT 0x8000
+#define MC_NUMERIC_DSCALE_MASK 0x3FFF
+#define MC_NUMERIC_SHORT_SIGN_MASK 0x2000
+#define MC_NUMERIC_SHORT_DSCALE_MASK 0x1F80
+#define MC_NUMERIC_SHORT_DSCALE_SHIFT 7
+#define MC_NUMERIC_SHORT_DSCALE_MAX \
+	(MC_NUMERIC_SHORT_DSCALE_MASK >> MC_NUMERIC_SHORT_DSCALE_SHIFT)
+#define MC_NUMERIC_SHORT_WEIGHT_SIGN_MASK 0x0040
+#define MC_NUMERIC_SHORT_WEIGHT_MASK 0x003F
+#define MC_NUMERIC_SHORT_WEIGHT_MAX MC_NUMERIC_SHORT_WEIGHT_MASK
+#define MC_NUMERIC_SHORT_WEIGHT_MIN (-(MC_NUMERIC_SHORT_WEIGHT_MASK + 1))
+#define MC_NUMERIC_HDRSZ (VARHDRSZ + sizeof(uint16) + sizeof(int16))
+#define MC_NUMERIC_HDRSZ_SHORT (VARHDRSZ + sizeof(uint16))
+#define MC_NUMERIC_SIGN_MASK 0xC000
+#define MC_NUMERIC_SPECIAL 0xC000
+
+/* Accessors for a detoasted numeric */
+#define MC_NUMERIC_HEADER(num) (*(uint16 *) VARDATA(num))
+#define MC_NUMERIC_FLAGBITS(num) (MC_NUMERIC_HEADER(num) & MC_NUMERIC_SIGN_MASK)
+#define MC_NUMERIC_IS_SHORT(num) (MC_NUMERIC_FLAGBITS(num) == MC_NUMERIC_SHORT)
+#define MC_NUMERIC_HEADER_SIZE(num) \
+	(MC_NUMERIC_IS_SHORT(num) ? MC_NUMERIC_HDRSZ_SHORT : MC_NUMERIC_HDRSZ)
+#define MC_NUMERIC_DIGITS(num) \
+	((MulticornNumericDigit *) ((char *) (num) + MC_NUMERIC_HEADER_SIZE(num)))
+#define MC_NUMERIC_NDIGITS(num) \
+	((VARSIZE(num) - MC_NUMERIC_HEADER_SIZE(num)) / sizeof(MulticornNumericDigit))
+#define MC_NUMERIC_IS_NEGATIVE(num) \
+	(MC_NUMERIC_IS_SHORT(num) ? \
+	 (MC_NUMERIC_HEADER(num) & MC_NUMERIC_SHORT_SIGN_MASK) != 0 : \
+	 MC_NUMERIC_FLAGBITS(num) == MC_NUMERIC_NEG)
+#define MC_NUMERIC_DSCALE(num) \
+	(MC_NUMERIC_IS_SHORT(num) ? \
+	 (MC_NUMERIC_HEADER(num) & MC_NUMERIC_SHORT_DSCALE_MASK) >> \
+	 MC_NUMERIC_SHORT_DSCALE_SHIFT : \
+	 MC_NUMERIC_HEADER(num) & MC_NUMERIC_DSCALE_MASK)
+#define MC_NUMERIC_WEIGHT(num) \
+	(MC_NUMERIC_IS_SHORT(num) ? \
+	 (((MC_NUMERIC_HEADER(num) & MC_NUMERIC_SHORT_WEIGHT_SIGN_MASK) ? \
+	   ~MC_NUMERIC_SHORT_WEIGHT_MASK : 0) | \
+	  (MC_NUMERIC_HEADER(num) & MC_NUMERIC_SHORT_WEIGHT_MASK)) : \
+	 (int) *(int16 *) (VARDATA(num) + sizeof(uint16)))
+
+static PyObject *getCachedClass(PyObject **cache, const char *modulename,
+			   const char *classname);
+static Datum makeNumericDatum(bool negative, int weight, int dscale,
+				 MulticornNumericDigit *digits, int ndigits,
+				 bool *overflow);
+static int	getIntAttribute(PyObject *fdw_instance, const char *attrname);
+
+/* Maximum number of estimates cached per table, see newEstimate */
+#define MULTICORN_MAX_ESTIMATES 64
+
+static int	getIntOption(List *options, const char *name);
+static MulticornEstimate *getEstimate(MulticornPlanState * state,
+			const char *key);
+static MulticornEstimate *newEstimate(MulticornPlanState * state,
+			const char *key);
+static void freeEstimate(MulticornEstimate * estimate);
+static void appendQualShape(StringInfo key, MulticornBaseQual * qual);
+static void appendSortShape(StringInfo key, List *deparsed);
+
 /*
  * Get a (python) encoding name for an attribute.
  */
@@ -273,8 +410,73 @@ valuesToPySet(List *targetlist)
 	return result;
 }
 
+/*
+ * Build a python list of strings from a list of Value nodes, keeping their
+ * order.
+ */
+static PyObject *
+valuesToPyList(List *values)
+{
+	PyObject   *result = PyList_New(0);
+	ListCell   *lc;
+
+	foreach(lc, values)
+	{
+		PyObject   *pyString = PyString_FromString(strVal(lfirst(lc)));
+
+		PyList_Append(result, pyString);
+		Py_DECREF(pyString);
+	}
+	return result;
+}
+
+/*
+ * Build the python representation of the join clauses deparsed by
+ * deparseJoinClause: a list of (outer_column, operator, inner_column) tuples.
+ */
+static PyObject *
+joinClausesToPyList(List *join_clauses)
+{
+	PyObject   *result = PyList_New(0);
+	ListCell   *lc;
+
+	foreach(lc, join_clauses)
+	{
+		List	   *clause = (List *) lfirst(lc);
+		PyObject   *p_outer = PyString_FromString(strVal(linitial(clause))),
+				   *p_operator = PyString_FromString(strVal(lsecond(clause))),
+				   *p_inner = PyString_FromString(strVal(lthird(clause))),
+				   *p_clause = PyTuple_Pack(3, p_outer, p_operator, p_inner);
+
+		PyList_Append(result, p_clause);
+		Py_DECREF(p_clause);
+		Py_DECREF(p_outer);
+		Py_DECREF(p_operator);
+		Py_DECREF(p_inner);
+	}
+	return result;
+}
+
+/*
+ * Returns the name of a join type, as given to the python fdw.
+ */
+static const char *
+joinTypeName(JoinType jointype)
+{
+	switch (jointype)
+	{
+		case JOIN_INNER:
+			return "inner";
+		case JOIN_LEFT:
+			return "left";
+		default:
+			elog(ERROR, "unsupported join type %d", (int) jointype);
+	}
+	return NULL;
+}
+
 PyObject *
-qualDefsToPyList(List *qual_list, ConversionInfo ** cinfos)
+qualDefsToPyList(List *qual_list, ConversionInfo ** cinfos, bool bool_quals)
 {
 	ListCell   *lc;
 	PyObject   *p_quals = PyList_New(0);
@@ -282,16 +484,18 @@ qualDefsToPyList(List *qual_list, ConversionInfo ** cinfos)
 	foreach(lc, qual_list)
 	{
 		MulticornBaseQual *qual_def = (MulticornBaseQual *) lfirst(lc);
+		PyObject   *python_qual;
 
-		if (qual_def->right_type == T_Const)
+		if (qual_def->right_type == T_BoolExpr && !bool_quals)
 		{
-			PyObject   *python_qual = qualdefToPython((MulticornConstQual *) qual_def, cinfos);
-
-			if (python_qual != NULL)
-			{
-				PyList_Append(p_quals, python_qual);
-				Py_DECREF(python_qual);
-			}
+			continue;
+		}
+		/* Parameters are unknown at planning time */
+		python_qual = qualToPython(NULL, qual_def, cinfos);
+		if (python_qual != NULL)
+		{
+			PyList_Append(p_quals, python_qual);
+			Py_DECREF(python_qual);
 		}
 	}
 	return p_quals;
@@ -587,6 +791,7 @@ getCacheEntry(Oid foreigntableid)
 		entry->columns = NULL;
 		entry->cacheContext = NULL;
 		entry->xact_depth = 0;
+		entry->estimates = NIL;
 		needInitialization = true;
 	}
 	else
@@ -623,6 +828,18 @@ getCacheEntry(Oid foreigntableid)
 		entry->value = NULL;
 		getColumnsFromTable(desc, &p_columns, &columns);
 		PyDict_DelItemString(p_options, "wrapper");
+		if (PyDict_GetItemString(p_options, "estimate_cache_ttl") != NULL)
+		{
+			PyDict_DelItemString(p_options, "estimate_cache_ttl");
+		}
+		if (PyDict_GetItemString(p_options, "result_cache_size") != NULL)
+		{
+			PyDict_DelItemString(p_options, "result_cache_size");
+		}
+		if (PyDict_GetItemString(p_options, "key_batch_size") != NULL)
+		{
+			PyDict_DelItemString(p_options, "key_batch_size");
+		}
 		p_instance = PyObject_CallFunction(p_class, "(O,O)", p_options,
 										   p_columns);
 		errorCheck();
@@ -638,6 +855,11 @@ getCacheEntry(Oid foreigntableid)
 		entry->options = options;
 		entry->columns = columns;
 		entry->xact_depth = 0;
+		/* The estimates of the previous instance went with its context */
+		entry->estimates = NIL;
+		entry->estimate_ttl = getIntOption(options, "estimate_cache_ttl");
+		entry->result_cache_size = getIntOption(options, "result_cache_size");
+		entry->key_batch_size = getIntOption(options, "key_batch_size");
 		Py_DECREF(p_class);
 		Py_DECREF(p_options);
 		Py_DECREF(p_columns);
@@ -661,6 +883,183 @@ getCacheEntry(Oid foreigntableid)
 }
 
 
+/*
+ * Returns the value of a multicorn integer option, such as
+ * estimate_cache_ttl, or 0 if it is not set. The option of the table takes
+ * precedence over the one of the server.
+ */
+static int
+getIntOption(List *options, const char *name)
+{
+	ListCell   *lc;
+
+	foreach(lc, options)
+	{
+		DefElem    *def = (DefElem *) lfirst(lc);
+
+		if (strcmp(def->defname, name) == 0)
+		{
+			return (int) strtol(defGetString(def), NULL, 10);
+		}
+	}
+	return 0;
+}
+
+/*
+ * Returns the estimate cached for the planned table under the given key, or
+ * NULL if there is none or the estimate cache is disabled. Expired estimates
+ * are removed from the cache.
+ */
+static MulticornEstimate *
+getEstimate(MulticornPlanState * state, const char *key)
+{
+	CacheEntry *entry = hash_search(InstancesHash, &state->foreigntableid,
+									HASH_FIND, NULL);
+	TimestampTz now;
+	ListCell   *lc;
+
+	if (entry == NULL || entry->estimate_ttl <= 0)
+	{
+		return NULL;
+	}
+	now = GetCurrentTimestamp();
+	foreach(lc, entry->estimates)
+	{
+		MulticornEstimate *estimate = (MulticornEstimate *) lfirst(lc);
+
+		if (strcmp(estimate->key, key) != 0)
+		{
+			continue;
+		}
+		if (estimate->expires <= now)
+		{
+			entry->estimates = list_delete_ptr(entry->estimates, estimate);
+			freeEstimate(estimate);
+			return NULL;
+		}
+		return estimate;
+	}
+	return NULL;
+}
+
+/*
+ * Returns a new estimate, cached for the planned table under the given key,
+ * or NULL if the estimate cache is disabled. The estimate is allocated in the
+ * cache context of the table, and lives until it expires or the python
+ * instance is rebuilt. At most MULTICORN_MAX_ESTIMATES estimates are kept per
+ * table, the oldest one being evicted first.
+ */
+static MulticornEstimate *
+newEstimate(MulticornPlanState * state, const char *key)
+{
+	CacheEntry *entry = hash_search(InstancesHash, &state->foreigntableid,
+									HASH_FIND, NULL);
+	MulticornEstimate *estimate;
+	MemoryContext oldContext;
+	TimestampTz now;
+	List	   *kept = NIL;
+	ListCell   *lc;
+
+	if (entry == NULL || entry->estimate_ttl <= 0)
+	{
+		return NULL;
+	}
+	now = GetCurrentTimestamp();
+	oldContext = MemoryContextSwitchTo(entry->cacheContext);
+	/* Drop the expired estimates, and the one being replaced */
+	foreach(lc, entry->estimates)
+	{
+		estimate = (MulticornEstimate *) lfirst(lc);
+		if (estimate->expires <= now || strcmp(estimate->key, key) == 0)
+		{
+			freeEstimate(estimate);
+		}
+		else
+		{
+			kept = lappend(kept, estimate);
+		}
+	}
+	list_free(entry->estimates);
+	entry->estimates = kept;
+	if (list_length(entry->estimates) >= MULTICORN_MAX_ESTIMATES)
+	{
+		estimate = (MulticornEstimate *) linitial(entry->estimates);
+		entry->estimates = list_delete_first(entry->estimates);
+		freeEstimate(estimate);
+	}
+	estimate = palloc0(sizeof(MulticornEstimate));
+	estimate->key = pstrdup(key);
+	estimate->expires = TimestampTzPlusMilliseconds(now,
+									  (int64) entry->estimate_ttl * 1000);
+	entry->estimates = lappend(entry->estimates, estimate);
+	MemoryContextSwitchTo(oldContext);
+	return estimate;
+}
+
+static void
+freeEstimate(MulticornEstimate * estimate)
+{
+	pfree(estimate->key);
+	list_free(estimate->attnums);
+	if (estimate->paths != NIL)
+	{
+		ListCell   *lc;
+
+		foreach(lc, estimate->paths)
+		{
+			List	   *item = (List *) lfirst(lc);
+
+			list_free((List *) linitial(item));
+			list_free_deep(list_delete_first(item));
+		}
+		list_free(estimate->paths);
+	}
+	pfree(estimate);
+}
+
+/*
+ * Appends the shape of a qual to the key of an estimate: its column, its
+ * operator and the kind of its value, but not the value itself.
+ */
+static void
+appendQualShape(StringInfo key, MulticornBaseQual * qual)
+{
+	appendStringInfo(key, "(%d %s %d %d %d %u", qual->varattno,
+					 qual->opname ? qual->opname : "",
+					 qual->isArray, qual->useOr, qual->right_type,
+					 qual->typeoid);
+	if (qual->right_type == T_BoolExpr)
+	{
+		MulticornBoolQual *boolqual = (MulticornBoolQual *) qual;
+		ListCell   *lc;
+
+		appendStringInfo(key, " %d", boolqual->boolop);
+		foreach(lc, boolqual->args)
+		{
+			appendQualShape(key, (MulticornBaseQual *) lfirst(lc));
+		}
+	}
+	appendStringInfoChar(key, ')');
+}
+
+/*
+ * Appends a list of MulticornDeparsedSortGroup to the key of an estimate.
+ */
+static void
+appendSortShape(StringInfo key, List *deparsed)
+{
+	ListCell   *lc;
+
+	foreach(lc, deparsed)
+	{
+		MulticornDeparsedSortGroup *md = (MulticornDeparsedSortGroup *) lfirst(lc);
+
+		appendStringInfo(key, "(%d %d %d %s)", md->attnum, md->reversed,
+						 md->nulls_first,
+						 md->collate ? NameStr(*(md->collate)) : "");
+	}
+}
+
 /*
  * Returns the fdw_instance associated with the foreigntableid.
  *
@@ -703,6 +1102,9 @@ begin_remote_xact(CacheEntry * entry)
  * Returns the relation estimated size, in term of number of rows and width.
  * This is done by calling the getRelSize python method.
  *
+ * The python method can also return the startup cost and the per-row cost
+ * of the scan. Otherwise, the startup cost is the _startup_cost attribute,
+ * and the per-row cost is left to the caller (negative).
  */
 void
 getRelSize(MulticornPlanState * state,
@@ -715,30 +1117,86 @@ getRelSize(MulticornPlanState * state,
 			   *p_rows_and_width,
 			   *p_rows,
 			   *p_width,
-			   *p_startup_cost;
+			   *p_startup_cost,
+			   *p_per_row_cost;
+	Py_ssize_t	size;
+	StringInfo	key = makeStringInfo();
+	MulticornEstimate *estimate;
+	ListCell   *lc;
 
+	/* Look for an estimate of a scan of the same shape */
+	appendStringInfoString(key, "size");
+	foreach(lc, state->target_list)
+	{
+		appendStringInfo(key, " %s", strVal(lfirst(lc)));
+	}
+	foreach(lc, state->qual_list)
+	{
+		appendQualShape(key, (MulticornBaseQual *) lfirst(lc));
+	}
+	estimate = getEstimate(state, key->data);
+	if (estimate != NULL)
+	{
+		*rows = estimate->rows;
+		*width = estimate->width;
+		state->startupCost = estimate->startupCost;
+		state->perRowCost = estimate->perRowCost;
+		state->fdwCosts = estimate->fdwCosts;
+		return;
+	}
 	p_targets_set = valuesToPySet(state->target_list);
-	p_quals = qualDefsToPyList(state->qual_list, state->cinfos);
+	p_quals = qualDefsToPyList(state->qual_list, state->cinfos,
+							   acceptsBoolQuals(state->fdw_instance));
 	p_rows_and_width = PyObject_CallMethod(state->fdw_instance, "get_rel_size",
 										   "(O,O)", p_quals, p_targets_set);
 	errorCheck();
 	Py_DECREF(p_targets_set);
 	Py_DECREF(p_quals);
-	if ((p_rows_and_width == Py_None) || PyTuple_Size(p_rows_and_width) != 2)
+	size = (p_rows_and_width == Py_None) ? 0 : PyTuple_Size(p_rows_and_width);
+	if (size != 2 && size != 4)
 	{
 		Py_DECREF(p_rows_and_width);
-		elog(ERROR, "The get_rel_size python method should return a tuple of length 2");
+		elog(ERROR, "The get_rel_size python method should return a tuple of length 2 or 4");
 	}
 	p_rows = PyNumber_Long(PyTuple_GetItem(p_rows_and_width, 0));
 	p_width = PyNumber_Long(PyTuple_GetItem(p_rows_and_width, 1));
-	p_startup_cost = PyNumber_Long(
-			   PyObject_GetAttrString(state->fdw_instance, "_startup_cost"));
+	if (size == 4)
+	{
+		p_startup_cost = PyNumber_Float(PyTuple_GetItem(p_rows_and_width, 2));
+		p_per_row_cost = PyNumber_Float(PyTuple_GetItem(p_rows_and_width, 3));
+		errorCheck();
+		state->perRowCost = PyFloat_AsDouble(p_per_row_cost);
+		state->fdwCosts = true;
+		Py_DECREF(p_per_row_cost);
+	}
+	else
+	{
+		PyObject   *p_attribute = PyObject_GetAttrString(state->fdw_instance,
+														 "_startup_cost");
+
+		errorCheck();
+		p_startup_cost = PyNumber_Float(p_attribute);
+		Py_DECREF(p_attribute);
+		errorCheck();
+		state->perRowCost = -1;
+		state->fdwCosts = false;
+	}
 	*rows = PyLong_AsDouble(p_rows);
 	*width = (int) PyLong_AsLong(p_width);
-	state->startupCost = (int) PyLong_AsLong(p_startup_cost);
+	state->startupCost = PyFloat_AsDouble(p_startup_cost);
+	Py_DECREF(p_startup_cost);
 	Py_DECREF(p_rows);
 	Py_DECREF(p_width);
 	Py_DECREF(p_rows_and_width);
+	estimate = newEstimate(state, key->data);
+	if (estimate != NULL)
+	{
+		estimate->rows = *rows;
+		estimate->width = *width;
+		estimate->startupCost = state->startupCost;
+		estimate->perRowCost = state->perRowCost;
+		estimate->fdwCosts = state->fdwCosts;
+	}
 }
 
 PyObject *
@@ -789,12 +1247,21 @@ pythonQual(char *operatorname,
 		   bool use_or,
 		   Oid typeoid)
 {
-	PyObject   *qualClass = getClassString("multicorn.Qual"),
+	PyObject   *qualClass,
 			   *qualInstance,
 			   *p_operatorname,
 			   *operator,
 			   *columnName;
 
+	/* col = ANY(keys) restrictions offer their keys as a set */
+	if (is_array && use_or && strcmp(operatorname, "=") == 0)
+	{
+		qualClass = getClassString("multicorn.KeySetQual");
+	}
+	else
+	{
+		qualClass = getClassString("multicorn.Qual");
+	}
 	p_operatorname = PyUnicode_Decode(operatorname, strlen(operatorname), getPythonEncodingName(), NULL);
 	errorCheck();
 	if (is_array)
@@ -898,120 +1365,456 @@ getDeparsedSortGroup(PyObject *sortKey)
 
 
 /*
- * Execute the query in the python fdw, and returns an iterator.
+ * Convert a qual to a python Qual, or to a BoolQual for a boolean
+ * expression. Parameters are evaluated in the expression context of the
+ * scan, or make the qual unusable if node is NULL.
+ * Returns NULL if the qual cannot be converted.
  */
-PyObject *
-execute(ForeignScanState *node, ExplainState *es)
+static PyObject *
+qualToPython(ForeignScanState *node, MulticornBaseQual * qual,
+			 ConversionInfo ** cinfos)
 {
-	MulticornExecState *state = node->fdw_state;
-	PyObject   *p_targets_set,
-			   *p_quals = PyList_New(0),
-			   *p_pathkeys = PyList_New(0),
-			   *p_iterable,
-			   *p_method;
-	ListCell   *lc;
-
-	ExprContext *econtext = node->ss.ps.ps_ExprContext;
+	MulticornConstQual *newqual = NULL;
+	bool		isNull;
 
-	foreach(lc, state->qual_list)
+	switch (qual->right_type)
 	{
-		MulticornBaseQual *qual = lfirst(lc);
-		MulticornConstQual *newqual = NULL;
-		bool		isNull;
-		ExprState  *expr_state = NULL;
-
-		switch (qual->right_type)
-		{
-			case T_Param:
-				expr_state = ExecInitExpr(((MulticornParamQual *) qual)->expr,
-										  (PlanState *) node);
-				newqual = palloc0(sizeof(MulticornConstQual));
-				newqual->base.right_type = T_Const;
-				newqual->base.varattno = qual->varattno;
-				newqual->base.opname = qual->opname;
-				newqual->base.isArray = qual->isArray;
-				newqual->base.useOr = qual->useOr;
-				newqual->value = ExecEvalExpr(expr_state, econtext, &isNull, NULL);
-				newqual->base.typeoid = qual->typeoid;
-				newqual->isnull = isNull;
-				break;
-			case T_Const:
-				newqual = (MulticornConstQual *) qual;
-				break;
-			default:
-				break;
-		}
-		if (newqual != NULL)
-		{
-			PyObject   *python_qual = qualdefToPython((MulticornConstQual *) newqual, state->cinfos);
-
-			if (python_qual != NULL)
+		case T_Param:
+			if (node == NULL)
 			{
-				PyList_Append(p_quals, python_qual);
-				Py_DECREF(python_qual);
+				return NULL;
 			}
-		}
+			newqual = palloc0(sizeof(MulticornConstQual));
+			newqual->base.right_type = T_Const;
+			newqual->base.varattno = qual->varattno;
+			newqual->base.opname = qual->opname;
+			newqual->base.isArray = qual->isArray;
+			newqual->base.useOr = qual->useOr;
+			newqual->value = evaluateParamQual(node,
+											   (MulticornParamQual *) qual,
+											   &isNull);
+			newqual->base.typeoid = qual->typeoid;
+			newqual->isnull = isNull;
+			break;
+		case T_Const:
+			newqual = (MulticornConstQual *) qual;
+			break;
+		case T_BoolExpr:
+			return boolQualToPython(node, (MulticornBoolQual *) qual, cinfos);
+		default:
+			return NULL;
 	}
-	/* Transform every object to a suitable python representation */
-	p_targets_set = valuesToPySet(state->target_list);
+	return qualdefToPython(newqual, cinfos);
+}
 
-	foreach(lc, state->pathkeys)
+/*
+ * Evaluate the value of a qual depending on a parameter, for the current
+ * execution of the scan.
+ */
+Datum
+evaluateParamQual(ForeignScanState *node, MulticornParamQual * qual,
+				  bool *isnull)
+{
+	if (qual->expr_state == NULL)
 	{
-		MulticornDeparsedSortGroup *pathkey = (MulticornDeparsedSortGroup *) lfirst(lc);
-		PyObject *python_sortkey = getSortKey(pathkey);
-		PyList_Append(p_pathkeys, python_sortkey);
-		Py_DECREF(python_sortkey);
+		/* Kept for the rescans, so in the query context */
+		MemoryContext oldContext = MemoryContextSwitchTo(node->ss.ps.state->es_query_cxt);
+
+		qual->expr_state = ExecInitExpr(qual->expr, (PlanState *) node);
+		MemoryContextSwitchTo(oldContext);
 	}
+	return ExecEvalExpr(qual->expr_state, node->ss.ps.ps_ExprContext,
+						isnull, NULL);
+}
+
+/*
+ * Build a python BoolQual from a tree of quals. The whole tree is discarded
+ * if any of its quals cannot be converted.
+ */
+static PyObject *
+boolQualToPython(ForeignScanState *node, MulticornBoolQual * qual,
+				 ConversionInfo ** cinfos)
+{
+	PyObject   *p_args = PyList_New(0),
+			   *boolQualClass,
+			   *result;
+	const char *boolop;
+	ListCell   *lc;
+
+	foreach(lc, qual->args)
 	{
-		PyObject * args,
-				 * kwargs = PyDict_New();
-		if(PyList_Size(p_pathkeys) > 0){
-			PyDict_SetItemString(kwargs, "sortkeys", p_pathkeys);
-		}
-		if(es != NULL){
-			PyObject * verbose;
-			if(es->verbose){
-				verbose = Py_True;
-			} else {
-				verbose = Py_False;
-			}
-			p_method = PyObject_GetAttrString(state->fdw_instance, "explain");
-			args = PyTuple_Pack(2, p_quals, p_targets_set);
-			PyDict_SetItemString(kwargs, "verbose", verbose);
-			errorCheck();
-		} else {
-			p_method = PyObject_GetAttrString(state->fdw_instance, "execute");
-			errorCheck();
-			args = PyTuple_Pack(2, p_quals, p_targets_set);
-			errorCheck();
-		}
-		p_iterable = PyObject_Call(p_method, args, kwargs);
-		errorCheck();
-		Py_DECREF(p_method);
-		Py_DECREF(args);
-		Py_DECREF(kwargs);
-	}
+		PyObject   *p_arg = qualToPython(node, lfirst(lc), cinfos);
 
-	errorCheck();
-	if (p_iterable == Py_None){
-		state->p_iterator = p_iterable;
+		if (p_arg == NULL)
+		{
+			Py_DECREF(p_args);
+			return NULL;
+		}
+		PyList_Append(p_args, p_arg);
+		Py_DECREF(p_arg);
 	}
-	else
+	switch (qual->boolop)
 	{
-		state->p_iterator = PyObject_GetIter(p_iterable);
+		case AND_EXPR:
+			boolop = "and";
+			break;
+		case OR_EXPR:
+			boolop = "or";
+			break;
+		default:
+			boolop = "not";
+			break;
 	}
-	Py_DECREF(p_quals);
-	Py_DECREF(p_targets_set);
-	Py_DECREF(p_pathkeys);
-	Py_DECREF(p_iterable);
+	boolQualClass = getClassString("multicorn.BoolQual");
+	result = PyObject_CallFunction(boolQualClass, "(s,O)", boolop, p_args);
 	errorCheck();
-	return state->p_iterator;
+	Py_DECREF(boolQualClass);
+	Py_DECREF(p_args);
+	return result;
 }
 
-void
-pynumberToCString(PyObject *pyobject, StringInfo buffer,
-				  ConversionInfo * cinfo)
-{
+/*
+ * Build the python quals of a scan from a list of MulticornBaseQual,
+ * evaluating the parameters for the current execution. Boolean expressions
+ * are only given to the wrappers accepting them.
+ */
+static PyObject *
+qualsToPyList(ForeignScanState *node, List *qual_list,
+			  ConversionInfo ** cinfos, bool bool_quals)
+{
+	PyObject   *p_quals = PyList_New(0);
+	ListCell   *lc;
+
+	foreach(lc, qual_list)
+	{
+		MulticornBaseQual *qual = lfirst(lc);
+		PyObject   *python_qual;
+
+		if (qual->right_type == T_BoolExpr && !bool_quals)
+		{
+			continue;
+		}
+		python_qual = qualToPython(node, qual, cinfos);
+		if (python_qual != NULL)
+		{
+			PyList_Append(p_quals, python_qual);
+			Py_DECREF(python_qual);
+		}
+	}
+	return p_quals;
+}
+
+/*
+ * Returns true if the value of a qual depends on the parameters of the scan.
+ */
+static bool
+qualDependsOnParams(MulticornBaseQual * qual)
+{
+	ListCell   *lc;
+
+	if (qual->right_type == T_Param)
+	{
+		return true;
+	}
+	if (qual->right_type == T_BoolExpr)
+	{
+		foreach(lc, ((MulticornBoolQual *) qual)->args)
+		{
+			if (qualDependsOnParams(lfirst(lc)))
+			{
+				return true;
+			}
+		}
+	}
+	return false;
+}
+
+/*
+ * Returns the python quals of a scan, as a new list.
+ *
+ * The quals are built on the first execution, and kept in the exec state:
+ * on the next executions, only the quals depending on parameters are built
+ * again. If p_changed is not NULL, it is set to a new list of the quals whose
+ * value changed since the previous execution.
+ */
+static PyObject *
+scanQuals(ForeignScanState *node, PyObject **p_changed)
+{
+	MulticornExecState *state = node->fdw_state;
+	ConversionInfo **cinfos = state->joined ? state->outer_cinfos : state->cinfos;
+	ListCell   *lc,
+			   *lc2;
+
+	if (p_changed != NULL)
+	{
+		*p_changed = PyList_New(0);
+	}
+	if (state->p_quals == NULL)
+	{
+		MemoryContext oldContext = MemoryContextSwitchTo(node->ss.ps.state->es_query_cxt);
+		bool		bool_quals = acceptsBoolQuals(state->fdw_instance);
+
+		state->p_quals = PyList_New(0);
+		foreach(lc, state->qual_list)
+		{
+			MulticornBaseQual *qual = lfirst(lc);
+			PyObject   *python_qual;
+
+			if (qual->right_type == T_BoolExpr && !bool_quals)
+			{
+				continue;
+			}
+			python_qual = qualToPython(node, qual, cinfos);
+			if (python_qual == NULL)
+			{
+				continue;
+			}
+			if (qualDependsOnParams(qual))
+			{
+				state->param_quals = lappend(state->param_quals, qual);
+				state->param_positions = lappend_int(state->param_positions,
+											   PyList_Size(state->p_quals));
+			}
+			PyList_Append(state->p_quals, python_qual);
+			Py_DECREF(python_qual);
+		}
+		MemoryContextSwitchTo(oldContext);
+	}
+	else
+	{
+		forboth(lc, state->param_quals, lc2, state->param_positions)
+		{
+			PyObject   *python_qual = qualToPython(node, lfirst(lc), cinfos),
+					   *p_previous = PyList_GetItem(state->p_quals,
+												  lfirst_int(lc2));
+
+			if (python_qual == NULL)
+			{
+				continue;
+			}
+			if (PyObject_RichCompareBool(python_qual, p_previous, Py_EQ) == 1)
+			{
+				Py_DECREF(python_qual);
+				continue;
+			}
+			errorCheck();
+			if (p_changed != NULL)
+			{
+				PyList_Append(*p_changed, python_qual);
+			}
+			/* Steals the reference */
+			PyList_SetItem(state->p_quals, lfirst_int(lc2), python_qual);
+		}
+	}
+	/* The wrapper may modify the list it is given */
+	return PyList_GetSlice(state->p_quals, 0, PyList_Size(state->p_quals));
+}
+
+/*
+ * Restart a scan after a rescan, by giving the quals which changed to the
+ * rescan method of the python fdw.
+ *
+ * Returns false if the python fdw did not return new rows, in which case the
+ * scan must be executed again.
+ */
+bool
+executeRescan(ForeignScanState *node)
+{
+	MulticornExecState *state = node->fdw_state;
+	PyObject   *p_quals,
+			   *p_changed,
+			   *p_iterable;
+
+	if (state->p_quals == NULL ||
+		!PyObject_HasAttrString(state->fdw_instance, "rescan"))
+	{
+		return false;
+	}
+	p_quals = scanQuals(node, &p_changed);
+	Py_DECREF(p_quals);
+	p_iterable = PyObject_CallMethod(state->fdw_instance, "rescan", "(O)",
+									 p_changed);
+	Py_DECREF(p_changed);
+	errorCheck();
+	if (p_iterable == Py_None)
+	{
+		Py_DECREF(p_iterable);
+		return false;
+	}
+	state->p_iterator = PyObject_GetIter(p_iterable);
+	Py_DECREF(p_iterable);
+	errorCheck();
+	return true;
+}
+
+/*
+ * Call a scan method of the python fdw: execute, explain or execute_join.
+ * The method is called with the quals and the columns of
+ * the scan. The columns of a join scan are given as an ordered list.
+ */
+static PyObject *
+callScanMethod(ForeignScanState *node, const char *methodname,
+			   ExplainState *es)
+{
+	MulticornExecState *state = node->fdw_state;
+	PyObject   *p_targets_set,
+			   *p_quals,
+			   *p_pathkeys = PyList_New(0),
+			   *p_result,
+			   *p_method;
+	ListCell   *lc;
+
+	p_quals = scanQuals(node, NULL);
+	/* The keys of a batched join are only known during the execution */
+	if (state->key_qual != NULL && es == NULL)
+	{
+		PyObject   *p_key_qual = qualdefToPython(state->key_qual,
+												 state->cinfos);
+
+		PyList_Append(p_quals, p_key_qual);
+		Py_DECREF(p_key_qual);
+	}
+	/* Transform every object to a suitable python representation */
+	if (state->joined)
+	{
+		p_targets_set = valuesToPyList(state->target_list);
+	}
+	else
+	{
+		p_targets_set = valuesToPySet(state->target_list);
+	}
+
+	foreach(lc, state->pathkeys)
+	{
+		MulticornDeparsedSortGroup *pathkey = (MulticornDeparsedSortGroup *) lfirst(lc);
+		PyObject *python_sortkey = getSortKey(pathkey);
+		PyList_Append(p_pathkeys, python_sortkey);
+		Py_DECREF(python_sortkey);
+	}
+	{
+		PyObject * args,
+				 * kwargs = PyDict_New();
+		if(PyList_Size(p_pathkeys) > 0){
+			PyDict_SetItemString(kwargs, "sortkeys", p_pathkeys);
+		}
+		if (state->limit >= 0)
+		{
+			PyObject   *p_limit = PyLong_FromLongLong(state->limit);
+
+			PyDict_SetItemString(kwargs, "limit", p_limit);
+			Py_DECREF(p_limit);
+		}
+		if (state->joined)
+		{
+			PyObject   *p_join_type = PyString_FromString(joinTypeName(state->jointype)),
+					   *p_clauses = joinClausesToPyList(state->join_clauses),
+					   *p_inner_quals = qualsToPyList(node, state->inner_qual_list,
+													  state->inner_cinfos,
+								  acceptsBoolQuals(state->inner_fdw_instance)),
+					   *p_inner_columns = valuesToPyList(state->inner_target_list);
+
+			PyDict_SetItemString(kwargs, "join_type", p_join_type);
+			PyDict_SetItemString(kwargs, "clauses", p_clauses);
+			PyDict_SetItemString(kwargs, "inner", state->inner_fdw_instance);
+			PyDict_SetItemString(kwargs, "inner_quals", p_inner_quals);
+			PyDict_SetItemString(kwargs, "inner_columns", p_inner_columns);
+			Py_DECREF(p_join_type);
+			Py_DECREF(p_clauses);
+			Py_DECREF(p_inner_quals);
+			Py_DECREF(p_inner_columns);
+		}
+		if(es != NULL){
+			PyObject * verbose;
+			if(es->verbose){
+				verbose = Py_True;
+			} else {
+				verbose = Py_False;
+			}
+			PyDict_SetItemString(kwargs, "verbose", verbose);
+		}
+		p_method = PyObject_GetAttrString(state->fdw_instance, methodname);
+		errorCheck();
+		args = PyTuple_Pack(2, p_quals, p_targets_set);
+		errorCheck();
+		p_result = PyObject_Call(p_method, args, kwargs);
+		errorCheck();
+		Py_DECREF(p_method);
+		Py_DECREF(args);
+		Py_DECREF(kwargs);
+	}
+
+	errorCheck();
+	Py_DECREF(p_quals);
+	Py_DECREF(p_targets_set);
+	Py_DECREF(p_pathkeys);
+	return p_result;
+}
+
+/*
+ * Execute the query in the python fdw, and returns an iterator.
+ */
+PyObject *
+execute(ForeignScanState *node, ExplainState *es)
+{
+	MulticornExecState *state = node->fdw_state;
+	const char *methodname = state->joined ? "execute_join" : "execute";
+	PyObject   *p_iterable = callScanMethod(node,
+											es != NULL ? "explain" : methodname,
+											es);
+
+	if (p_iterable == Py_None){
+		state->p_iterator = p_iterable;
+	}
+	else
+	{
+		state->p_iterator = PyObject_GetIter(p_iterable);
+	}
+	Py_DECREF(p_iterable);
+	errorCheck();
+	return state->p_iterator;
+}
+
+/*
+ * Returns true if the python fdw wants the boolean expressions of its quals,
+ * as BoolQual instances.
+ */
+bool
+acceptsBoolQuals(PyObject *fdw_instance)
+{
+	return getIntAttribute(fdw_instance, "_bool_quals") != 0;
+}
+
+/*
+ * Returns true if the python fdw overrides the sample_rows method, and can
+ * therefore be analyzed.
+ */
+bool
+canAnalyze(PyObject *fdw_instance)
+{
+	PyObject   *p_class = PyObject_GetAttrString(fdw_instance, "__class__"),
+			   *p_base = getClassString("multicorn.ForeignDataWrapper"),
+			   *p_method,
+			   *p_base_method;
+	bool		result = false;
+
+	p_method = PyObject_GetAttrString(p_class, "sample_rows");
+	p_base_method = PyObject_GetAttrString(p_base, "sample_rows");
+	if (p_method != NULL && p_base_method != NULL)
+	{
+		result = PyObject_RichCompareBool(p_method, p_base_method, Py_EQ) == 0;
+	}
+	PyErr_Clear();
+	Py_XDECREF(p_method);
+	Py_XDECREF(p_base_method);
+	Py_DECREF(p_base);
+	Py_DECREF(p_class);
+	return result;
+}
+
+void
+pynumberToCString(PyObject *pyobject, StringInfo buffer,
+				  ConversionInfo * cinfo)
+{
 	PyObject   *pTempStr;
 	char	   *tempbuffer;
 	Py_ssize_t	strlength = 0;
@@ -1138,46 +1941,50 @@ pydateToCString(PyObject *pyobject, StringInfo buffer,
 }
 
 
-void
-pyobjectToCString(PyObject *pyobject, StringInfo buffer,
-				  ConversionInfo * cinfo)
+/*
+ * Returns the function used to convert a python object to its text
+ * representation. The choice only depends on the type of the object.
+ */
+pyobjectToCStringFunc
+getCStringConverter(PyObject *pyobject)
 {
-	if (pyobject == NULL || pyobject == Py_None)
-	{
-		return;
-	}
 	if (PyNumber_Check(pyobject))
 	{
-		pynumberToCString(pyobject, buffer, cinfo);
-		return;
+		return pynumberToCString;
 	}
 	if (PyUnicode_Check(pyobject))
 	{
-		pyunicodeToCString(pyobject, buffer, cinfo);
-		return;
+		return pyunicodeToCString;
 	}
 	if (PyBytes_Check(pyobject))
 	{
-		pystringToCString(pyobject, buffer, cinfo);
-		return;
+		return pystringToCString;
 	}
 	if (PySequence_Check(pyobject))
 	{
-		pysequenceToCString(pyobject, buffer, cinfo);
-		return;
+		return pysequenceToCString;
 	}
 	if (PyMapping_Check(pyobject))
 	{
-		pymappingToCString(pyobject, buffer, cinfo);
-		return;
+		return pymappingToCString;
 	}
-	PyDateTime_IMPORT;
+	importDateTime();
 	if (PyDate_Check(pyobject))
 	{
-		pydateToCString(pyobject, buffer, cinfo);
+		return pydateToCString;
+	}
+	return pyunknownToCstring;
+}
+
+void
+pyobjectToCString(PyObject *pyobject, StringInfo buffer,
+				  ConversionInfo * cinfo)
+{
+	if (pyobject == NULL || pyobject == Py_None)
+	{
 		return;
 	}
-	pyunknownToCstring(pyobject, buffer, cinfo);
+	getCStringConverter(pyobject) (pyobject, buffer, cinfo);
 }
 
 void
@@ -1195,6 +2002,48 @@ pyunknownToCstring(PyObject *pyobject, StringInfo buffer,
 	return;
 }
 
+/*
+ * Returns a borrowed reference to the key used to look up the attribute in a
+ * dictionary row. It is created on first use, and kept in the ConversionInfo
+ * until releaseConversionInfos is called.
+ */
+static PyObject *
+getAttrKey(ConversionInfo * cinfo)
+{
+	if (cinfo->attrkey == NULL)
+	{
+#if PY_MAJOR_VERSION >= 3
+		cinfo->attrkey = PyUnicode_InternFromString(cinfo->attrname);
+#else
+		cinfo->attrkey = PyString_InternFromString(cinfo->attrname);
+#endif
+		errorCheck();
+	}
+	return cinfo->attrkey;
+}
+
+/*
+ * Release the python objects cached in an array of ConversionInfo.
+ */
+void
+releaseConversionInfos(ConversionInfo ** cinfos, int numattrs)
+{
+	int			i;
+
+	if (cinfos == NULL)
+	{
+		return;
+	}
+	for (i = 0; i < numattrs; i++)
+	{
+		if (cinfos[i] != NULL)
+		{
+			Py_CLEAR(cinfos[i]->attrkey);
+			Py_CLEAR(cinfos[i]->guessedpytype);
+		}
+	}
+}
+
 void
 pythonDictToTuple(PyObject *p_value,
 				  TupleTableSlot *slot,
@@ -1205,19 +2054,31 @@ pythonDictToTuple(PyObject *p_value,
 	PyObject   *p_object;
 	Datum	   *values = slot->tts_values;
 	bool	   *nulls = slot->tts_isnull;
+	bool		exact_dict = PyDict_CheckExact(p_value);
 
 	for (i = 0; i < slot->tts_tupleDescriptor->natts; i++)
 	{
-		char	   *key;
+		PyObject   *key;
 		Form_pg_attribute attr = slot->tts_tupleDescriptor->attrs[i];
 		AttrNumber	cinfo_idx = attr->attnum - 1;
 
-		if (cinfos[cinfo_idx] == NULL)
+		if (cinfos[cinfo_idx] == NULL || cinfos[cinfo_idx]->unrequested)
 		{
+			values[i] = (Datum) NULL;
+			nulls[i] = true;
 			continue;
 		}
-		key = cinfos[cinfo_idx]->attrname;
-		p_object = PyMapping_GetItemString(p_value, key);
+		key = getAttrKey(cinfos[cinfo_idx]);
+		if (exact_dict)
+		{
+			/* Missing keys do not raise with a plain dict. */
+			p_object = PyDict_GetItem(p_value, key);
+			Py_XINCREF(p_object);
+		}
+		else
+		{
+			p_object = PyObject_GetItem(p_value, key);
+		}
 		if (p_object != NULL && p_object != Py_None)
 		{
 			resetStringInfo(buffer);
@@ -1254,7 +2115,10 @@ pythonSequenceToTuple(PyObject *p_value,
 				j;
 	Datum	   *values = slot->tts_values;
 	bool	   *nulls = slot->tts_isnull;
+	bool		fast_sequence;
 
+	/* Tuples (including namedtuples) and lists can be indexed directly. */
+	fast_sequence = PyTuple_Check(p_value) || PyList_CheckExact(p_value);
 	for (i = 0, j = 0; i < slot->tts_tupleDescriptor->natts; i++)
 	{
 		PyObject   *p_object;
@@ -1263,16 +2127,38 @@ pythonSequenceToTuple(PyObject *p_value,
 
 		if (cinfos[cinfo_idx] == NULL)
 		{
+			values[i] = (Datum) NULL;
+			nulls[i] = true;
 			continue;
 		}
-		p_object = PySequence_GetItem(p_value, j);
-		if(p_object == NULL || p_object == Py_None){
+		if (cinfos[cinfo_idx]->unrequested)
+		{
+			/* The value is still there, skip it without converting it. */
+			values[i] = (Datum) NULL;
 			nulls[i] = true;
-			values[i] = 0;
+			j++;
 			continue;
 		}
-		resetStringInfo(buffer);
-		values[i] = pyobjectToDatum(p_object, buffer,
+		if (fast_sequence && j < PySequence_Fast_GET_SIZE(p_value))
+		{
+			p_object = PySequence_Fast_GET_ITEM(p_value, j);
+			Py_INCREF(p_object);
+		}
+		else
+		{
+			p_object = PySequence_GetItem(p_value, j);
+			errorCheck();
+		}
+		j++;
+		if (p_object == Py_None)
+		{
+			nulls[i] = true;
+			values[i] = 0;
+			Py_DECREF(p_object);
+			continue;
+		}
+		resetStringInfo(buffer);
+		values[i] = pyobjectToDatum(p_object, buffer,
 									cinfos[cinfo_idx]);
 		if (buffer->data == NULL)
 		{
@@ -1284,7 +2170,6 @@ pythonSequenceToTuple(PyObject *p_value,
 		}
 		errorCheck();
 		Py_DECREF(p_object);
-		j++;
 	}
 }
 
@@ -1316,14 +2201,1028 @@ pythonResultToTuple(PyObject *p_value,
 	}
 }
 
+/*
+ * Column blocks.
+ *
+ * A ColumnBlock holds a block of rows by column. Columns exposing a buffer
+ * of integer, floating point or boolean items are read directly from
+ * the buffer; other columns are read as sequences of python objects.
+ */
+
+/* Kinds of buffer items */
+#define MC_ITEM_SIGNED 's'
+#define MC_ITEM_UNSIGNED 'u'
+#define MC_ITEM_FLOAT 'f'
+#define MC_ITEM_BOOL 'b'
+
+bool
+isColumnBlock(PyObject *p_block)
+{
+	static PyObject *p_columnblock_class = NULL;
+
+	return PyObject_TypeCheck(p_block, (PyTypeObject *)
+							  getCachedClass(&p_columnblock_class,
+											 "multicorn", "ColumnBlock"));
+}
+
+/*
+ * Returns the kind of the items of a one-dimensional buffer, or 0 if they
+ * cannot be read directly.
+ */
+static char
+getBufferItemKind(Py_buffer *view)
+{
+	const char *format = view->format == NULL ? "B" : view->format;
+
+	if (view->ndim != 1)
+	{
+		return 0;
+	}
+	/* Only native byte order is supported */
+	if (*format == '@' || *format == '=')
+	{
+		format++;
+	}
+	if (format[0] == '\0' || format[1] != '\0')
+	{
+		return 0;
+	}
+	switch (format[0])
+	{
+		case 'b':
+		case 'h':
+		case 'i':
+		case 'l':
+		case 'q':
+		case 'n':
+			return MC_ITEM_SIGNED;
+		case 'B':
+		case 'H':
+		case 'I':
+		case 'L':
+		case 'Q':
+		case 'N':
+			return MC_ITEM_UNSIGNED;
+		case 'f':
+		case 'd':
+			return MC_ITEM_FLOAT;
+		case '?':
+			return MC_ITEM_BOOL;
+		default:
+			return 0;
+	}
+}
+
+/*
+ * Returns true if items of the given kind can be stored directly in a column
+ * of the given type.
+ */
+static bool
+bufferKindMatchesType(char kind, Oid typeoid)
+{
+	switch (typeoid)
+	{
+		case INT2OID:
+		case INT4OID:
+		case INT8OID:
+			return kind == MC_ITEM_SIGNED || kind == MC_ITEM_UNSIGNED;
+		case FLOAT4OID:
+		case FLOAT8OID:
+		case NUMERICOID:
+			return kind == MC_ITEM_SIGNED || kind == MC_ITEM_UNSIGNED ||
+				kind == MC_ITEM_FLOAT;
+		case BOOLOID:
+			return kind == MC_ITEM_BOOL;
+		default:
+			return false;
+	}
+}
+
+static void
+checkColumnLength(ConversionInfo * cinfo, Py_ssize_t length,
+				  Py_ssize_t expected)
+{
+	if (length < expected)
+	{
+		ereport(ERROR,
+				(errcode(ERRCODE_FDW_ERROR),
+				 errmsg("Column %s of the ColumnBlock has %ld values, "
+						"%ld were expected", cinfo->attrname,
+						(long) length, (long) expected)));
+	}
+}
+
+/*
+ * Returns a new reference to the item of a mapping for the given column,
+ * or NULL if it is missing or None.
+ */
+static PyObject *
+getColumnItem(PyObject *p_mapping, ConversionInfo * cinfo)
+{
+	PyObject   *p_item;
+
+	if (p_mapping == NULL || p_mapping == Py_None)
+	{
+		return NULL;
+	}
+	if (PyDict_CheckExact(p_mapping))
+	{
+		p_item = PyDict_GetItem(p_mapping, getAttrKey(cinfo));
+		Py_XINCREF(p_item);
+	}
+	else
+	{
+		p_item = PyObject_GetItem(p_mapping, getAttrKey(cinfo));
+		PyErr_Clear();
+	}
+	if (p_item == Py_None)
+	{
+		Py_CLEAR(p_item);
+	}
+	return p_item;
+}
+
+/*
+ * Release the buffers and objects held by the column readers.
+ */
+static void
+releaseColumnReaders(MulticornExecState * state, int natts)
+{
+	int			i;
+
+	for (i = 0; i < natts; i++)
+	{
+		MulticornColumnReader *reader = &state->column_readers[i];
+
+		if (reader->has_view)
+		{
+			PyBuffer_Release(&reader->view);
+		}
+		if (reader->has_nullview)
+		{
+			PyBuffer_Release(&reader->nullview);
+		}
+		Py_XDECREF(reader->p_values);
+		Py_XDECREF(reader->p_nulls);
+		memset(reader, 0, sizeof(MulticornColumnReader));
+	}
+}
+
+/*
+ * Prepare the readers for a new ColumnBlock. The buffers are acquired once
+ * for the whole block.
+ */
+void
+beginColumnBlock(MulticornExecState * state, PyObject *p_block, int natts)
+{
+	PyObject   *p_columns,
+			   *p_nulls,
+			   *p_length;
+	PyObject   *volatile p_values = NULL;
+	int			i;
+
+	p_columns = PyObject_GetAttrString(p_block, "columns");
+	errorCheck();
+	p_nulls = PyObject_GetAttrString(p_block, "nulls");
+	errorCheck();
+	p_length = PyObject_GetAttrString(p_block, "length");
+	errorCheck();
+	state->columnblock_length = PyNumber_AsSsize_t(p_length, PyExc_OverflowError);
+	Py_DECREF(p_length);
+	errorCheck();
+	PG_TRY();
+	{
+		for (i = 0; i < natts; i++)
+		{
+			MulticornColumnReader *reader = &state->column_readers[i];
+			ConversionInfo *cinfo = state->cinfos[i];
+
+			if (cinfo == NULL || cinfo->unrequested)
+			{
+				continue;
+			}
+			p_values = getColumnItem(p_columns, cinfo);
+			if (p_values == NULL)
+			{
+				continue;
+			}
+			if (PyObject_CheckBuffer(p_values) &&
+				PyObject_GetBuffer(p_values, &reader->view,
+								   PyBUF_STRIDES | PyBUF_FORMAT) == 0)
+			{
+				reader->has_view = true;
+				reader->kind = getBufferItemKind(&reader->view);
+				if (bufferKindMatchesType(reader->kind, cinfo->atttypoid))
+				{
+					checkColumnLength(cinfo, reader->view.shape[0],
+									  state->columnblock_length);
+				}
+				else
+				{
+					PyBuffer_Release(&reader->view);
+					reader->has_view = false;
+				}
+			}
+			PyErr_Clear();
+			if (!reader->has_view)
+			{
+				reader->p_values = PySequence_Fast(p_values,
+									 "ColumnBlock columns must be sequences");
+				errorCheck();
+				checkColumnLength(cinfo,
+								  PySequence_Fast_GET_SIZE(reader->p_values),
+								  state->columnblock_length);
+			}
+			Py_CLEAR(p_values);
+
+			p_values = getColumnItem(p_nulls, cinfo);
+			if (p_values == NULL)
+			{
+				continue;
+			}
+			if (PyObject_CheckBuffer(p_values) &&
+				PyObject_GetBuffer(p_values, &reader->nullview,
+								   PyBUF_STRIDES | PyBUF_FORMAT) == 0)
+			{
+				reader->has_nullview = true;
+				if (reader->nullview.ndim == 1 &&
+					reader->nullview.itemsize == 1)
+				{
+					checkColumnLength(cinfo, reader->nullview.shape[0],
+									  state->columnblock_length);
+				}
+				else
+				{
+					PyBuffer_Release(&reader->nullview);
+					reader->has_nullview = false;
+				}
+			}
+			PyErr_Clear();
+			if (!reader->has_nullview)
+			{
+				reader->p_nulls = PySequence_Fast(p_values,
+									"ColumnBlock nulls must be sequences");
+				errorCheck();
+				checkColumnLength(cinfo,
+								  PySequence_Fast_GET_SIZE(reader->p_nulls),
+								  state->columnblock_length);
+			}
+			Py_CLEAR(p_values);
+		}
+	}
+	PG_CATCH();
+	{
+		/*
+		 * The block is not kept by the state yet: release the buffers
+		 * already acquired, which would otherwise stay exported.
+		 */
+		releaseColumnReaders(state, natts);
+		Py_XDECREF(p_values);
+		Py_DECREF(p_columns);
+		Py_DECREF(p_nulls);
+		PG_RE_THROW();
+	}
+	PG_END_TRY();
+	Py_DECREF(p_columns);
+	Py_DECREF(p_nulls);
+	state->p_columnblock = p_block;
+	Py_INCREF(p_block);
+	state->batch_index = 0;
+}
+
+/*
+ * Release the buffers and objects held by the readers of the current
+ * ColumnBlock or Arrow record batch.
+ */
+void
+releaseColumnBlock(MulticornExecState * state, int natts)
+{
+	if (state->p_columnblock == NULL)
+	{
+		return;
+	}
+	releaseArrowBatch(state, natts);
+	releaseColumnReaders(state, natts);
+	Py_CLEAR(state->p_columnblock);
+}
+
+/*
+ * Convert an item read from a buffer to a datum of the column type.
+ */
+static Datum
+bufferItemToDatum(MulticornColumnReader * reader, char *item,
+				  ConversionInfo * cinfo)
+{
+	int64		ivalue = 0;
+	uint64		uvalue = 0;
+	double		dvalue = 0;
+	bool		isfloat = reader->kind == MC_ITEM_FLOAT;
+
+	/*
+	 * Buffer items are not necessarily aligned, they are copied to local
+	 * variables instead of being dereferenced in place.
+	 */
+	switch (reader->kind)
+	{
+		case MC_ITEM_BOOL:
+			return BoolGetDatum(*item != 0);
+		case MC_ITEM_FLOAT:
+			if (reader->view.itemsize == sizeof(float))
+			{
+				float		fvalue;
+
+				memcpy(&fvalue, item, sizeof(float));
+				dvalue = fvalue;
+			}
+			else
+				memcpy(&dvalue, item, sizeof(double));
+			break;
+		case MC_ITEM_SIGNED:
+			switch (reader->view.itemsize)
+			{
+				case 1:
+					ivalue = *(int8 *) item;
+					break;
+				case 2:
+					{
+						int16		value;
+
+						memcpy(&value, item, sizeof(int16));
+						ivalue = value;
+						break;
+					}
+				case 4:
+					{
+						int32		value;
+
+						memcpy(&value, item, sizeof(int32));
+						ivalue = value;
+						break;
+					}
+				default:
+					memcpy(&ivalue, item, sizeof(int64));
+					break;
+			}
+			break;
+		case MC_ITEM_UNSIGNED:
+			switch (reader->view.itemsize)
+			{
+				case 1:
+					uvalue = *(uint8 *) item;
+					break;
+				case 2:
+					{
+						uint16		value;
+
+						memcpy(&value, item, sizeof(uint16));
+						uvalue = value;
+						break;
+					}
+				case 4:
+					{
+						uint32		value;
+
+						memcpy(&value, item, sizeof(uint32));
+						uvalue = value;
+						break;
+					}
+				default:
+					memcpy(&uvalue, item, sizeof(uint64));
+					break;
+			}
+			if (uvalue > (uint64) INT64CONST(0x7FFFFFFFFFFFFFFF))
+			{
+				ereport(ERROR,
+						(errcode(ERRCODE_NUMERIC_VALUE_OUT_OF_RANGE),
+						 errmsg("value " UINT64_FORMAT " is out of range for type %s",
+								uvalue, format_type_be(cinfo->atttypoid))));
+			}
+			ivalue = (int64) uvalue;
+			break;
+	}
+	return nativeNumberToDatum(ivalue, dvalue, isfloat, cinfo);
+}
+
+/*
+ * Convert a number read from a native buffer to a datum of the column type,
+ * which must be a floating point or numeric type if isfloat is true, or an
+ * integer, floating point or numeric type otherwise.
+ * If isfloat is true, the value is dvalue; otherwise it is ivalue.
+ */
+Datum
+nativeNumberToDatum(int64 ivalue, double dvalue, bool isfloat,
+					ConversionInfo * cinfo)
+{
+	if (!isfloat)
+	{
+		dvalue = (double) ivalue;
+	}
+	switch (cinfo->atttypoid)
+	{
+		case INT2OID:
+			if (ivalue < SHRT_MIN || ivalue > SHRT_MAX)
+				break;
+			return Int16GetDatum((int16) ivalue);
+		case INT4OID:
+			if (ivalue < INT_MIN || ivalue > INT_MAX)
+				break;
+			return Int32GetDatum((int32) ivalue);
+		case INT8OID:
+			return Int64GetDatum(ivalue);
+		case FLOAT4OID:
+			if (isinf((float4) dvalue) && !isinf(dvalue))
+				break;
+			return Float4GetDatum((float4) dvalue);
+		case FLOAT8OID:
+			return Float8GetDatum(dvalue);
+		case NUMERICOID:
+			if (isfloat)
+				return DirectFunctionCall1(float8_numeric,
+										   Float8GetDatum(dvalue));
+			return DirectFunctionCall1(int8_numeric, Int64GetDatum(ivalue));
+	}
+	ereport(ERROR,
+			(errcode(ERRCODE_NUMERIC_VALUE_OUT_OF_RANGE),
+			 errmsg("value %g is out of range for type %s",
+					dvalue, format_type_be(cinfo->atttypoid))));
+	return (Datum) 0;
+}
+
+/*
+ * Store the row at the given index of the current ColumnBlock in the slot.
+ */
+void
+columnBlockToTuple(MulticornExecState * state, Py_ssize_t index,
+				   TupleTableSlot *slot)
+{
+	Datum	   *values = slot->tts_values;
+	bool	   *nulls = slot->tts_isnull;
+	int			i;
+
+	for (i = 0; i < slot->tts_tupleDescriptor->natts; i++)
+	{
+		MulticornColumnReader *reader = &state->column_readers[i];
+		ConversionInfo *cinfo = state->cinfos[i];
+		bool		isnull;
+
+		values[i] = (Datum) 0;
+		nulls[i] = true;
+		if (reader->arrow != NULL)
+		{
+			nulls[i] = !arrowColumnToDatum(reader->arrow, index, cinfo,
+										   &values[i]);
+			continue;
+		}
+		if (!reader->has_view && reader->p_values == NULL)
+		{
+			continue;
+		}
+		if (reader->has_nullview)
+		{
+			isnull = *((char *) reader->nullview.buf +
+					   index * reader->nullview.strides[0]) != 0;
+		}
+		else if (reader->p_nulls != NULL)
+		{
+			isnull = PyObject_IsTrue(PySequence_Fast_GET_ITEM(reader->p_nulls,
+															  index));
+		}
+		else
+		{
+			isnull = false;
+		}
+		if (isnull)
+		{
+			continue;
+		}
+		if (reader->has_view)
+		{
+			values[i] = bufferItemToDatum(reader,
+										  (char *) reader->view.buf +
+										  index * reader->view.strides[0],
+										  cinfo);
+			nulls[i] = false;
+		}
+		else
+		{
+			PyObject   *p_object = PySequence_Fast_GET_ITEM(reader->p_values,
+															index);
+
+			if (p_object == Py_None)
+			{
+				continue;
+			}
+			resetStringInfo(state->buffer);
+			values[i] = pyobjectToDatum(p_object, state->buffer, cinfo);
+			nulls[i] = state->buffer->data == NULL;
+			errorCheck();
+		}
+	}
+}
+
+/*
+ * Returns a borrowed reference to a python class or module attribute,
+ * imported on first use and cached for the lifetime of the backend.
+ */
+static PyObject *
+getCachedClass(PyObject **cache, const char *modulename, const char *classname)
+{
+	if (*cache == NULL)
+	{
+		PyObject   *p_module = PyImport_ImportModule(modulename);
+
+		errorCheck();
+		*cache = PyObject_GetAttrString(p_module, classname);
+		Py_DECREF(p_module);
+		errorCheck();
+	}
+	return *cache;
+}
+
+/*
+ * Build a numeric datum from its base-NBASE digits, following the same rules
+ * as make_result in utils/adt/numeric.c.
+ * If the value cannot be represented, overflow is set and the caller should
+ * fall back to the text conversion, which will report a proper error.
+ */
+static Datum
+makeNumericDatum(bool negative, int weight, int dscale,
+				 MulticornNumericDigit *digits, int ndigits, bool *overflow)
+{
+	char	   *result;
+	Size		len;
+
+	*overflow = false;
+	/* Strip leading and trailing zeroes */
+	while (ndigits > 0 && *digits == 0)
+	{
+		digits++;
+		weight--;
+		ndigits--;
+	}
+	while (ndigits > 0 && digits[ndigits - 1] == 0)
+		ndigits--;
+	if (ndigits == 0)
+	{
+		negative = false;
+		weight = 0;
+	}
+	if (dscale > MC_NUMERIC_DSCALE_MASK || weight > SHRT_MAX ||
+		weight < SHRT_MIN)
+	{
+		*overflow = true;
+		return (Datum) 0;
+	}
+	if (dscale <= MC_NUMERIC_SHORT_DSCALE_MAX &&
+		weight <= MC_NUMERIC_SHORT_WEIGHT_MAX &&
+		weight >= MC_NUMERIC_SHORT_WEIGHT_MIN)
+	{
+		uint16		header = MC_NUMERIC_SHORT;
+
+		len = MC_NUMERIC_HDRSZ_SHORT + ndigits * sizeof(MulticornNumericDigit);
+		result = palloc(len);
+		if (negative)
+			header |= MC_NUMERIC_SHORT_SIGN_MASK;
+		header |= (dscale << MC_NUMERIC_SHORT_DSCALE_SHIFT);
+		if (weight < 0)
+			header |= MC_NUMERIC_SHORT_WEIGHT_SIGN_MASK;
+		header |= (weight & MC_NUMERIC_SHORT_WEIGHT_MASK);
+		memcpy(result + VARHDRSZ, &header, sizeof(uint16));
+		memcpy(result + MC_NUMERIC_HDRSZ_SHORT, digits,
+			   ndigits * sizeof(MulticornNumericDigit));
+	}
+	else
+	{
+		uint16		sign_dscale = (negative ? MC_NUMERIC_NEG : MC_NUMERIC_POS) |
+		(dscale & MC_NUMERIC_DSCALE_MASK);
+		int16		n_weight = (int16) weight;
+
+		len = MC_NUMERIC_HDRSZ + ndigits * sizeof(MulticornNumericDigit);
+		result = palloc(len);
+		memcpy(result + VARHDRSZ, &sign_dscale, sizeof(uint16));
+		memcpy(result + VARHDRSZ + sizeof(uint16), &n_weight, sizeof(int16));
+		memcpy(result + MC_NUMERIC_HDRSZ, digits,
+			   ndigits * sizeof(MulticornNumericDigit));
+	}
+	SET_VARSIZE(result, len);
+	return PointerGetDatum(result);
+}
+
+/* Floor division and modulo, for splitting decimal exponents into groups */
+#define FLOORDIV(a, b) (((a) >= 0) ? (a) / (b) : -((-(a) + (b) - 1) / (b)))
+#define FLOORMOD(a, b) ((a) - FLOORDIV(a, b) * (b))
+
+/*
+ * Convert a decimal.Decimal instance to a numeric, using the digits
+ * returned by Decimal.as_tuple().
+ */
+static bool
+pydecimalToNumeric(PyObject *object, Datum *value)
+{
+	PyObject   *p_tuple = PyObject_CallMethod(object, "as_tuple", "()"),
+			   *p_digits,
+			   *p_exponent;
+	Py_ssize_t	ndecdigits,
+				i;
+	long		exponent;
+	int			weight,
+				lastgroup,
+				ndigits;
+	bool		negative,
+				overflow;
+	MulticornNumericDigit *digits;
+
+	errorCheck();
+	p_digits = PyTuple_GetItem(p_tuple, 1);
+	p_exponent = PyTuple_GetItem(p_tuple, 2);
+	if (!PyIntOrLong_Check(p_exponent))
+	{
+		/* NaN and infinities are left to the text conversion */
+		Py_DECREF(p_tuple);
+		return false;
+	}
+	negative = PyObject_IsTrue(PyTuple_GetItem(p_tuple, 0));
+	exponent = PyLong_AsLong(p_exponent);
+	ndecdigits = PyTuple_Size(p_digits);
+	if (ndecdigits == 0 || exponent > INT_MAX / 2 ||
+		exponent < INT_MIN / 2)
+	{
+		Py_DECREF(p_tuple);
+		return false;
+	}
+	/* The power of ten of the first digit gives the weight */
+	weight = FLOORDIV((int) (ndecdigits - 1 + exponent), MC_DEC_DIGITS);
+	lastgroup = FLOORDIV((int) exponent, MC_DEC_DIGITS);
+	ndigits = weight - lastgroup + 1;
+	digits = palloc0(ndigits * sizeof(MulticornNumericDigit));
+	for (i = 0; i < ndecdigits; i++)
+	{
+		int			power = (int) (ndecdigits - 1 - i + exponent);
+		int			group = weight - FLOORDIV(power, MC_DEC_DIGITS);
+		int			decdigit = (int) PyLong_AsLong(PyTuple_GET_ITEM(p_digits, i));
+		int			j;
+
+		for (j = FLOORMOD(power, MC_DEC_DIGITS); j > 0; j--)
+			decdigit *= 10;
+		digits[group] += decdigit;
+	}
+	Py_DECREF(p_tuple);
+	*value = makeNumericDatum(negative, weight,
+							  exponent < 0 ? (int) -exponent : 0,
+							  digits, ndigits, &overflow);
+	pfree(digits);
+	return !overflow;
+}
+
+/*
+ * Convert a python int too large for an int64 to a numeric, by splitting it
+ * in base-NBASE digits.
+ */
+static bool
+pylongToNumeric(PyObject *object, Datum *value)
+{
+	PyObject   *p_base = PyLong_FromLong(MC_NBASE),
+			   *p_rest;
+	int			maxdigits = 16,
+				ndigits = 0,
+				i;
+	bool		negative,
+				overflow;
+	MulticornNumericDigit *digits = palloc(maxdigits *
+										   sizeof(MulticornNumericDigit));
+
+	/* The value is out of the int64 range, so comparing to NBASE is enough */
+	negative = PyObject_RichCompareBool(object, p_base, Py_LT) == 1;
+	p_rest = PyNumber_Absolute(object);
+	errorCheck();
+	/* Collect the digits, least significant first */
+	while (PyObject_IsTrue(p_rest))
+	{
+		PyObject   *p_divmod = PyNumber_Divmod(p_rest, p_base);
+
+		errorCheck();
+		if (ndigits == maxdigits)
+		{
+			maxdigits *= 2;
+			digits = repalloc(digits,
+							  maxdigits * sizeof(MulticornNumericDigit));
+		}
+		digits[ndigits++] = (MulticornNumericDigit)
+			PyLong_AsLong(PyTuple_GET_ITEM(p_divmod, 1));
+		Py_DECREF(p_rest);
+		p_rest = PyTuple_GET_ITEM(p_divmod, 0);
+		Py_INCREF(p_rest);
+		Py_DECREF(p_divmod);
+	}
+	Py_DECREF(p_rest);
+	Py_DECREF(p_base);
+	/* And put them back in the numeric order */
+	for (i = 0; i < ndigits / 2; i++)
+	{
+		MulticornNumericDigit tmp = digits[i];
+
+		digits[i] = digits[ndigits - 1 - i];
+		digits[ndigits - 1 - i] = tmp;
+	}
+	*value = makeNumericDatum(negative, ndigits - 1, 0, digits, ndigits,
+							  &overflow);
+	pfree(digits);
+	return !overflow;
+}
+
+/*
+ * Build a timestamp from a python datetime object. For timestamptz columns,
+ * naive datetimes are interpreted in the session timezone, just like their
+ * textual representation would be.
+ */
+static bool
+pydatetimeToTimestamp(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	struct pg_tm tm;
+	fsec_t		fsec;
+	Timestamp	result;
+	int			tz;
+	int			usec = PyDateTime_DATE_GET_MICROSECOND(object);
+
+	tm.tm_year = PyDateTime_GET_YEAR(object);
+	tm.tm_mon = PyDateTime_GET_MONTH(object);
+	tm.tm_mday = PyDateTime_GET_DAY(object);
+	tm.tm_hour = PyDateTime_DATE_GET_HOUR(object);
+	tm.tm_min = PyDateTime_DATE_GET_MINUTE(object);
+	tm.tm_sec = PyDateTime_DATE_GET_SECOND(object);
+	tm.tm_isdst = -1;
+#ifdef HAVE_INT64_TIMESTAMP
+	fsec = usec;
+#else
+	fsec = usec / 1000000.0;
+#endif
+	if (cinfo->atttypoid == TIMESTAMPTZOID)
+	{
+		PyObject   *p_offset = PyObject_CallMethod(object, "utcoffset", "()");
+
+		errorCheck();
+		if (p_offset == Py_None)
+		{
+			tz = DetermineTimeZoneOffset(&tm, session_timezone);
+		}
+		else
+		{
+			tz = -(((PyDateTime_Delta *) p_offset)->days * SECS_PER_DAY +
+				   ((PyDateTime_Delta *) p_offset)->seconds);
+		}
+		Py_DECREF(p_offset);
+		if (tm2timestamp(&tm, fsec, &tz, &result) != 0)
+			return false;
+		*value = TimestampTzGetDatum(result);
+		if (cinfo->atttypmod >= 0)
+			*value = DirectFunctionCall2(timestamptz_scale, *value,
+										 Int32GetDatum(cinfo->atttypmod));
+	}
+	else
+	{
+		if (tm2timestamp(&tm, fsec, NULL, &result) != 0)
+			return false;
+		*value = TimestampGetDatum(result);
+		if (cinfo->atttypmod >= 0)
+			*value = DirectFunctionCall2(timestamp_scale, *value,
+										 Int32GetDatum(cinfo->atttypmod));
+	}
+	return true;
+}
+
+/*
+ * Native converters, building a datum directly from a python object instead
+ * of formatting it as text and calling the type input function.
+ *
+ * They return false if the object cannot be converted this way, in which
+ * case the caller should use the generic conversion.
+ */
+static bool
+pyintToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	int			overflow;
+	PY_LONG_LONG lvalue;
+
+	if (!PyIntOrLong_Check(object) || PyBool_Check(object))
+		return false;
+	lvalue = PyLong_AsLongLongAndOverflow(object, &overflow);
+	if (overflow != 0)
+		return false;
+	switch (cinfo->atttypoid)
+	{
+		case INT2OID:
+			if (lvalue < SHRT_MIN || lvalue > SHRT_MAX)
+				return false;
+			*value = Int16GetDatum((int16) lvalue);
+			break;
+		case INT4OID:
+			if (lvalue < INT_MIN || lvalue > INT_MAX)
+				return false;
+			*value = Int32GetDatum((int32) lvalue);
+			break;
+		default:
+			*value = Int64GetDatum((int64) lvalue);
+			break;
+	}
+	return true;
+}
+
+static bool
+pyfloatToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	double		dvalue;
+
+	if (PyFloat_Check(object))
+	{
+		dvalue = PyFloat_AS_DOUBLE(object);
+	}
+	else if (PyIntOrLong_Check(object) && !PyBool_Check(object))
+	{
+		dvalue = PyLong_AsDouble(object);
+		if (dvalue == -1.0 && PyErr_Occurred())
+		{
+			PyErr_Clear();
+			return false;
+		}
+	}
+	else
+	{
+		return false;
+	}
+	if (cinfo->atttypoid == FLOAT4OID)
+	{
+		float4		fvalue = (float4) dvalue;
+
+		/* Let float4in report the overflow */
+		if (isinf(fvalue) && !isinf(dvalue))
+			return false;
+		*value = Float4GetDatum(fvalue);
+	}
+	else
+	{
+		*value = Float8GetDatum(dvalue);
+	}
+	return true;
+}
+
+static bool
+pyboolToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	if (!PyBool_Check(object))
+		return false;
+	*value = BoolGetDatum(object == Py_True);
+	return true;
+}
+
+static bool
+pydateToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	int			year,
+				month,
+				day;
+
+	if (!PyDate_Check(object))
+		return false;
+	year = PyDateTime_GET_YEAR(object);
+	month = PyDateTime_GET_MONTH(object);
+	day = PyDateTime_GET_DAY(object);
+	if (!IS_VALID_JULIAN(year, month, day))
+		return false;
+	*value = DateADTGetDatum(date2j(year, month, day) - POSTGRES_EPOCH_JDATE);
+	return true;
+}
+
+static bool
+pydatetimeToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	if (!PyDateTime_Check(object))
+		return false;
+	return pydatetimeToTimestamp(object, cinfo, value);
+}
+
+static bool
+pynumericToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	static PyObject *p_decimal_class = NULL;
+
+	if (PyIntOrLong_Check(object) && !PyBool_Check(object))
+	{
+		int			overflow;
+		PY_LONG_LONG lvalue = PyLong_AsLongLongAndOverflow(object, &overflow);
+
+		if (overflow != 0)
+		{
+			if (!pylongToNumeric(object, value))
+				return false;
+		}
+		else
+		{
+			*value = DirectFunctionCall1(int8_numeric,
+										 Int64GetDatum((int64) lvalue));
+		}
+	}
+	else if (PyObject_TypeCheck(object, (PyTypeObject *)
+					 getCachedClass(&p_decimal_class, "decimal", "Decimal")))
+	{
+		if (!pydecimalToNumeric(object, value))
+			return false;
+	}
+	else
+	{
+		return false;
+	}
+	if (cinfo->atttypmod >= 0)
+	{
+		*value = DirectFunctionCall2(numeric, *value,
+									 Int32GetDatum(cinfo->atttypmod));
+	}
+	return true;
+}
+
+static bool
+pyuuidToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	static PyObject *p_uuid_class = NULL;
+	PyObject   *p_bytes;
+	char	   *data;
+	Py_ssize_t	size;
+
+	if (!PyObject_TypeCheck(object, (PyTypeObject *)
+							getCachedClass(&p_uuid_class, "uuid", "UUID")))
+		return false;
+	p_bytes = PyObject_GetAttrString(object, "bytes");
+	errorCheck();
+	if (PyBytes_AsStringAndSize(p_bytes, &data, &size) < 0 ||
+		size != UUID_LEN)
+	{
+		PyErr_Clear();
+		Py_DECREF(p_bytes);
+		return false;
+	}
+	*value = PointerGetDatum(palloc(UUID_LEN));
+	memcpy(DatumGetPointer(*value), data, UUID_LEN);
+	Py_DECREF(p_bytes);
+	return true;
+}
+
+/*
+ * Returns the native converter for a given type, or NULL if values of this
+ * type should always go through the text conversion.
+ * This is called once per column, when initializing the ConversionInfo.
+ */
+pyobjectToDatumFunc
+getNativeConverter(Oid typeoid)
+{
+	switch (typeoid)
+	{
+		case INT2OID:
+		case INT4OID:
+		case INT8OID:
+			return pyintToDatum;
+		case FLOAT4OID:
+		case FLOAT8OID:
+			return pyfloatToDatum;
+		case BOOLOID:
+			return pyboolToDatum;
+		case DATEOID:
+			importDateTime();
+			return pydateToDatum;
+		case TIMESTAMPOID:
+		case TIMESTAMPTZOID:
+			importDateTime();
+			return pydatetimeToDatum;
+		case NUMERICOID:
+			return pynumericToDatum;
+		case UUIDOID:
+			return pyuuidToDatum;
+		default:
+			return NULL;
+	}
+}
+
 Datum
 pyobjectToDatum(PyObject *object, StringInfo buffer,
 				ConversionInfo * cinfo)
 {
 	Datum		value = 0;
 
-	pyobjectToCString(object, buffer,
-					  cinfo);
+	if (cinfo->pytodatum != NULL && cinfo->pytodatum(object, cinfo, &value))
+	{
+		return value;
+	}
+
+	/*
+	 * Values of a given column are usually all of the same python type:
+	 * reuse the text converter picked for the previous value if possible.
+	 */
+	if (Py_TYPE(object) != cinfo->guessedpytype)
+	{
+		Py_XDECREF(cinfo->guessedpytype);
+		cinfo->guessedpytype = Py_TYPE(object);
+		Py_INCREF(cinfo->guessedpytype);
+		cinfo->guessedtocstring = getCStringConverter(object);
+	}
+	cinfo->guessedtocstring(object, buffer, cinfo);
 
 	if (buffer->len >= 0)
 	{
@@ -1349,112 +3248,380 @@ pyobjectToDatum(PyObject *object, StringInfo buffer,
 }
 
 PyObject *
-datumStringToPython(Datum datum, ConversionInfo * cinfo)
+datumStringToPython(Datum datum, ConversionInfo * cinfo)
+{
+	char	   *temp;
+	ssize_t		size;
+	PyObject   *result;
+
+	temp = datum == 0 ? "?" : TextDatumGetCString(datum);
+	size = strlen(temp);
+	result = PyUnicode_Decode(temp, size, getPythonEncodingName(), NULL);
+	return result;
+}
+
+/*
+ * Convert a C string in the database encoding to a python unicode object.
+ */
+static PyObject *
+cstringToPython(const char *temp)
+{
+	return PyUnicode_Decode(temp, strlen(temp), getPythonEncodingName(), NULL);
+}
+
+/*
+ * Resolve the output information for a type not handled by one of the native
+ * converters. For an array, this is the information of the element type.
+ * The result is cached in the ConversionInfo, since a given column (or qual)
+ * is usually always converted from the same type.
+ */
+static void
+lookupOutputInfo(Oid type, ConversionInfo * cinfo)
+{
+	Oid			outputtype = type;
+	Oid			outfuncoid;
+	bool		isvarlena;
+
+	cinfo->outelemtypoid = get_element_type(type);
+	cinfo->outelemconverter = NULL;
+	if (OidIsValid(cinfo->outelemtypoid))
+	{
+		get_typlenbyvalalign(cinfo->outelemtypoid, &cinfo->outelemlen,
+							 &cinfo->outelembyval, &cinfo->outelemalign);
+		cinfo->outelemconverter = getPythonConverter(cinfo->outelemtypoid);
+		outputtype = cinfo->outelemtypoid;
+	}
+	if (cinfo->outelemconverter == NULL)
+	{
+		getTypeOutputInfo(outputtype, &outfuncoid, &isvarlena);
+		/* The function must live as long as the ConversionInfo itself */
+		fmgr_info_cxt(outfuncoid, &cinfo->outfunc,
+					  GetMemoryChunkContext(cinfo));
+	}
+	cinfo->outtypoid = type;
+}
+
+PyObject *
+datumUnknownToPython(Datum datum, ConversionInfo * cinfo, Oid type)
+{
+	if (cinfo->outtypoid != type)
+	{
+		lookupOutputInfo(type, cinfo);
+	}
+	return cstringToPython(OutputFunctionCall(&cinfo->outfunc, datum));
+}
+
+/*
+ * Numerics are converted from their base-NBASE digits: to an int if they have
+ * no decimal part, or to a decimal.Decimal built from its (sign, digits,
+ * exponent) tuple otherwise.
+ */
+PyObject *
+datumNumberToPython(Datum datum, ConversionInfo * cinfo)
+{
+	static PyObject *p_decimal_class = NULL;
+	Numeric		num = DatumGetNumeric(datum);
+	MulticornNumericDigit *digits;
+	int			ndigits,
+				weight,
+				dscale,
+				ndecdigits,
+				intgroups,
+				w,
+				i;
+	bool		negative;
+	PyObject   *p_digits,
+			   *result;
+
+	getCachedClass(&p_decimal_class, "decimal", "Decimal");
+	if (MC_NUMERIC_FLAGBITS(num) == MC_NUMERIC_SPECIAL)
+	{
+		/* NaN, and infinities on versions supporting them */
+		return PyObject_CallFunction(p_decimal_class, "s",
+									 DatumGetCString(DirectFunctionCall1(numeric_out,
+																		 datum)));
+	}
+	digits = MC_NUMERIC_DIGITS(num);
+	ndigits = MC_NUMERIC_NDIGITS(num);
+	weight = MC_NUMERIC_WEIGHT(num);
+	dscale = MC_NUMERIC_DSCALE(num);
+	negative = MC_NUMERIC_IS_NEGATIVE(num);
+	if (dscale == 0 && weight < 4)
+	{
+		/* Fits in an int64 */
+		int64		value = 0;
+
+		for (w = weight; w >= 0; w--)
+		{
+			i = weight - w;
+			value = value * MC_NBASE + (i < ndigits ? digits[i] : 0);
+		}
+		return PyLong_FromLongLong(negative ? -value : value);
+	}
+
+	/*
+	 * Expand the digits to decimal digits, from the first integer group (or
+	 * the units if there is none) down to dscale decimal places.
+	 */
+	intgroups = weight >= 0 ? weight + 1 : 1;
+	ndecdigits = intgroups * MC_DEC_DIGITS + dscale;
+	p_digits = PyTuple_New(ndecdigits);
+	for (i = 0; i < ndecdigits; i++)
+	{
+		int			power = intgroups * MC_DEC_DIGITS - 1 - i;
+		int			group = weight - FLOORDIV(power, MC_DEC_DIGITS);
+		int			decdigit = 0;
+
+		if (group >= 0 && group < ndigits)
+		{
+			int			j;
+
+			decdigit = digits[group];
+			for (j = FLOORMOD(power, MC_DEC_DIGITS); j > 0; j--)
+				decdigit /= 10;
+			decdigit %= 10;
+		}
+		PyTuple_SET_ITEM(p_digits, i, PyLong_FromLong(decdigit));
+	}
+	if (dscale == 0)
+	{
+		/* Too large for an int64: let python do the arithmetic */
+		PyObject   *p_decimal = PyObject_CallFunction(p_decimal_class,
+													  "((iOi))",
+													  negative, p_digits, 0);
+
+		result = p_decimal == NULL ? NULL : PyNumber_Long(p_decimal);
+		Py_XDECREF(p_decimal);
+	}
+	else
+	{
+		result = PyObject_CallFunction(p_decimal_class, "((iOi))",
+									   negative, p_digits, -dscale);
+	}
+	Py_DECREF(p_digits);
+	return result;
+}
+
+PyObject *
+datumDateToPython(Datum datum, ConversionInfo * cinfo)
+{
+	int			year,
+				month,
+				day;
+
+	importDateTime();
+	j2date(DatumGetDateADT(datum) + POSTGRES_EPOCH_JDATE,
+		   &year, &month, &day);
+	return PyDate_FromDate(year, month, day);
+}
+
+/*
+ * Build a python datetime from a timestamp, interpreted in UTC. If tzinfo is
+ * not NULL, the resulting datetime is aware.
+ */
+static PyObject *
+timestampToPyDateTime(Timestamp timestamp, PyObject *tzinfo)
+{
+	struct pg_tm pg_tm_value;
+	fsec_t		fsec;
+	int			usec;
+
+	importDateTime();
+	timestamp2tm(timestamp, NULL, &pg_tm_value, &fsec, NULL, NULL);
+#ifdef HAVE_INT64_TIMESTAMP
+	usec = fsec;
+#else
+	usec = (int) (fsec * USECS_PER_SEC);
+#endif
+	return PyDateTimeAPI->DateTime_FromDateAndTime(pg_tm_value.tm_year,
+												   pg_tm_value.tm_mon,
+												   pg_tm_value.tm_mday,
+												   pg_tm_value.tm_hour,
+												   pg_tm_value.tm_min,
+												   pg_tm_value.tm_sec,
+												   usec,
+												   tzinfo == NULL ?
+												   Py_None : tzinfo,
+											  PyDateTimeAPI->DateTimeType);
+}
+
+PyObject *
+datumTimestampToPython(Datum datum, ConversionInfo * cinfo)
 {
-	char	   *temp;
-	ssize_t		size;
-	PyObject   *result;
-
-	temp = datum == 0 ? "?" : TextDatumGetCString(datum);
-	size = strlen(temp);
-	result = PyUnicode_Decode(temp, size, getPythonEncodingName(), NULL);
-	return result;
+	return timestampToPyDateTime(DatumGetTimestamp(datum), NULL);
 }
 
+/*
+ * Timestamps with time zone are converted to aware datetimes in UTC, using
+ * the tzinfo instance from multicorn.compat since python 2 has none.
+ */
 PyObject *
-datumUnknownToPython(Datum datum, ConversionInfo * cinfo, Oid type)
+datumTimestamptzToPython(Datum datum, ConversionInfo * cinfo)
 {
-	char	   *temp;
-	ssize_t		size;
-	PyObject   *result;
-	Oid			outfuncoid;
-	bool		isvarlena;
-	FmgrInfo   *fmout = palloc0(sizeof(FmgrInfo));
+	static PyObject *p_utc = NULL;
 
-	getTypeOutputInfo(type, &outfuncoid, &isvarlena);
-	fmgr_info(outfuncoid, fmout);
-	temp = OutputFunctionCall(fmout, datum);
-	size = strlen(temp);
-	result = PyUnicode_Decode(temp, size, getPythonEncodingName(), NULL);
-	pfree(fmout);
-	return result;
+	return timestampToPyDateTime(DatumGetTimestampTz(datum),
+								 getCachedClass(&p_utc, "multicorn.compat",
+												"utc"));
 }
 
+/*
+ * Intervals are converted to timedeltas. Since a timedelta has no notion of
+ * months, a month is counted as 30 days, like justify_days does.
+ */
 PyObject *
-datumNumberToPython(Datum datum, ConversionInfo * cinfo)
+datumIntervalToPython(Datum datum, ConversionInfo * cinfo)
 {
-	ssize_t		numvalue = (ssize_t) DatumGetNumeric(datum);
-	char	   *tempvalue = (char *) DirectFunctionCall1(numeric_out,
-														 numvalue);
-	PyObject   *buffer = PyString_FromString(tempvalue),
-#if PY_MAJOR_VERSION >= 3
-			   *value = PyFloat_FromString(buffer);
+	Interval   *interval = DatumGetIntervalP(datum);
+	int			days = interval->month * DAYS_PER_MONTH + interval->day;
+	int			seconds,
+				usecs;
+
+#ifdef HAVE_INT64_TIMESTAMP
+	int64		time = interval->time;
+
+	days += time / USECS_PER_DAY;
+	time %= USECS_PER_DAY;
+	seconds = time / USECS_PER_SEC;
+	usecs = time % USECS_PER_SEC;
 #else
-			   *value = PyFloat_FromString(buffer, NULL);
+	double		time = interval->time;
+	double		wholedays = trunc(time / SECS_PER_DAY);
+
+	days += (int) wholedays;
+	time -= wholedays * SECS_PER_DAY;
+	seconds = (int) time;
+	usecs = (int) rint((time - seconds) * USECS_PER_SEC);
 #endif
-	Py_DECREF(buffer);
-	return value;
+	importDateTime();
+	return PyDelta_FromDSU(days, seconds, usecs);
 }
 
 PyObject *
-datumDateToPython(Datum datum, ConversionInfo * cinfo)
+datumInt2ToPython(Datum datum, ConversionInfo * cinfo)
 {
-	struct pg_tm *pg_tm_value = palloc(sizeof(struct pg_tm));
-	PyObject   *result;
-	fsec_t		fsec;
+	return PyLong_FromLong(DatumGetInt16(datum));
+}
 
-	PyDateTime_IMPORT;
-	datum = DirectFunctionCall1(date_timestamp, datum);
-	timestamp2tm(DatumGetTimestamp(datum), NULL, pg_tm_value, &fsec,
-				 NULL, NULL);
-	result = PyDate_FromDate(pg_tm_value->tm_year,
-							 pg_tm_value->tm_mon, pg_tm_value->tm_mday);
-	pfree(pg_tm_value);
-	return result;
+PyObject *
+datumIntToPython(Datum datum, ConversionInfo * cinfo)
+{
+	return PyLong_FromLong(DatumGetInt32(datum));
 }
 
 PyObject *
-datumTimestampToPython(Datum datum, ConversionInfo * cinfo)
+datumInt8ToPython(Datum datum, ConversionInfo * cinfo)
 {
-	struct pg_tm *pg_tm_value = palloc(sizeof(struct pg_tm));
-	PyObject   *result;
-	fsec_t		fsec;
+	return PyLong_FromLongLong(DatumGetInt64(datum));
+}
+
+PyObject *
+datumFloat4ToPython(Datum datum, ConversionInfo * cinfo)
+{
+	return PyFloat_FromDouble(DatumGetFloat4(datum));
+}
+
+PyObject *
+datumFloat8ToPython(Datum datum, ConversionInfo * cinfo)
+{
+	return PyFloat_FromDouble(DatumGetFloat8(datum));
+}
+
+PyObject *
+datumBoolToPython(Datum datum, ConversionInfo * cinfo)
+{
+	return PyBool_FromLong(DatumGetBool(datum));
+}
+
+PyObject *
+datumUuidToPython(Datum datum, ConversionInfo * cinfo)
+{
+	static PyObject *p_uuid_class = NULL;
+	PyObject   *p_args,
+			   *p_kwargs,
+			   *p_bytes,
+			   *result;
+
+	p_bytes = PyBytes_FromStringAndSize((char *) DatumGetUUIDP(datum)->data,
+										UUID_LEN);
+	p_args = PyTuple_New(0);
+	p_kwargs = PyDict_New();
+	PyDict_SetItemString(p_kwargs, "bytes", p_bytes);
+	result = PyObject_Call(getCachedClass(&p_uuid_class, "uuid", "UUID"),
+						   p_args, p_kwargs);
+	Py_DECREF(p_bytes);
+	Py_DECREF(p_args);
+	Py_DECREF(p_kwargs);
+	return result;
+}
+
+/*
+ * json and jsonb values are decoded with json.loads.
+ */
+static PyObject *
+jsonStringToPython(const char *temp)
+{
+	static PyObject *p_loads = NULL;
+	PyObject   *p_string,
+			   *result;
 
-	PyDateTime_IMPORT;
-	timestamp2tm(DatumGetTimestamp(datum), NULL, pg_tm_value, &fsec,
-				 NULL, NULL);
-	result = PyDateTime_FromDateAndTime(pg_tm_value->tm_year,
-										pg_tm_value->tm_mon,
-										pg_tm_value->tm_mday,
-										pg_tm_value->tm_hour,
-										pg_tm_value->tm_min,
-										pg_tm_value->tm_sec, 0);
-	pfree(pg_tm_value);
+	p_string = cstringToPython(temp);
+	if (p_string == NULL)
+	{
+		return NULL;
+	}
+	result = PyObject_CallFunctionObjArgs(getCachedClass(&p_loads, "json",
+														 "loads"),
+										  p_string, NULL);
+	Py_DECREF(p_string);
 	return result;
 }
 
 PyObject *
-datumIntToPython(Datum datum, ConversionInfo * cinfo)
+datumJsonToPython(Datum datum, ConversionInfo * cinfo)
 {
-	return PyLong_FromLong(DatumGetInt32(datum));
+	return jsonStringToPython(TextDatumGetCString(datum));
 }
 
+#if PG_VERSION_NUM >= 90400
 PyObject *
-datumArrayToPython(Datum datum, Oid type, ConversionInfo * cinfo)
+datumJsonbToPython(Datum datum, ConversionInfo * cinfo)
 {
-#if PG_VERSION_NUM >= 90500
-	ArrayIterator iterator = array_create_iterator(DatumGetArrayTypeP(datum),
-												   0, NULL);
-# else
-	ArrayIterator iterator = array_create_iterator(DatumGetArrayTypeP(datum),
-												   0);
-# endif
+	return jsonStringToPython(DatumGetCString(DirectFunctionCall1(jsonb_out,
+																  datum)));
+}
+#endif
 
+PyObject *
+datumArrayToPython(Datum datum, Oid type, ConversionInfo * cinfo)
+{
+	ArrayType  *array = DatumGetArrayTypeP(datum);
+	ArrayIterator iterator;
+	datumToPythonFunc converter;
 	Datum		elem = (Datum) NULL;
 	bool		isnull;
 	PyObject   *result = PyList_New(0),
 			   *pyitem;
 
+	if (cinfo->outtypoid != type)
+	{
+		lookupOutputInfo(type, cinfo);
+	}
+	/* Element converters do not touch the cached output information. */
+	converter = cinfo->outelemconverter;
+#if PG_VERSION_NUM >= 90500
+	{
+		ArrayMetaState meta;
+
+		meta.element_type = cinfo->outelemtypoid;
+		meta.typlen = cinfo->outelemlen;
+		meta.typbyval = cinfo->outelembyval;
+		meta.typalign = cinfo->outelemalign;
+		iterator = array_create_iterator(array, 0, &meta);
+	}
+#else
+	iterator = array_create_iterator(array, 0);
+#endif
 	while (array_iterate(iterator, &elem, &isnull))
 	{
 		if (isnull)
@@ -1463,23 +3630,26 @@ datumArrayToPython(Datum datum, Oid type, ConversionInfo * cinfo)
 		}
 		else
 		{
-			HeapTuple	tuple;
-			Form_pg_type typeStruct;
-
-			tuple = SearchSysCache1(TYPEOID, ObjectIdGetDatum(type));
-			if (!HeapTupleIsValid(tuple))
+			if (converter != NULL)
 			{
-				elog(ERROR, "lookup failed for type %u",
-					 type);
+				pyitem = converter(elem, cinfo);
+			}
+			else
+			{
+				pyitem = cstringToPython(OutputFunctionCall(&cinfo->outfunc,
+															elem));
+			}
+			if (pyitem == NULL)
+			{
+				Py_DECREF(result);
+				array_free_iterator(iterator);
+				return NULL;
 			}
-			typeStruct = (Form_pg_type) GETSTRUCT(tuple);
-			pyitem = datumToPython(elem, typeStruct->typelem, cinfo);
-			ReleaseSysCache(tuple);
-
 			PyList_Append(result, pyitem);
 			Py_DECREF(pyitem);
 		}
 	}
+	array_free_iterator(iterator);
 	return result;
 }
 
@@ -1498,45 +3668,74 @@ datumByteaToPython(Datum datum, ConversionInfo * cinfo)
 #endif
 }
 
-
-PyObject *
-datumToPython(Datum datum, Oid type, ConversionInfo * cinfo)
+/*
+ * Returns the function converting datums of the given type to python
+ * objects, or NULL if there is no native conversion for it.
+ */
+datumToPythonFunc
+getPythonConverter(Oid type)
 {
-	HeapTuple	tuple;
-	Form_pg_type typeStruct;
-
 	switch (type)
 	{
 		case BYTEAOID:
-			return datumByteaToPython(datum, cinfo);
+			return datumByteaToPython;
 		case TEXTOID:
 		case VARCHAROID:
-			return datumStringToPython(datum, cinfo);
+			return datumStringToPython;
 		case NUMERICOID:
-			return datumNumberToPython(datum, cinfo);
+			return datumNumberToPython;
 		case DATEOID:
-			return datumDateToPython(datum, cinfo);
+			return datumDateToPython;
 		case TIMESTAMPOID:
-			return datumTimestampToPython(datum, cinfo);
+			return datumTimestampToPython;
+		case TIMESTAMPTZOID:
+			return datumTimestamptzToPython;
+		case INTERVALOID:
+			return datumIntervalToPython;
+		case INT2OID:
+			return datumInt2ToPython;
 		case INT4OID:
-			return datumIntToPython(datum, cinfo);
+			return datumIntToPython;
+		case INT8OID:
+			return datumInt8ToPython;
+		case FLOAT4OID:
+			return datumFloat4ToPython;
+		case FLOAT8OID:
+			return datumFloat8ToPython;
+		case BOOLOID:
+			return datumBoolToPython;
+		case UUIDOID:
+			return datumUuidToPython;
+		case JSONOID:
+			return datumJsonToPython;
+#if PG_VERSION_NUM >= 90400
+		case JSONBOID:
+			return datumJsonbToPython;
+#endif
 		default:
-			/* Case for the array ? */
-			tuple = SearchSysCache1(TYPEOID, ObjectIdGetDatum(type));
-			if (!HeapTupleIsValid(tuple))
-			{
-				elog(ERROR, "lookup failed for type %u",
-					 type);
-			}
-			typeStruct = (Form_pg_type) GETSTRUCT(tuple);
-			ReleaseSysCache(tuple);
-			if ((typeStruct->typelem != 0) && (typeStruct->typlen == -1))
-			{
-				/* Its an array. */
-				return datumArrayToPython(datum, type, cinfo);
-			}
-			return datumUnknownToPython(datum, cinfo, type);
+			return NULL;
+	}
+}
+
+PyObject *
+datumToPython(Datum datum, Oid type, ConversionInfo * cinfo)
+{
+	datumToPythonFunc converter = getPythonConverter(type);
+
+	if (converter != NULL)
+	{
+		return converter(datum, cinfo);
+	}
+	if (cinfo->outtypoid != type)
+	{
+		lookupOutputInfo(type, cinfo);
+	}
+	if (OidIsValid(cinfo->outelemtypoid))
+	{
+		/* Its an array. */
+		return datumArrayToPython(datum, type, cinfo);
 	}
+	return datumUnknownToPython(datum, cinfo, type);
 }
 
 /*
@@ -1544,6 +3743,9 @@ datumToPython(Datum datum, Oid type, ConversionInfo * cinfo)
  * result to a list of "tuples" (list) of the form:
  *
  * - Bitmapset of attnums - Cost (integer)
+ *
+ * followed, if the python method returned them, by the startup cost and the
+ * total cost of the path (float8 constants).
  */
 List *
 pathKeys(MulticornPlanState * state)
@@ -1552,7 +3754,12 @@ pathKeys(MulticornPlanState * state)
 	Py_ssize_t	i;
 	PyObject   *fdw_instance = state->fdw_instance,
 			   *p_pathkeys;
+	MulticornEstimate *estimate = getEstimate(state, "paths");
 
+	if (estimate != NULL)
+	{
+		return copyObject(estimate->paths);
+	}
 	p_pathkeys = PyObject_CallMethod(fdw_instance, "get_path_keys", "()");
 	errorCheck();
 	for (i = 0; i < PySequence_Length(p_pathkeys); i++)
@@ -1592,6 +3799,23 @@ pathKeys(MulticornPlanState * state)
 		item = lappend(item, attnums);
 		item = lappend(item, makeConst(INT4OID,
 									 -1, InvalidOid, 4, rows, false, true));
+		if (PySequence_Length(p_item) == 4)
+		{
+			int			l;
+
+			for (l = 2; l < 4; l++)
+			{
+				PyObject   *p_value = PySequence_GetItem(p_item, l),
+						   *p_float = PyNumber_Float(p_value);
+
+				Py_DECREF(p_value);
+				errorCheck();
+				item = lappend(item, makeConst(FLOAT8OID, -1, InvalidOid, 8,
+								   Float8GetDatum(PyFloat_AsDouble(p_float)),
+											   false, FLOAT8PASSBYVAL));
+				Py_DECREF(p_float);
+			}
+		}
 		result = lappend(result, item);
 		Py_DECREF(p_keys);
 		Py_DECREF(p_cost);
@@ -1599,6 +3823,16 @@ pathKeys(MulticornPlanState * state)
 		Py_DECREF(p_item);
 	}
 	Py_DECREF(p_pathkeys);
+	estimate = newEstimate(state, "paths");
+	if (estimate != NULL)
+	{
+		CacheEntry *entry = hash_search(InstancesHash, &state->foreigntableid,
+										HASH_FIND, NULL);
+		MemoryContext oldContext = MemoryContextSwitchTo(entry->cacheContext);
+
+		estimate->paths = copyObject(result);
+		MemoryContextSwitchTo(oldContext);
+	}
 	return result;
 }
 
@@ -1619,9 +3853,35 @@ canSort(MulticornPlanState * state, List *deparsed)
 	ListCell   *lc;
 	Py_ssize_t	i;
 	PyObject   *fdw_instance = state->fdw_instance,
-			   *p_pathkeys = PyList_New(0),
+			   *p_pathkeys,
 			   *p_sortable;
+	StringInfo	key = makeStringInfo();
+	MulticornEstimate *estimate;
+
+	appendStringInfoString(key, "sort");
+	appendSortShape(key, deparsed);
+	estimate = getEstimate(state, key->data);
+	if (estimate != NULL)
+	{
+		/* Only the attnums of the accepted sorts are used by the planner */
+		ListCell   *lc2;
+
+		foreach(lc, estimate->attnums)
+		{
+			foreach(lc2, deparsed)
+			{
+				MulticornDeparsedSortGroup *md = lfirst(lc2);
 
+				if (md->attnum == lfirst_int(lc))
+				{
+					result = lappend(result, md);
+					break;
+				}
+			}
+		}
+		return result;
+	}
+	p_pathkeys = PyList_New(0);
 	foreach(lc, deparsed)
 	{
 		MulticornDeparsedSortGroup *pathkey = (MulticornDeparsedSortGroup *) lfirst(lc);
@@ -1641,6 +3901,207 @@ canSort(MulticornPlanState * state, List *deparsed)
 	}
 	Py_DECREF(p_pathkeys);
 	Py_DECREF(p_sortable);
+	estimate = newEstimate(state, key->data);
+	if (estimate != NULL)
+	{
+		CacheEntry *entry = hash_search(InstancesHash, &state->foreigntableid,
+										HASH_FIND, NULL);
+		MemoryContext oldContext = MemoryContextSwitchTo(entry->cacheContext);
+
+		foreach(lc, result)
+		{
+			MulticornDeparsedSortGroup *md = lfirst(lc);
+
+			estimate->attnums = lappend_int(estimate->attnums, md->attnum);
+		}
+		MemoryContextSwitchTo(oldContext);
+	}
+	return result;
+}
+
+/*
+ * Call the get_sort_cost method from the python implementation, to get the
+ * additional startup and per-row costs of a scan returning sorted rows.
+ */
+void
+getSortCost(MulticornPlanState * state, List *deparsed,
+			Cost *startup_cost, Cost *per_row_cost)
+{
+	ListCell   *lc;
+	PyObject   *p_pathkeys,
+			   *p_cost;
+	StringInfo	key = makeStringInfo();
+	MulticornEstimate *estimate;
+
+	*startup_cost = 0;
+	*per_row_cost = 0;
+	if (!PyObject_HasAttrString(state->fdw_instance, "get_sort_cost"))
+	{
+		/* Wrappers not inheriting from ForeignDataWrapper */
+		return;
+	}
+	appendStringInfoString(key, "sortcost");
+	appendSortShape(key, deparsed);
+	estimate = getEstimate(state, key->data);
+	if (estimate != NULL)
+	{
+		*startup_cost = estimate->startupCost;
+		*per_row_cost = estimate->perRowCost;
+		return;
+	}
+	p_pathkeys = PyList_New(0);
+	foreach(lc, deparsed)
+	{
+		MulticornDeparsedSortGroup *pathkey = (MulticornDeparsedSortGroup *) lfirst(lc);
+		PyObject   *python_sortkey = getSortKey(pathkey);
+
+		PyList_Append(p_pathkeys, python_sortkey);
+		Py_DECREF(python_sortkey);
+	}
+	p_cost = PyObject_CallMethod(state->fdw_instance, "get_sort_cost", "(O)",
+								 p_pathkeys);
+	Py_DECREF(p_pathkeys);
+	errorCheck();
+	if (p_cost != Py_None)
+	{
+		PyObject   *p_startup_cost,
+				   *p_per_row_cost;
+
+		if (PySequence_Length(p_cost) != 2)
+		{
+			Py_DECREF(p_cost);
+			elog(ERROR, "The get_sort_cost python method should return a tuple of length 2");
+		}
+		p_startup_cost = PySequence_GetItem(p_cost, 0);
+		p_per_row_cost = PySequence_GetItem(p_cost, 1);
+		*startup_cost = PyFloat_AsDouble(p_startup_cost);
+		*per_row_cost = PyFloat_AsDouble(p_per_row_cost);
+		Py_DECREF(p_startup_cost);
+		Py_DECREF(p_per_row_cost);
+		errorCheck();
+	}
+	Py_DECREF(p_cost);
+	estimate = newEstimate(state, key->data);
+	if (estimate != NULL)
+	{
+		estimate->startupCost = *startup_cost;
+		estimate->perRowCost = *per_row_cost;
+	}
+}
+
+/*
+ * Ask the python fdw whether it can stop returning rows after the given
+ * limit.
+ */
+bool
+canLimit(MulticornPlanState * state, int64 limit)
+{
+	PyObject   *p_result;
+	bool		result;
+
+	if (!PyObject_HasAttrString(state->fdw_instance, "can_limit"))
+	{
+		/* Wrappers not inheriting from ForeignDataWrapper */
+		return false;
+	}
+	p_result = PyObject_CallMethod(state->fdw_instance, "can_limit", "(L)",
+								   (PY_LONG_LONG) limit);
+	errorCheck();
+	result = PyObject_IsTrue(p_result);
+	Py_DECREF(p_result);
+	return result;
+}
+
+/*
+ * Ask the python fdw which quals it enforces exactly, and return the
+ * corresponding clauses. The clauses and quals lists are parallel: every
+ * clause is translated to a single qual. Quals depending on parameters are
+ * unknown at planning time, and are never enforced.
+ */
+List *
+canEnforce(MulticornPlanState * state, List *clauses, List *quals)
+{
+	List	   *candidates = NIL,
+			   *result = NIL;
+	PyObject   *p_quals,
+			   *p_enforced;
+	ListCell   *lc_clause,
+			   *lc_qual;
+	bool		bool_quals;
+	Py_ssize_t	i = 0;
+
+	if (clauses == NIL ||
+		!PyObject_HasAttrString(state->fdw_instance, "can_enforce"))
+	{
+		/* Wrappers not inheriting from ForeignDataWrapper */
+		return NIL;
+	}
+	bool_quals = acceptsBoolQuals(state->fdw_instance);
+	p_quals = PyList_New(0);
+	forboth(lc_clause, clauses, lc_qual, quals)
+	{
+		MulticornBaseQual *qual = (MulticornBaseQual *) lfirst(lc_qual);
+		PyObject   *p_qual;
+
+		if (qual->right_type == T_BoolExpr && !bool_quals)
+		{
+			continue;
+		}
+		p_qual = qualToPython(NULL, qual, state->cinfos);
+		if (p_qual != NULL)
+		{
+			candidates = lappend(candidates, lfirst(lc_clause));
+			PyList_Append(p_quals, p_qual);
+			Py_DECREF(p_qual);
+		}
+	}
+	if (candidates == NIL)
+	{
+		Py_DECREF(p_quals);
+		return NIL;
+	}
+	p_enforced = PyObject_CallMethod(state->fdw_instance, "can_enforce",
+									 "(O)", p_quals);
+	errorCheck();
+	foreach(lc_clause, candidates)
+	{
+		PyObject   *p_qual = PyList_GetItem(p_quals, i++);
+
+		if (PySequence_Contains(p_enforced, p_qual) == 1)
+		{
+			result = lappend(result, lfirst(lc_clause));
+		}
+	}
+	Py_DECREF(p_quals);
+	Py_DECREF(p_enforced);
+	errorCheck();
+	return result;
+}
+
+/*
+ * Ask the python fdw of the outer table of a join whether it can compute
+ * the join with the inner table itself.
+ */
+bool
+canJoin(MulticornPlanState * state, PyObject *inner_instance)
+{
+	PyObject   *p_clauses,
+			   *p_result;
+	bool		result;
+
+	if (!PyObject_HasAttrString(state->fdw_instance, "can_join"))
+	{
+		/* Wrappers not inheriting from ForeignDataWrapper */
+		return false;
+	}
+	p_clauses = joinClausesToPyList(state->join_clauses);
+	p_result = PyObject_CallMethod(state->fdw_instance, "can_join", "(s,O,O,O)",
+								   joinTypeName(state->jointype), p_clauses,
+								   state->fdw_instance, inner_instance);
+	Py_DECREF(p_clauses);
+	errorCheck();
+	result = PyObject_IsTrue(p_result);
+	Py_DECREF(p_result);
 	return result;
 }
 
@@ -1700,3 +4161,50 @@ getRowIdColumn(PyObject *fdw_instance)
 	Py_DECREF(value);
 	return result;
 }
+
+/*
+ * Get an integer attribute of the fdw instance, or zero if it is missing.
+ */
+static int
+getIntAttribute(PyObject *fdw_instance, const char *attrname)
+{
+	PyObject   *value = PyObject_GetAttrString(fdw_instance, attrname),
+			   *p_size;
+	int			result = 0;
+
+	if (value == NULL)
+	{
+		/* Wrappers not inheriting from ForeignDataWrapper */
+		PyErr_Clear();
+		return 0;
+	}
+	if (value != Py_None)
+	{
+		p_size = PyNumber_Long(value);
+		errorCheck();
+		result = (int) PyLong_AsLong(p_size);
+		Py_DECREF(p_size);
+	}
+	Py_DECREF(value);
+	return result;
+}
+
+/*
+ * Get the number of rows per block yielded by the execute method.
+ * A value of zero means that execute yields rows one at a time.
+ */
+int
+getBatchSize(PyObject *fdw_instance)
+{
+	return getIntAttribute(fdw_instance, "_batch_size");
+}
+
+/*
+ * Get the number of rows given at once to the bulk modification methods.
+ * A value lower than two means that rows are modified one at a time.
+ */
+int
+getModifyBatchSize(PyObject *fdw_instance)
+{
+	return getIntAttribute(fdw_instance, "_modify_batch_size");
+}
@@ -23,6 +23,10 @@ void extractClauseFromScalarArrayOpExpr(Relids base_relids,
 								   ScalarArrayOpExpr *node,
 								   List **quals);
 
+void extractClauseFromBoolExpr(Relids base_relids,
+						  BoolExpr *node,
+						  List **quals);
+
 char	   *getOperatorString(Oid opoid);
 
 MulticornBaseQual *makeQual(AttrNumber varattno, char *opname, Expr *value,
@@ -114,6 +118,7 @@ initConversioninfo(ConversionInfo ** cinfos, AttInMetadata *attinmeta)
 			cinfo->attnum = i + 1;
 			cinfo->attndims = attr->attndims;
 			cinfo->need_quote = false;
+			cinfo->pytodatum = getNativeConverter(attr->atttypid);
 			cinfos[i] = cinfo;
 		}
 		else
@@ -304,6 +309,10 @@ extractRestrictions(Relids base_relids,
 											   (ScalarArrayOpExpr *) node,
 											   quals);
 			break;
+		case T_BoolExpr:
+			extractClauseFromBoolExpr(base_relids,
+									  (BoolExpr *) node, quals);
+			break;
 		default:
 			{
 				ereport(WARNING,
@@ -377,6 +386,53 @@ extractClauseFromScalarArrayOpExpr(Relids base_relids,
 }
 
 
+/*
+ *	Convert a "BoolExpr" (AND, OR, NOT) to a tree of quals.
+ *
+ *	Every argument must be converted to exactly one qual: dropping a branch
+ *	of an OR, or anything below a NOT, would make the tree more restrictive
+ *	than the original clause. If any argument cannot be pushed down, the
+ *	whole expression is left to postgresql.
+ */
+void
+extractClauseFromBoolExpr(Relids base_relids,
+						  BoolExpr *node,
+						  List **quals)
+{
+	MulticornBoolQual *result;
+	List	   *args = NIL;
+	ListCell   *lc;
+
+	foreach(lc, node->args)
+	{
+		Expr	   *arg = (Expr *) lfirst(lc);
+		int			nbquals = list_length(args);
+
+		switch (nodeTag(arg))
+		{
+			case T_OpExpr:
+			case T_NullTest:
+			case T_ScalarArrayOpExpr:
+			case T_BoolExpr:
+				extractRestrictions(base_relids, arg, &args);
+				break;
+			default:
+				break;
+		}
+		if (list_length(args) != nbquals + 1)
+		{
+			return;
+		}
+	}
+	result = palloc0(sizeof(MulticornBoolQual));
+	result->base.right_type = T_BoolExpr;
+	result->base.typeoid = InvalidOid;
+	result->boolop = node->boolop;
+	result->args = args;
+	*quals = lappend(*quals, result);
+}
+
+
 /*
  *	Convert a "NullTest" (IS NULL, or IS NOT NULL)
  *	to a suitable intermediate representation.
@@ -568,7 +624,7 @@ void computeDeparsedSortGroup(List *deparsed, MulticornPlanState *planstate,
 
 List *
 findPaths(PlannerInfo *root, RelOptInfo *baserel, List *possiblePaths,
-		int startupCost,
+		Cost startupCost,
 		MulticornPlanState *state,
 		List *apply_pathkeys, List *deparsed_pathkeys)
 {
@@ -641,6 +697,8 @@ findPaths(PlannerInfo *root, RelOptInfo *baserel, List *possiblePaths,
 										 bms_make_singleton(baserel->relid));
 			ParamPathInfo *ppi;
 			ForeignPath *foreignPath;
+			Cost		path_startup_cost = startupCost;
+			Cost		path_total_cost = scanTotalCost(state, nbrows);
 
 			if (!bms_is_empty(req_outer))
 			{
@@ -648,12 +706,19 @@ findPaths(PlannerInfo *root, RelOptInfo *baserel, List *possiblePaths,
 				ppi->ppi_req_outer = req_outer;
 				ppi->ppi_rows = nbrows;
 				ppi->ppi_clauses = list_concat(ppi->ppi_clauses, allclauses);
+				/* The python fdw may have given the costs of the path */
+				if (list_length(item) == 4)
+				{
+					path_startup_cost = DatumGetFloat8(((Const *) lthird(item))->constvalue);
+					path_total_cost = DatumGetFloat8(((Const *) lfourth(item))->constvalue) +
+						nbrows * state->localQualCost;
+				}
 				/* Add a simple parameterized path */
 				foreignPath = create_foreignscan_path(
 													  root, baserel,
 													  nbrows,
-													  startupCost,
-													  nbrows * baserel->width,
+													  path_startup_cost,
+													  path_total_cost,
 													  NIL, /* no pathkeys */
 													  NULL,
 #if PG_VERSION_NUM >= 90500
@@ -669,6 +734,24 @@ findPaths(PlannerInfo *root, RelOptInfo *baserel, List *possiblePaths,
 	return result;
 }
 
+/*
+ * Returns the total cost of a scan returning the given number of rows.
+ *
+ * If the python fdw did not give any cost, the cost of a row is its width,
+ * and the startup cost is not accounted for in the total cost.
+ */
+Cost
+scanTotalCost(MulticornPlanState *state, double rows)
+{
+	Cost		total_cost = rows * (state->perRowCost + state->localQualCost);
+
+	if (state->fdwCosts)
+	{
+		total_cost += state->startupCost;
+	}
+	return total_cost;
+}
+
 /*
  * Deparse a list of PathKey and return a list of MulticornDeparsedSortGroup.
  * This function will return data iif all the PathKey belong to the current
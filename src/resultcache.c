@@ -0,0 +1,449 @@
+/*-------------------------------------------------------------------------
+ *
+ * The Multicorn Foreign Data Wrapper allows you to fetch foreign data in
+ * Python in your PostgreSQL server.
+ *
+ * This module memoizes the rows returned by a scan depending on parameters,
+ * typically the inner side of a nested loop, by the values of those
+ * parameters. A repeated execution is then served from the cache, without
+ * calling the python fdw. The least recently used results are evicted once
+ * the memory given by the result_cache_size option is used.
+ *
+ * This software is released under the postgresql licence
+ *
+ * author: Kozea
+ *
+ *
+ *-------------------------------------------------------------------------
+ */
+#include "multicorn.h"
+#include "nodes/nodeFuncs.h"
+#include "utils/lsyscache.h"
+#include "utils/memutils.h"
+#include "access/hash.h"
+#if PG_VERSION_NUM >= 90300
+#include "access/htup_details.h"
+#endif
+
+/* A parameterized qual, whose value is part of the key of the results */
+typedef struct MulticornCacheParam
+{
+	MulticornParamQual *qual;
+	int16		typlen;
+	bool		typbyval;
+}	MulticornCacheParam;
+
+/* The rows returned by an execution of the scan */
+typedef struct MulticornCachedResult
+{
+	char	   *key;
+	Size		keylen;
+	uint32		hash;
+	HeapTuple  *tuples;
+	int			ntuples;
+	int			maxtuples;
+	Size		size;
+	/* Next result with the same hash value */
+	struct MulticornCachedResult *next;
+	/* Neighbours in the least recently used list */
+	struct MulticornCachedResult *lru_prev;
+	struct MulticornCachedResult *lru_next;
+}	MulticornCachedResult;
+
+typedef struct MulticornResultBucket
+{
+	uint32		hash;
+	MulticornCachedResult *results;
+}	MulticornResultBucket;
+
+typedef struct MulticornResultCache
+{
+	MemoryContext context;
+	HTAB	   *buckets;
+	TupleDesc	desc;
+	List	   *params;
+	/* Least recently used result first */
+	MulticornCachedResult *lru_head;
+	MulticornCachedResult *lru_tail;
+	Size		size;
+	Size		max_size;
+	/* Result filled by the current execution, or returned from the cache */
+	MulticornCachedResult *filling;
+	MulticornCachedResult *replaying;
+	int			replay_index;
+	/* Statistics shown by EXPLAIN ANALYZE */
+	long		hits;
+	long		misses;
+	long		evictions;
+}	MulticornResultCache;
+
+static void collectParams(List *quals, List **params);
+static void computeKey(ForeignScanState *node, MulticornResultCache * cache,
+		   StringInfo key);
+static void lruRemove(MulticornResultCache * cache,
+		  MulticornCachedResult * result);
+static void lruAppend(MulticornResultCache * cache,
+		  MulticornCachedResult * result);
+static void evictResult(MulticornResultCache * cache);
+static void freeResult(MulticornCachedResult * result);
+
+
+/*
+ * Create the result cache of a scan, with a maximum size in kB. Returns NULL
+ * if the scan does not depend on any parameter.
+ */
+MulticornResultCache *
+createResultCache(ForeignScanState *node, List *qual_list, int size)
+{
+	MulticornResultCache *cache;
+	List	   *params = NIL;
+	HASHCTL		ctl;
+
+	collectParams(qual_list, &params);
+	if (params == NIL)
+	{
+		return NULL;
+	}
+	cache = palloc0(sizeof(MulticornResultCache));
+	cache->params = params;
+	cache->desc = node->ss.ss_ScanTupleSlot->tts_tupleDescriptor;
+	cache->max_size = (Size) size * 1024;
+	cache->context = AllocSetContextCreate(CurrentMemoryContext,
+										   "multicorn result cache",
+										   ALLOCSET_DEFAULT_MINSIZE,
+										   ALLOCSET_DEFAULT_INITSIZE,
+										   ALLOCSET_DEFAULT_MAXSIZE);
+	MemSet(&ctl, 0, sizeof(ctl));
+	ctl.keysize = sizeof(uint32);
+	ctl.entrysize = sizeof(MulticornResultBucket);
+	ctl.hash = oid_hash;
+	ctl.hcxt = cache->context;
+	cache->buckets = hash_create("multicorn result cache", 256, &ctl,
+								 HASH_ELEM | HASH_FUNCTION | HASH_CONTEXT);
+	return cache;
+}
+
+/*
+ * Collect the parameterized quals of a list of quals, including the ones
+ * nested in boolean expressions.
+ */
+static void
+collectParams(List *quals, List **params)
+{
+	ListCell   *lc;
+
+	foreach(lc, quals)
+	{
+		MulticornBaseQual *qual = lfirst(lc);
+
+		if (qual->right_type == T_Param)
+		{
+			MulticornCacheParam *param = palloc0(sizeof(MulticornCacheParam));
+
+			param->qual = (MulticornParamQual *) qual;
+			get_typlenbyval(exprType((Node *) param->qual->expr),
+							&param->typlen, &param->typbyval);
+			*params = lappend(*params, param);
+		}
+		else if (qual->right_type == T_BoolExpr)
+		{
+			collectParams(((MulticornBoolQual *) qual)->args, params);
+		}
+	}
+}
+
+/*
+ * Build the key of the current execution, from the binary representation of
+ * the values of the parameters.
+ */
+static void
+computeKey(ForeignScanState *node, MulticornResultCache * cache,
+		   StringInfo key)
+{
+	ListCell   *lc;
+
+	foreach(lc, cache->params)
+	{
+		MulticornCacheParam *param = lfirst(lc);
+		bool		isnull;
+		Datum		value = evaluateParamQual(node, param->qual, &isnull);
+
+		appendStringInfoChar(key, isnull ? 'n' : 'v');
+		if (isnull)
+		{
+			continue;
+		}
+		if (param->typbyval)
+		{
+			appendBinaryStringInfo(key, (char *) &value, sizeof(Datum));
+		}
+		else if (param->typlen == -1)
+		{
+			struct varlena *varlena = pg_detoast_datum_packed((struct varlena *) DatumGetPointer(value));
+			uint32		length = VARSIZE_ANY_EXHDR(varlena);
+
+			appendBinaryStringInfo(key, (char *) &length, sizeof(uint32));
+			appendBinaryStringInfo(key, VARDATA_ANY(varlena), length);
+		}
+		else if (param->typlen == -2)
+		{
+			char	   *cstring = DatumGetCString(value);
+
+			appendBinaryStringInfo(key, cstring, strlen(cstring) + 1);
+		}
+		else
+		{
+			appendBinaryStringInfo(key, DatumGetPointer(value), param->typlen);
+		}
+	}
+}
+
+/*
+ * Look for the rows of an execution with the current parameter values. If
+ * they are found, they are returned by resultCacheNext. Otherwise, the rows
+ * of the execution are collected by resultCacheStore.
+ */
+bool
+resultCacheLookup(ForeignScanState *node, MulticornResultCache * cache)
+{
+	StringInfo	key = makeStringInfo();
+	uint32		hash;
+	MulticornResultBucket *bucket;
+	MulticornCachedResult *result;
+	MemoryContext oldContext;
+
+	computeKey(node, cache, key);
+	hash = DatumGetUInt32(hash_any((unsigned char *) key->data, key->len));
+	bucket = hash_search(cache->buckets, &hash, HASH_FIND, NULL);
+	for (result = bucket ? bucket->results : NULL; result; result = result->next)
+	{
+		if (result->keylen == key->len &&
+			memcmp(result->key, key->data, key->len) == 0)
+		{
+			cache->hits++;
+			lruRemove(cache, result);
+			lruAppend(cache, result);
+			cache->replaying = result;
+			cache->replay_index = 0;
+			return true;
+		}
+	}
+	cache->misses++;
+	oldContext = MemoryContextSwitchTo(cache->context);
+	result = palloc0(sizeof(MulticornCachedResult));
+	result->key = palloc(key->len);
+	memcpy(result->key, key->data, key->len);
+	result->keylen = key->len;
+	result->hash = hash;
+	result->maxtuples = 16;
+	result->tuples = palloc(sizeof(HeapTuple) * result->maxtuples);
+	result->size = sizeof(MulticornCachedResult) + key->len +
+		sizeof(HeapTuple) * result->maxtuples;
+	MemoryContextSwitchTo(oldContext);
+	cache->filling = result;
+	return false;
+}
+
+/*
+ * Store the next cached row in the slot, if the rows of the current
+ * execution come from the cache. The slot is left empty at the end of the
+ * rows.
+ */
+bool
+resultCacheNext(MulticornResultCache * cache, TupleTableSlot *slot)
+{
+	MulticornCachedResult *result = cache->replaying;
+
+	if (result == NULL)
+	{
+		return false;
+	}
+	if (cache->replay_index < result->ntuples)
+	{
+		heap_deform_tuple(result->tuples[cache->replay_index++], cache->desc,
+						  slot->tts_values, slot->tts_isnull);
+		ExecStoreVirtualTuple(slot);
+	}
+	return true;
+}
+
+/*
+ * Add the row stored in the slot to the result of the current execution.
+ * The result is given up if it does not fit in the cache.
+ */
+void
+resultCacheStore(MulticornResultCache * cache, TupleTableSlot *slot)
+{
+	MulticornCachedResult *result = cache->filling;
+	MemoryContext oldContext;
+	HeapTuple	tuple;
+
+	if (result == NULL)
+	{
+		return;
+	}
+	oldContext = MemoryContextSwitchTo(cache->context);
+	if (result->ntuples == result->maxtuples)
+	{
+		result->size += sizeof(HeapTuple) * result->maxtuples;
+		result->maxtuples *= 2;
+		result->tuples = repalloc(result->tuples,
+								  sizeof(HeapTuple) * result->maxtuples);
+	}
+	tuple = heap_form_tuple(cache->desc, slot->tts_values, slot->tts_isnull);
+	result->tuples[result->ntuples++] = tuple;
+	result->size += HEAPTUPLESIZE + tuple->t_len;
+	MemoryContextSwitchTo(oldContext);
+	if (result->size > cache->max_size)
+	{
+		freeResult(result);
+		cache->filling = NULL;
+	}
+}
+
+/*
+ * Add the result of the current execution to the cache, once every row has
+ * been returned, evicting the least recently used results to make room.
+ */
+void
+resultCacheFinish(MulticornResultCache * cache)
+{
+	MulticornCachedResult *result = cache->filling;
+	MulticornResultBucket *bucket;
+	bool		found;
+
+	if (result == NULL)
+	{
+		return;
+	}
+	cache->filling = NULL;
+	while (cache->lru_head != NULL &&
+		   cache->size + result->size > cache->max_size)
+	{
+		evictResult(cache);
+	}
+	bucket = hash_search(cache->buckets, &result->hash, HASH_ENTER, &found);
+	if (!found)
+	{
+		bucket->results = NULL;
+	}
+	result->next = bucket->results;
+	bucket->results = result;
+	lruAppend(cache, result);
+	cache->size += result->size;
+}
+
+/*
+ * Forget the current execution, when the scan is restarted. A result which
+ * was not complete is given up.
+ */
+void
+resultCacheReset(MulticornResultCache * cache)
+{
+	if (cache->filling != NULL)
+	{
+		freeResult(cache->filling);
+		cache->filling = NULL;
+	}
+	cache->replaying = NULL;
+}
+
+/*
+ * Show the statistics of the cache in EXPLAIN ANALYZE.
+ */
+void
+explainResultCache(MulticornResultCache * cache, ExplainState *es)
+{
+	StringInfo	buffer;
+	long		lookups = cache->hits + cache->misses;
+
+	if (!es->analyze)
+	{
+		return;
+	}
+	buffer = makeStringInfo();
+	appendStringInfo(buffer, "%ld hits, %ld misses, %ld evictions",
+					 cache->hits, cache->misses, cache->evictions);
+	if (lookups > 0)
+	{
+		appendStringInfo(buffer, ", hit ratio %.1f%%",
+						 100.0 * cache->hits / lookups);
+	}
+	ExplainPropertyText("Result Cache", buffer->data, es);
+}
+
+static void
+lruRemove(MulticornResultCache * cache, MulticornCachedResult * result)
+{
+	if (result->lru_prev != NULL)
+	{
+		result->lru_prev->lru_next = result->lru_next;
+	}
+	else
+	{
+		cache->lru_head = result->lru_next;
+	}
+	if (result->lru_next != NULL)
+	{
+		result->lru_next->lru_prev = result->lru_prev;
+	}
+	else
+	{
+		cache->lru_tail = result->lru_prev;
+	}
+	result->lru_prev = NULL;
+	result->lru_next = NULL;
+}
+
+static void
+lruAppend(MulticornResultCache * cache, MulticornCachedResult * result)
+{
+	result->lru_prev = cache->lru_tail;
+	result->lru_next = NULL;
+	if (cache->lru_tail != NULL)
+	{
+		cache->lru_tail->lru_next = result;
+	}
+	else
+	{
+		cache->lru_head = result;
+	}
+	cache->lru_tail = result;
+}
+
+/*
+ * Remove the least recently used result from the cache.
+ */
+static void
+evictResult(MulticornResultCache * cache)
+{
+	MulticornCachedResult *result = cache->lru_head,
+			  **link;
+	MulticornResultBucket *bucket;
+
+	lruRemove(cache, result);
+	bucket = hash_search(cache->buckets, &result->hash, HASH_FIND, NULL);
+	for (link = &bucket->results; *link != result; link = &(*link)->next);
+	*link = result->next;
+	if (bucket->results == NULL)
+	{
+		hash_search(cache->buckets, &result->hash, HASH_REMOVE, NULL);
+	}
+	cache->size -= result->size;
+	cache->evictions++;
+	freeResult(result);
+}
+
+static void
+freeResult(MulticornCachedResult * result)
+{
+	int			i;
+
+	for (i = 0; i < result->ntuples; i++)
+	{
+		heap_freetuple(result->tuples[i]);
+	}
+	pfree(result->tuples);
+	pfree(result->key);
+	pfree(result);
+}
@@ -0,0 +1,34 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn_join1 (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    test_type 'join'
+);
+CREATE foreign table testmulticorn_join2 (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    test_type 'join'
+);
+
+-- The join is computed by the wrapper
+SELECT a.test1, b.test2 FROM testmulticorn_join1 a
+JOIN testmulticorn_join2 b ON a.test1 = b.test1;
+
+-- Left join, without any match
+SELECT b.test1, a.test1 FROM testmulticorn_join1 a
+LEFT JOIN testmulticorn_join2 b ON a.test1 = b.test2;
+
+-- The quals are given to the wrapper, and rechecked
+SELECT a.test1, b.test2 FROM testmulticorn_join1 a
+JOIN testmulticorn_join2 b ON b.test1 = a.test1 WHERE a.test2 LIKE '%3';
+
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
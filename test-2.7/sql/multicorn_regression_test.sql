@@ -85,6 +85,24 @@ select * from testmulticorn limit 1;
 
 select * from testmulticorn where test1 = 0;
 
+-- Test conversions of qual values
+ALTER FOREIGN TABLE testmulticorn alter test1 type bigint;
+
+select * from testmulticorn where test1 = ANY(ARRAY[1, 3]);
+
+ALTER FOREIGN TABLE testmulticorn alter test1 type double precision;
+
+select * from testmulticorn where test1 < 1.5;
+
+ALTER FOREIGN TABLE testmulticorn alter test1 type numeric;
+
+select * from testmulticorn where test1 < 1.50;
+
+ALTER FOREIGN TABLE testmulticorn options (set test_type 'date');
+ALTER FOREIGN TABLE testmulticorn alter test1 type timestamptz;
+
+select count(*) from testmulticorn where test1 = '2011-01-01 14:30:26+00';
+
 ALTER FOREIGN TABLE testmulticorn options (drop test_type);
 
 -- Test operations with bytea
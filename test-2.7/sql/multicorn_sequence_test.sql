@@ -47,5 +47,27 @@ CREATE foreign table testmulticorn2 (
 );
 
 select * from testmulticorn union all select * from testmulticorn2;
+
+CREATE foreign table testmulticorn3 (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'namedtuple'
+);
+
+-- Test namedtuples, with some None values
+select * from testmulticorn3;
+
+CREATE foreign table testmulticorn4 (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'sparse'
+);
+
+-- Test dicts with missing keys
+select * from testmulticorn4;
 DROP USER MAPPING FOR postgres SERVER multicorn_srv;
 DROP EXTENSION multicorn cascade;
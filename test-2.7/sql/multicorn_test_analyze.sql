@@ -0,0 +1,23 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option1'
+);
+
+-- The sample returned by the fdw is used for the statistics
+ANALYZE testmulticorn;
+
+SELECT reltuples, relpages FROM pg_class WHERE relname = 'testmulticorn';
+
+SELECT attname, n_distinct FROM pg_stats WHERE tablename = 'testmulticorn' ORDER BY attname;
+
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
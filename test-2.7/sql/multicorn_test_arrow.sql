@@ -0,0 +1,30 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 character varying,
+    test2 timestamp
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'arrow'
+);
+
+-- Rows are read from an Arrow record batch
+select * from testmulticorn;
+
+-- Strings must be valid UTF-8
+ALTER FOREIGN TABLE testmulticorn options (set test_type 'arrow_encoding');
+
+select * from testmulticorn;
+
+-- Timestamps must be in the PostgreSQL range
+ALTER FOREIGN TABLE testmulticorn options (set test_type 'arrow_overflow');
+
+select * from testmulticorn;
+
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,37 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'batch'
+);
+
+-- Rows are yielded by blocks of 7 rows
+select * from testmulticorn;
+
+select test1 from testmulticorn where test1 like '%1';
+
+select count(*) from testmulticorn;
+
+CREATE foreign table testcolumns (
+    test1 integer,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'columns'
+);
+
+-- Rows are yielded by blocks of columns, integers come from an array
+select * from testcolumns;
+
+select test2 from testcolumns where test1 > 15;
+
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
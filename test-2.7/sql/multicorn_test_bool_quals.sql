@@ -0,0 +1,33 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option1'
+);
+CREATE foreign table testmulticorn_bool (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    test_type 'bool'
+);
+
+-- Boolean expressions are not given to the wrappers by default
+SELECT * FROM testmulticorn WHERE test1 = 'test1 1 0' OR test2 = 'test2 1 1';
+
+-- Wrappers accepting them get a BoolQual
+SELECT * FROM testmulticorn_bool WHERE test1 = 'test1 1 0' OR test2 = 'test2 1 1';
+
+SELECT * FROM testmulticorn_bool WHERE test1 = 'test1 1 0' OR (test1 = 'test1 3 1' AND test2 LIKE '%1');
+
+-- An expression is only pushed down if all its parts are
+SELECT * FROM testmulticorn_bool WHERE test1 LIKE '%1' AND (test1 = 'test1 3 1' OR test2 IS DISTINCT FROM 'test2 1 1');
+
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,22 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn_cost (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    test_type 'cost'
+);
+
+-- The startup and per-row costs come from get_rel_size
+EXPLAIN SELECT * FROM testmulticorn_cost;
+
+-- Sorting on the remote side is more expensive than sorting locally
+EXPLAIN (COSTS OFF) SELECT * FROM testmulticorn_cost ORDER BY test1;
+
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
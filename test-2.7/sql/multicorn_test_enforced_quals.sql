@@ -0,0 +1,27 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn_enforce (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    test_type 'enforce'
+);
+
+-- Enforced quals are not rechecked
+EXPLAIN (COSTS OFF) SELECT * FROM testmulticorn_enforce WHERE test1 = 'test1 1 0';
+
+SELECT * FROM testmulticorn_enforce WHERE test1 = 'test1 1 0';
+
+-- Other quals are
+EXPLAIN (COSTS OFF) SELECT * FROM testmulticorn_enforce WHERE test1 LIKE 'test1 1%';
+
+-- The limit can be pushed down when every qual is enforced
+SELECT * FROM testmulticorn_enforce WHERE test2 = 'test2 3 2' LIMIT 1;
+
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
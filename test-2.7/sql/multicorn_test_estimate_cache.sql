@@ -0,0 +1,30 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn_estimate (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    test_type 'estimate',
+    estimate_cache_ttl '3600'
+);
+
+-- The estimates are computed once per qual shape
+EXPLAIN (COSTS OFF) SELECT * FROM testmulticorn_estimate WHERE test1 = 'a';
+EXPLAIN (COSTS OFF) SELECT * FROM testmulticorn_estimate WHERE test1 = 'b';
+EXPLAIN (COSTS OFF) SELECT * FROM testmulticorn_estimate WHERE test1 > 'b';
+
+-- Changing the options of the table invalidates the cache
+ALTER FOREIGN TABLE testmulticorn_estimate OPTIONS (SET estimate_cache_ttl '0');
+EXPLAIN (COSTS OFF) SELECT * FROM testmulticorn_estimate WHERE test1 = 'a';
+EXPLAIN (COSTS OFF) SELECT * FROM testmulticorn_estimate WHERE test1 = 'a';
+
+-- The ttl must be a number of seconds
+ALTER FOREIGN TABLE testmulticorn_estimate OPTIONS (SET estimate_cache_ttl 'forever');
+
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
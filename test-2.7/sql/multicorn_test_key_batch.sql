@@ -0,0 +1,44 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn_key_batch (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option1',
+    key_batch_size '2'
+);
+
+CREATE TABLE local_keys (key character varying);
+INSERT INTO local_keys VALUES ('test1 1 0'), ('test1 3 1'), ('test1 1 0'),
+    (NULL), ('test1 2 2');
+ANALYZE local_keys;
+
+-- Leave the batched join as the only way to join the tables
+SET enable_hashjoin = off;
+SET enable_mergejoin = off;
+SET enable_nestloop = off;
+
+-- The inner foreign table is scanned by the batched join
+EXPLAIN (COSTS OFF) SELECT l.key, m.test2 FROM local_keys l
+JOIN testmulticorn_key_batch m ON m.test1 = l.key;
+
+-- The keys of two outer rows are looked up in a single execute
+SELECT l.key, m.test2 FROM local_keys l
+JOIN testmulticorn_key_batch m ON m.test1 = l.key;
+
+-- The outer rows without a match are kept by a left join
+SELECT l.key, m.test2 FROM local_keys l
+LEFT JOIN testmulticorn_key_batch m ON m.test1 = l.key;
+
+RESET enable_hashjoin;
+RESET enable_mergejoin;
+RESET enable_nestloop;
+
+DROP TABLE local_keys;
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
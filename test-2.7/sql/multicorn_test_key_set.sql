@@ -0,0 +1,29 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn_key_set (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    test_type 'keyset'
+);
+
+CREATE TABLE local_keys (key character varying);
+INSERT INTO local_keys VALUES ('test1 1 0'), ('test1 3 1'), (NULL);
+
+-- The keys are also given as a set, to drop the rows before returning them
+SELECT * FROM testmulticorn_key_set
+WHERE test1 = ANY(ARRAY(SELECT key FROM local_keys));
+
+-- Other list quals are plain quals
+SELECT * FROM testmulticorn_key_set
+WHERE test1 <> ALL(ARRAY(SELECT key FROM local_keys WHERE key IS NOT NULL))
+LIMIT 1;
+
+DROP TABLE local_keys;
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,23 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn_rescan (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    test_type 'rescan'
+);
+
+CREATE TABLE local_keys (key character varying);
+INSERT INTO local_keys VALUES ('test1 1 0'), ('test1 3 1');
+
+-- The inner scan of the nested loop is restarted with the changed quals only
+SELECT m.* FROM local_keys l JOIN testmulticorn_rescan m ON m.test1 = l.key;
+
+DROP TABLE local_keys;
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
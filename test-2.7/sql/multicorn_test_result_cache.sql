@@ -0,0 +1,44 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping for postgres server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn_result_cache (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    test_type 'rescan',
+    result_cache_size '1024'
+);
+
+CREATE TABLE local_keys (key character varying);
+INSERT INTO local_keys VALUES ('test1 1 0'), ('test1 3 1'), ('test1 1 0');
+
+-- The third execution of the inner scan is served from the cache
+SELECT m.* FROM local_keys l JOIN testmulticorn_result_cache m ON m.test1 = l.key;
+
+CREATE FUNCTION result_cache_stats(query text) RETURNS SETOF text AS $$
+DECLARE
+    line text;
+BEGIN
+    FOR line IN EXECUTE 'EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF) ' || query LOOP
+        IF line LIKE '%Result Cache%' THEN
+            RETURN NEXT trim(line);
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SET client_min_messages=WARNING;
+SELECT result_cache_stats('SELECT m.* FROM local_keys l JOIN testmulticorn_result_cache m ON m.test1 = l.key');
+SET client_min_messages=NOTICE;
+
+-- Invalid sizes are rejected
+ALTER FOREIGN TABLE testmulticorn_result_cache OPTIONS (SET result_cache_size 'big');
+
+DROP FUNCTION result_cache_stats(text);
+DROP TABLE local_keys;
+DROP USER MAPPING FOR postgres SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
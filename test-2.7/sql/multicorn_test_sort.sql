@@ -19,5 +19,21 @@ EXPLAIN SELECT * FROM testmulticorn ORDER BY test1 DESC;
 -- Data should be sorted
 SELECT * FROM testmulticorn ORDER BY test1 DESC;
 
+CREATE foreign table testmulticorn_limit (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    test_type 'limit'
+);
+
+-- Test limit pushdown, the offset is still applied locally
+SELECT * FROM testmulticorn_limit LIMIT 3 OFFSET 2;
+
+-- The limit is pushed after the sort
+SELECT * FROM testmulticorn_limit ORDER BY test1 DESC LIMIT 3;
+
+-- The limit cannot be pushed with local filters
+SELECT * FROM testmulticorn_limit WHERE test2 LIKE '%3' LIMIT 2;
+
 DROP USER MAPPING FOR postgres SERVER multicorn_srv;
 DROP EXTENSION multicorn cascade;
@@ -88,5 +88,18 @@ CREATE foreign table testmulticorn_write(
 	test_type 'date'
 );
 delete from testmulticorn_write;
+DROP foreign table testmulticorn_write;
+-- Test bulk inserts
+CREATE foreign table testmulticorn_write(
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'bulk'
+);
+insert into testmulticorn_write(test1, test2) VALUES ('a', 'b'), ('c', 'd'), ('e', 'f');
+insert into testmulticorn_write(test1, test2) VALUES ('g', 'h') RETURNING test1;
+update testmulticorn_write set test2 = 'test' where test1 ilike 'test1 3%';
+delete from testmulticorn_write where test1 ilike 'test1 1%';
 DROP USER MAPPING for postgres SERVER multicorn_srv;
 DROP EXTENSION multicorn cascade;
@@ -0,0 +1 @@
+../../test-2.7/sql/multicorn_join_test.sql
\ No newline at end of file
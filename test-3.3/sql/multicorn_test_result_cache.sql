@@ -0,0 +1 @@
+../../test-2.7/sql/multicorn_test_result_cache.sql
\ No newline at end of file